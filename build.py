@@ -94,13 +94,23 @@ def build_app():
         "uvicorn.protocols.http",
         "uvicorn.protocols.http.auto",
         "uvicorn.protocols.http.h11_impl",
+        "uvicorn.protocols.http.httptools_impl",
+        "uvicorn.loops.auto",
+        "uvicorn.loops.uvloop",
         "uvicorn.protocols.websockets",
         "uvicorn.protocols.websockets.auto",
         "uvicorn.lifespan",
         "uvicorn.lifespan.on",
         "httpx",
+        "orjson",
+        "tiktoken",
+        "tiktoken_ext",
+        "tiktoken_ext.openai_public",
         "httpx._transports",
         "httpx._transports.default",
+        "h2",
+        "hpack",
+        "hyperframe",
         "anyio",
         "anyio._backends",
         "anyio._backends._asyncio",
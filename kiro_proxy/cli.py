@@ -85,7 +85,7 @@ def cmd_accounts_import(args):
             token_path=file_path,
             enabled=acc_data.get("enabled", True)
         )
-        state.accounts.append(account)
+        state.add_account(account)
         account.load_credentials()
         imported += 1
         print(f"已导入: {account.name}")
@@ -127,7 +127,7 @@ def cmd_accounts_add(args):
         name=name,
         token_path=file_path
     )
-    state.accounts.append(account)
+    state.add_account(account)
     account.load_credentials()
     state._save_accounts()
     
@@ -173,7 +173,7 @@ def cmd_accounts_scan(args):
                     name=t["name"],
                     token_path=t["path"]
                 )
-                state.accounts.append(account)
+                state.add_account(account)
                 account.load_credentials()
                 added += 1
         state._save_accounts()
@@ -250,7 +250,7 @@ def cmd_login_social(args):
                 name=f"{provider.title()} 登录",
                 token_path=file_path
             )
-            state.accounts.append(account)
+            state.add_account(account)
             account.load_credentials()
             state._save_accounts()
             
@@ -1,10 +1,16 @@
 """配置模块"""
+import os
+from functools import lru_cache
 from pathlib import Path
 
 KIRO_API_URL = "https://q.us-east-1.amazonaws.com/generateAssistantResponse"
 MODELS_URL = "https://q.us-east-1.amazonaws.com/ListAvailableModels"
 TOKEN_PATH = Path.home() / ".aws/sso/cache/kiro-auth-token.json"
 
+# 调试输出：打印请求结构、400 错误时的请求细节、保存完整请求到 debug_requests/
+# （默认关闭，设置环境变量 KIRO_DEBUG_REQUESTS=1 开启）
+DEBUG_REQUESTS = os.environ.get("KIRO_DEBUG_REQUESTS", "").lower() in ("1", "true", "yes")
+
 # 配额管理配置
 QUOTA_COOLDOWN_SECONDS = 300  # 配额超限冷却时间（秒）
 
@@ -50,6 +56,7 @@ KIRO_MODELS = {"auto", "claude-sonnet-4.5", "claude-sonnet-4", "claude-haiku-4.5
 # 流式模式前缀
 FAKE_STREAM_PREFIX = "假流式/"
 
+@lru_cache(maxsize=256)
 def parse_stream_mode(model: str) -> tuple[str, bool]:
     """解析模型名称，返回 (实际模型名, 是否伪流式)
     
@@ -61,19 +68,37 @@ def parse_stream_mode(model: str) -> tuple[str, bool]:
         return model[len(FAKE_STREAM_PREFIX):], True
     return model, False
 
-def map_model_name(model: str) -> str:
-    """将外部模型名称映射到 Kiro 支持的名称"""
-    if not model:
-        return "claude-sonnet-4"
-    if model in MODEL_MAPPING:
-        return MODEL_MAPPING[model]
-    if model in KIRO_MODELS:
-        return model
+# 模型名解析缓存：预置映射表和 Kiro 原生模型，未命中时按关键字解析后写入
+_MODEL_CACHE: dict[str, str] = {**{m: m for m in KIRO_MODELS}, **MODEL_MAPPING}
+_MODEL_CACHE_MAX = 512
+
+# 关键字回退表（按顺序匹配）
+_MODEL_KEYWORDS = (
+    ("opus", "claude-opus-4.5"),
+    ("haiku", "claude-haiku-4.5"),
+)
+
+
+def _resolve_model_name(model: str) -> str:
+    """按关键字解析未知模型名"""
     model_lower = model.lower()
-    if "opus" in model_lower:
-        return "claude-opus-4.5"
-    if "haiku" in model_lower:
-        return "claude-haiku-4.5"
+    for keyword, target in _MODEL_KEYWORDS:
+        if keyword in model_lower:
+            return target
     if "sonnet" in model_lower:
         return "claude-sonnet-4.5" if "4.5" in model_lower else "claude-sonnet-4"
     return "claude-sonnet-4"
+
+
+def map_model_name(model: str) -> str:
+    """将外部模型名称映射到 Kiro 支持的名称"""
+    if not model:
+        return "claude-sonnet-4"
+    cached = _MODEL_CACHE.get(model)
+    if cached is not None:
+        return cached
+    result = _resolve_model_name(model)
+    # 模型名来自客户端，限制缓存大小
+    if len(_MODEL_CACHE) < _MODEL_CACHE_MAX:
+        _MODEL_CACHE[model] = result
+    return result
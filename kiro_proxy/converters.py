@@ -9,20 +9,103 @@
 - web_search 特殊工具支持
 - tool_results 去重
 """
-import json
 import hashlib
-import re
 from typing import List, Dict, Any, Tuple, Optional
 
+from . import jsonutil
+
 # 常量
 MAX_TOOLS = 50
 MAX_TOOL_DESCRIPTION_LENGTH = 500
+# 会话哈希时每段内容最多参与的字符/字节数
+SESSION_HASH_PREFIX = 4096
+# 会话哈希时每条消息最多参与的内容块数
+SESSION_HASH_MAX_BLOCKS = 8
+# 图片 MIME 子类型 -> Kiro 图片格式（未知类型按 jpeg 处理）
+IMAGE_FORMATS = {"jpeg": "jpeg", "jpg": "jpeg", "png": "png", "gif": "gif", "webp": "webp"}
+
+
+def _truncate_strings(obj):
+    """截断嵌套结构中的长字符串（如 base64 图片），避免序列化整段数据"""
+    if isinstance(obj, str):
+        return obj[:SESSION_HASH_PREFIX]
+    if isinstance(obj, dict):
+        return {k: _truncate_strings(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_truncate_strings(v) for v in obj]
+    return obj
+
+
+def _hash_session_content(h, content):
+    """把消息内容的有界前缀写入哈希"""
+    if isinstance(content, str):
+        h.update(content[:SESSION_HASH_PREFIX].encode())
+    elif isinstance(content, list):
+        for block in content[:SESSION_HASH_MAX_BLOCKS]:
+            text = block.get("text") if isinstance(block, dict) else None
+            if isinstance(text, str):
+                h.update(text[:SESSION_HASH_PREFIX].encode())
+            else:
+                h.update(jsonutil.dumps_bytes(_truncate_strings(block)))
+            h.update(b"\x00")
+    else:
+        h.update(jsonutil.dumps_bytes(_truncate_strings(content)))
 
 
 def generate_session_id(messages: list) -> str:
-    """基于消息内容生成会话ID"""
-    content = json.dumps(messages[:3], sort_keys=True)
-    return hashlib.sha256(content.encode()).hexdigest()[:16]
+    """基于前 3 条消息的 role + content 生成会话ID（16 位 hex）
+
+    兼容 Gemini 的 parts 字段。会话 ID 仅用于账号粘性（尽力而为），
+    因此每段内容只哈希有界前缀、每条消息只取前几个内容块、不做键排序，
+    耗时与历史长度和附件大小无关。
+    """
+    h = hashlib.blake2b(digest_size=8)
+    for msg in messages[:3]:
+        if isinstance(msg, dict):
+            h.update(str(msg.get("role", "")).encode())
+            h.update(b"\x00")
+            _hash_session_content(h, msg.get("content", msg.get("parts", "")))
+        else:
+            _hash_session_content(h, msg)
+        h.update(b"\x01")
+    return h.hexdigest()
+
+
+def parse_image_data_url(url: str) -> Optional[Tuple[str, str]]:
+    """解析 data:image/<fmt>;base64,<data>，返回 (fmt, data)
+
+    手工切分而不用正则，避免在 MB 级 base64 数据上逐字符匹配。
+    """
+    if not url.startswith("data:image/"):
+        return None
+    sep = url.find(";base64,", 11)
+    if sep <= 11:
+        return None
+    fmt = url[11:sep]
+    data = url[sep + 8:]
+    if not data or not fmt.isalnum():
+        return None
+    return fmt, data
+
+
+def _image_from_block(block: dict) -> Optional[dict]:
+    """把 Anthropic image / OpenAI image_url 内容块转换为 Kiro 图片，其他块返回 None"""
+    block_type = block.get("type", "")
+    if block_type == "image":
+        # Anthropic 格式
+        source = block.get("source", {})
+        media_type = source.get("media_type", "image/jpeg")
+        data = source.get("data", "")
+        if data:
+            fmt = IMAGE_FORMATS.get(media_type.rpartition("/")[2].lower(), "jpeg")
+            return {"format": fmt, "source": {"bytes": data}}
+    elif block_type == "image_url":
+        # OpenAI 格式
+        parsed = parse_image_data_url(block.get("image_url", {}).get("url", ""))
+        if parsed:
+            fmt, data = parsed
+            return {"format": fmt, "source": {"bytes": data}}
+    return None
 
 
 def extract_images_from_content(content) -> Tuple[str, List[dict]]:
@@ -44,45 +127,12 @@ def extract_images_from_content(content) -> Tuple[str, List[dict]]:
         if isinstance(block, str):
             text_parts.append(block)
         elif isinstance(block, dict):
-            block_type = block.get("type", "")
-            
-            if block_type == "text":
+            if block.get("type", "") == "text":
                 text_parts.append(block.get("text", ""))
-            
-            elif block_type == "image":
-                # Anthropic 格式
-                source = block.get("source", {})
-                media_type = source.get("media_type", "image/jpeg")
-                data = source.get("data", "")
-                
-                fmt = "jpeg"
-                if "png" in media_type:
-                    fmt = "png"
-                elif "gif" in media_type:
-                    fmt = "gif"
-                elif "webp" in media_type:
-                    fmt = "webp"
-                
-                if data:
-                    images.append({
-                        "format": fmt,
-                        "source": {"bytes": data}
-                    })
-            
-            elif block_type == "image_url":
-                # OpenAI 格式
-                image_url = block.get("image_url", {})
-                url = image_url.get("url", "")
-                
-                if url.startswith("data:"):
-                    match = re.match(r'data:image/(\w+);base64,(.+)', url)
-                    if match:
-                        fmt = match.group(1)
-                        data = match.group(2)
-                        images.append({
-                            "format": fmt,
-                            "source": {"bytes": data}
-                        })
+            else:
+                image = _image_from_block(block)
+                if image:
+                    images.append(image)
     
     return "\n".join(text_parts), images
 
@@ -250,15 +300,18 @@ def fix_history_alternation(history: List[dict], model_id: str = "claude-sonnet-
     return fixed
 
 
-def convert_anthropic_messages_to_kiro(messages: List[dict], system="") -> Tuple[str, List[dict], List[dict]]:
+def convert_anthropic_messages_to_kiro(messages: List[dict], system="") -> Tuple[str, List[dict], List[dict], List[dict]]:
     """将 Anthropic 消息格式转换为 Kiro 格式
     
+    最后一条 user 消息中的图片在同一次遍历中提取。
+
     Returns:
-        (user_content, history, tool_results)
+        (user_content, history, tool_results, images)
     """
     history = []
     user_content = ""
     current_tool_results = []
+    images = []
     
     # 处理 system
     system_text = ""
@@ -276,17 +329,26 @@ def convert_anthropic_messages_to_kiro(messages: List[dict], system="") -> Tuple
         role = msg.get("role", "")
         content = msg.get("content", "")
         is_last = (i == len(messages) - 1)
+        collect_images = is_last and role == "user"
         
-        # 处理 content 列表
+        # 处理 content 列表（纯字符串内容直接跳过；一次遍历同时收集 tool_use 和最后一条 user 消息的图片）
         tool_results = []
+        tool_uses = []
         text_parts = []
         
         if isinstance(content, list):
             for block in content:
                 if isinstance(block, dict):
-                    if block.get("type") == "text":
+                    block_type = block.get("type")
+                    if block_type == "text":
                         text_parts.append(block.get("text", ""))
-                    elif block.get("type") == "tool_result":
+                    elif block_type == "tool_use":
+                        tool_uses.append({
+                            "toolUseId": block.get("id", ""),
+                            "name": block.get("name", ""),
+                            "input": block.get("input", {})
+                        })
+                    elif block_type == "tool_result":
                         tr_content = block.get("content", "")
                         if isinstance(tr_content, list):
                             tr_text_parts = []
@@ -305,6 +367,10 @@ def convert_anthropic_messages_to_kiro(messages: List[dict], system="") -> Tuple
                             "status": status,
                             "toolUseId": block.get("tool_use_id", "")
                         })
+                    elif collect_images:
+                        image = _image_from_block(block)
+                        if image:
+                            images.append(image)
                 elif isinstance(block, str):
                     text_parts.append(block)
             
@@ -353,24 +419,7 @@ def convert_anthropic_messages_to_kiro(messages: List[dict], system="") -> Tuple
                 })
         
         elif role == "assistant":
-            tool_uses = []
-            assistant_text = ""
-            
-            if isinstance(msg.get("content"), list):
-                text_parts = []
-                for block in msg["content"]:
-                    if isinstance(block, dict):
-                        if block.get("type") == "tool_use":
-                            tool_uses.append({
-                                "toolUseId": block.get("id", ""),
-                                "name": block.get("name", ""),
-                                "input": block.get("input", {})
-                            })
-                        elif block.get("type") == "text":
-                            text_parts.append(block.get("text", ""))
-                assistant_text = "\n".join(text_parts)
-            else:
-                assistant_text = content if isinstance(content, str) else ""
+            assistant_text = content if isinstance(content, str) else ""
             
             # 确保 assistant 消息有内容
             if not assistant_text:
@@ -390,7 +439,7 @@ def convert_anthropic_messages_to_kiro(messages: List[dict], system="") -> Tuple
     # 修复历史交替
     history = fix_history_alternation(history)
     
-    return user_content, history, current_tool_results
+    return user_content, history, current_tool_results, images
 
 
 def convert_kiro_response_to_anthropic(result: dict, model: str, msg_id: str) -> dict:
@@ -471,12 +520,35 @@ def convert_openai_tools_to_kiro(tools: List[dict]) -> List[dict]:
     return kiro_tools
 
 
+def _join_text(blocks: list) -> str:
+    """拼接 OpenAI 内容块中的文本（空格分隔），不构造中间列表"""
+    return " ".join(
+        b.get("text", "") for b in blocks
+        if isinstance(b, dict) and b.get("type") == "text"
+    )
+
+
+def _join_text_and_images(blocks: list) -> Tuple[str, List[dict]]:
+    """一次遍历同时拼接 OpenAI 内容块中的文本（空格分隔）并提取图片"""
+    texts = []
+    images = []
+    for b in blocks:
+        if isinstance(b, dict):
+            if b.get("type") == "text":
+                texts.append(b.get("text", ""))
+            else:
+                image = _image_from_block(b)
+                if image:
+                    images.append(image)
+    return " ".join(texts), images
+
+
 def convert_openai_messages_to_kiro(
     messages: List[dict], 
     model: str,
     tools: List[dict] = None,
     tool_choice = None
-) -> Tuple[str, List[dict], List[dict], List[dict]]:
+) -> Tuple[str, List[dict], List[dict], List[dict], List[dict]]:
     """将 OpenAI 消息格式转换为 Kiro 格式
     
     增强：
@@ -484,14 +556,16 @@ def convert_openai_messages_to_kiro(
     - 支持 assistant 的 tool_calls
     - 支持 tool_choice: required
     - 历史交替修复
+    - 最后一条 user 消息的图片在提取文本时一并提取
     
     Returns:
-        (user_content, history, tool_results, kiro_tools)
+        (user_content, history, tool_results, kiro_tools, images)
     """
     system_content = ""
     history = []
     user_content = ""
     current_tool_results = []
+    images = []
     pending_tool_results = []  # 待处理的 tool 消息
     
     # 处理 tool_choice: required
@@ -506,7 +580,10 @@ def convert_openai_messages_to_kiro(
         
         # 提取文本内容
         if isinstance(content, list):
-            content = " ".join([c.get("text", "") for c in content if c.get("type") == "text"])
+            if is_last and role == "user":
+                content, images = _join_text_and_images(content)
+            else:
+                content = _join_text(content)
         if not content:
             content = ""
         
@@ -592,7 +669,7 @@ def convert_openai_messages_to_kiro(
                 func = tc.get("function", {})
                 args_str = func.get("arguments", "{}")
                 try:
-                    args = json.loads(args_str)
+                    args = jsonutil.loads(args_str)
                 except:
                     args = {}
                 
@@ -631,13 +708,13 @@ def convert_openai_messages_to_kiro(
     if not user_content:
         user_content = messages[-1].get("content", "") if messages else "Continue"
         if isinstance(user_content, list):
-            user_content = " ".join([c.get("text", "") for c in user_content if c.get("type") == "text"])
+            user_content = _join_text(user_content)
         if not user_content:
             user_content = "Continue"
     
     # 历史不包含最后一条用户消息
     if history and "userInputMessage" in history[-1]:
-        history = history[:-1]
+        history.pop()
     
     # 修复历史交替
     history = fix_history_alternation(history, model)
@@ -645,7 +722,7 @@ def convert_openai_messages_to_kiro(
     # 转换工具
     kiro_tools = convert_openai_tools_to_kiro(tools) if tools else []
     
-    return user_content, history, current_tool_results, kiro_tools
+    return user_content, history, current_tool_results, kiro_tools, images
 
 
 def convert_kiro_response_to_openai(result: dict, model: str, msg_id: str) -> dict:
@@ -660,7 +737,7 @@ def convert_kiro_response_to_openai(result: dict, model: str, msg_id: str) -> di
                 "type": "function",
                 "function": {
                     "name": tool_use.get("name", ""),
-                    "arguments": json.dumps(tool_use.get("input", {}))
+                    "arguments": jsonutil.dumps(tool_use.get("input", {}))
                 }
             })
     
@@ -801,7 +878,7 @@ def convert_gemini_contents_to_kiro(
                 fr = part["functionResponse"]
                 response_content = fr.get("response", {})
                 if isinstance(response_content, dict):
-                    response_text = json.dumps(response_content)
+                    response_text = jsonutil.dumps(response_content)
                 else:
                     response_text = str(response_content)
                 
@@ -912,7 +989,7 @@ def convert_gemini_contents_to_kiro(
     
     # 移除最后一条（当前用户消息）
     if history and "userInputMessage" in history[-1]:
-        history = history[:-1]
+        history.pop()
     
     # 转换工具
     kiro_tools = convert_gemini_tools_to_kiro(tools) if tools else []
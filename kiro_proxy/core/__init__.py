@@ -2,7 +2,7 @@
 from .state import state, ProxyState, RequestLog
 from .account import Account
 from .persistence import load_config, save_config, CONFIG_FILE
-from .retry import RetryableRequest, is_retryable_error, RETRYABLE_STATUS_CODES
+from .retry import RetryableRequest, is_retryable_error, backoff_sleep, RETRYABLE_STATUS_CODES
 from .scheduler import scheduler
 from .stats import stats_manager
 from .browser import detect_browsers, open_url, get_browsers_info
@@ -18,11 +18,12 @@ from .error_handler import (
     get_anthropic_error_response, format_error_log
 )
 from .rate_limiter import RateLimiter, RateLimitConfig, rate_limiter, get_rate_limiter
+from .http_client import get_client, close_client, warm_up
 
 __all__ = [
     "state", "ProxyState", "RequestLog", "Account", 
     "load_config", "save_config", "CONFIG_FILE",
-    "RetryableRequest", "is_retryable_error", "RETRYABLE_STATUS_CODES",
+    "RetryableRequest", "is_retryable_error", "backoff_sleep", "RETRYABLE_STATUS_CODES",
     "scheduler", "stats_manager",
     "detect_browsers", "open_url", "get_browsers_info",
     "flow_monitor", "FlowMonitor", "LLMFlow", "FlowState", "TokenUsage",
@@ -32,5 +33,6 @@ __all__ = [
     "is_content_length_error",
     "ErrorType", "KiroError", "classify_error", "is_account_suspended",
     "get_anthropic_error_response", "format_error_log",
-    "RateLimiter", "RateLimitConfig", "rate_limiter", "get_rate_limiter"
+    "RateLimiter", "RateLimitConfig", "rate_limiter", "get_rate_limiter",
+    "get_client", "close_client", "warm_up"
 ]
@@ -1,5 +1,7 @@
 """账号管理"""
+import asyncio
 import json
+import os
 import time
 from dataclasses import dataclass, field
 from pathlib import Path
@@ -10,8 +12,11 @@ from ..credential import (
     generate_machine_id, quota_manager
 )
 
+# token 文件变更检查间隔（秒）
+TOKEN_STAT_INTERVAL = 1.0
 
-@dataclass
+
+@dataclass(slots=True)
 class Account:
     """账号信息"""
     id: str
@@ -25,21 +30,25 @@ class Account:
     
     _credentials: Optional[KiroCredentials] = field(default=None, repr=False)
     _machine_id: Optional[str] = field(default=None, repr=False)
+    _cached_mtime: int = field(default=0, repr=False)
+    _stat_checked_at: float = field(default=0.0, repr=False)
     
-    def is_available(self) -> bool:
-        """检查账号是否可用"""
+    def is_available(self, now: Optional[float] = None) -> bool:
+        """检查账号是否可用（批量检查时可传入同一个 now）"""
         if not self.enabled:
             return False
         if self.status in (CredentialStatus.DISABLED, CredentialStatus.UNHEALTHY, CredentialStatus.SUSPENDED):
             return False
-        if not quota_manager.is_available(self.id):
+        if not quota_manager.is_available(self.id, now):
             return False
         return True
     
     def load_credentials(self) -> Optional[KiroCredentials]:
         """加载凭证信息"""
         try:
+            mtime = self._token_mtime()
             self._credentials = KiroCredentials.from_file(self.token_path)
+            self._cached_mtime = mtime
             
             if self._credentials.client_id_hash and not self._credentials.client_id:
                 self._merge_client_credentials()
@@ -68,23 +77,46 @@ class Account:
             except Exception:
                 pass
     
-    def get_credentials(self) -> Optional[KiroCredentials]:
-        """获取凭证（带缓存）"""
+    def _token_mtime(self) -> int:
+        """token 文件修改时间（纳秒，文件不存在返回 0）"""
+        self._stat_checked_at = time.monotonic()
+        try:
+            return os.stat(self.token_path).st_mtime_ns
+        except OSError:
+            return 0
+    
+    def _needs_reload(self) -> bool:
+        """凭证未加载或 token 文件已被修改
+
+        同一账号每 TOKEN_STAT_INTERVAL 秒最多 stat 一次，高频请求时不再每次触发系统调用。
+        """
         if self._credentials is None:
+            return True
+        if time.monotonic() - self._stat_checked_at < TOKEN_STAT_INTERVAL:
+            return False
+        return self._token_mtime() != self._cached_mtime
+
+    def get_credentials(self) -> Optional[KiroCredentials]:
+        """获取凭证（带缓存，文件被外部更新时自动重新加载）"""
+        if self._needs_reload():
             self.load_credentials()
         return self._credentials
     
     def get_token(self) -> str:
-        """获取 access_token"""
+        """获取 access_token（只做一次 stat，文件未变化时不读文件）"""
         creds = self.get_credentials()
         if creds and creds.access_token:
             return creds.access_token
-        
-        try:
-            with open(self.token_path) as f:
-                return json.load(f).get("accessToken", "")
-        except Exception:
-            return ""
+        return ""
+
+    async def get_token_async(self) -> str:
+        """获取 access_token（需要读文件时放到线程中执行，不阻塞事件循环）"""
+        if self._needs_reload():
+            await asyncio.to_thread(self.load_credentials)
+        creds = self._credentials
+        if creds and creds.access_token:
+            return creds.access_token
+        return ""
     
     def get_machine_id(self) -> str:
         """获取基于此账号的 Machine ID"""
@@ -121,6 +153,7 @@ class Account:
         if success:
             creds.save_to_file(self.token_path)
             self._credentials = creds
+            self._cached_mtime = self._token_mtime()
             self.status = CredentialStatus.ACTIVE
             return True, "Token 刷新成功"
         else:
@@ -141,10 +174,12 @@ class Account:
         # 如果限速未启用，不标记冷却，只记录错误
         else:
             self.error_count += 1
+        rate_limiter.penalize(self.id)
     
-    def get_status_info(self) -> dict:
+    def get_status_info(self, now: Optional[float] = None) -> dict:
         """获取状态信息"""
-        cooldown_remaining = quota_manager.get_cooldown_remaining(self.id)
+        now = now or time.time()
+        cooldown_remaining = quota_manager.get_cooldown_remaining(self.id, now)
         creds = self.get_credentials()
         
         return {
@@ -152,7 +187,7 @@ class Account:
             "name": self.name,
             "enabled": self.enabled,
             "status": self.status.value,
-            "available": self.is_available(),
+            "available": self.is_available(now),
             "request_count": self.request_count,
             "error_count": self.error_count,
             "cooldown_remaining": cooldown_remaining,
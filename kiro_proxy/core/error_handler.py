@@ -37,6 +37,28 @@ class KiroError:
     cooldown_seconds: int = 0             # 冷却时间
 
 
+# 错误类型 -> (HTTP 状态码, Anthropic 错误类型)
+ANTHROPIC_ERROR_MAP = {
+    ErrorType.ACCOUNT_SUSPENDED: (403, "authentication_error"),
+    ErrorType.RATE_LIMITED: (429, "rate_limit_error"),
+    ErrorType.CONTENT_TOO_LONG: (400, "invalid_request_error"),
+    ErrorType.AUTH_FAILED: (401, "authentication_error"),
+    ErrorType.SERVICE_UNAVAILABLE: (503, "api_error"),
+    ErrorType.MODEL_UNAVAILABLE: (503, "overloaded_error"),
+    ErrorType.UNKNOWN: (500, "api_error"),
+}
+ANTHROPIC_ERROR_DEFAULT = (500, "api_error")
+
+# 分类时只扫描错误文本的前 N 个字符（Kiro 错误体通常很短，避免异常大的 body 被整段小写化）
+CLASSIFY_SCAN_LIMIT = 8192
+
+# 各类错误的关键字（均为小写，在同一份小写文本上匹配）
+_QUOTA_KEYWORDS = ("rate limit", "quota", "too many requests", "throttl", "capacity")
+_AUTH_KEYWORDS = ("unauthorized", "invalid token")
+_MODEL_UNAVAILABLE_KEYWORDS = ("model_temporarily_unavailable", "unexpectedly high load")
+_USER_ID_RE = re.compile(r'User ID \(([^)]+)\)')
+
+
 def classify_error(status_code: int, error_text: str) -> KiroError:
     """分类 Kiro API 错误
     
@@ -47,12 +69,12 @@ def classify_error(status_code: int, error_text: str) -> KiroError:
     Returns:
         KiroError 对象
     """
-    error_lower = error_text.lower()
+    error_lower = error_text[:CLASSIFY_SCAN_LIMIT].lower()
     
-    # 1. 账号封禁检测 (最严重)
-    if "temporarily_suspended" in error_lower or "suspended" in error_lower:
+    # 1. 账号封禁检测 (最严重，"suspended" 同时覆盖 TEMPORARILY_SUSPENDED)
+    if "suspended" in error_lower:
         # 提取 User ID
-        user_id_match = re.search(r'User ID \(([^)]+)\)', error_text)
+        user_id_match = _USER_ID_RE.search(error_text)
         user_id = user_id_match.group(1) if user_id_match else "unknown"
         
         return KiroError(
@@ -65,8 +87,7 @@ def classify_error(status_code: int, error_text: str) -> KiroError:
         )
     
     # 2. 配额超限检测
-    quota_keywords = ["rate limit", "quota", "too many requests", "throttl", "capacity"]
-    if status_code == 429 or any(kw in error_lower for kw in quota_keywords):
+    if status_code == 429 or any(kw in error_lower for kw in _QUOTA_KEYWORDS):
         return KiroError(
             type=ErrorType.RATE_LIMITED,
             status_code=status_code,
@@ -89,7 +110,7 @@ def classify_error(status_code: int, error_text: str) -> KiroError:
         )
     
     # 4. 认证失败检测
-    if status_code == 401 or "unauthorized" in error_lower or "invalid token" in error_lower:
+    if status_code == 401 or any(kw in error_lower for kw in _AUTH_KEYWORDS):
         return KiroError(
             type=ErrorType.AUTH_FAILED,
             status_code=status_code,
@@ -99,7 +120,7 @@ def classify_error(status_code: int, error_text: str) -> KiroError:
         )
     
     # 5. 模型不可用检测
-    if "model_temporarily_unavailable" in error_lower or "unexpectedly high load" in error_lower:
+    if any(kw in error_lower for kw in _MODEL_UNAVAILABLE_KEYWORDS):
         return KiroError(
             type=ErrorType.MODEL_UNAVAILABLE,
             status_code=status_code,
@@ -135,20 +156,10 @@ def is_account_suspended(status_code: int, error_text: str) -> bool:
 
 def get_anthropic_error_response(error: KiroError) -> dict:
     """生成 Anthropic 格式的错误响应"""
-    error_type_map = {
-        ErrorType.ACCOUNT_SUSPENDED: "authentication_error",
-        ErrorType.RATE_LIMITED: "rate_limit_error",
-        ErrorType.CONTENT_TOO_LONG: "invalid_request_error",
-        ErrorType.AUTH_FAILED: "authentication_error",
-        ErrorType.SERVICE_UNAVAILABLE: "api_error",
-        ErrorType.MODEL_UNAVAILABLE: "overloaded_error",
-        ErrorType.UNKNOWN: "api_error",
-    }
-    
     return {
         "type": "error",
         "error": {
-            "type": error_type_map.get(error.type, "api_error"),
+            "type": ANTHROPIC_ERROR_MAP.get(error.type, ANTHROPIC_ERROR_DEFAULT)[1],
             "message": error.user_message
         }
     }
@@ -4,7 +4,7 @@
 """
 import json
 import time
-import uuid
+import secrets
 from pathlib import Path
 from dataclasses import dataclass, field, asdict
 from typing import Optional, List, Dict, Any
@@ -77,6 +77,10 @@ class FlowResponse:
     # 流式响应
     chunks: List[str] = field(default_factory=list)
     chunk_count: int = 0
+    
+    def full_content(self) -> str:
+        """完整响应内容（流式传输中由 chunks 拼接）"""
+        return self.content or "".join(self.chunks)
 
 
 @dataclass
@@ -173,7 +177,7 @@ class LLMFlow:
         if self.response:
             d["response"] = {
                 "status_code": self.response.status_code,
-                "content_length": len(self.response.content),
+                "content_length": len(self.response.full_content()),
                 "has_tool_calls": bool(self.response.tool_calls),
                 "stop_reason": self.response.stop_reason,
                 "chunk_count": self.response.chunk_count,
@@ -199,7 +203,7 @@ class LLMFlow:
         if self.response:
             d["response"]["headers"] = self.response.headers
             d["response"]["body"] = self.response.body
-            d["response"]["content"] = self.response.content
+            d["response"]["content"] = self.response.full_content()
             d["response"]["tool_calls"] = self.response.tool_calls
             d["response"]["chunks"] = self.response.chunks[-10:]  # 只保留最后10个chunk
         
@@ -293,7 +297,7 @@ class FlowStore:
                 found = False
                 if flow.request and search.lower() in json.dumps(flow.request.body).lower():
                     found = True
-                if flow.response and search.lower() in flow.response.content.lower():
+                if flow.response and search.lower() in flow.response.full_content().lower():
                     found = True
                 if not found:
                     continue
@@ -388,8 +392,9 @@ class FlowStore:
             if flow.response.usage:
                 lines.append(f"- **Tokens**: {flow.response.usage.input_tokens} in / {flow.response.usage.output_tokens} out")
             
-            if flow.response.content:
-                lines.extend(["", "### Content", "", f"```\n{flow.response.content[:2000]}\n```"])
+            content = flow.response.full_content()
+            if content:
+                lines.extend(["", "### Content", "", f"```\n{content[:2000]}\n```"])
         
         if flow.error:
             lines.extend([
@@ -420,7 +425,7 @@ class FlowMonitor:
         account_name: Optional[str] = None,
     ) -> str:
         """创建新的 Flow"""
-        flow_id = uuid.uuid4().hex[:12]
+        flow_id = secrets.token_hex(6)
         
         # 解析请求
         request = FlowRequest(
@@ -474,7 +479,6 @@ class FlowMonitor:
         if flow and flow.response:
             flow.response.chunks.append(chunk)
             flow.response.chunk_count += 1
-            flow.response.content += chunk
     
     def complete_flow(
         self,
@@ -498,7 +502,8 @@ class FlowMonitor:
             flow.response = FlowResponse(status_code=status_code)
         
         flow.response.status_code = status_code
-        flow.response.content = content or flow.response.content
+        # 流式内容只在结束时拼接一次，避免逐块字符串拼接
+        flow.response.content = content or flow.response.full_content()
         flow.response.tool_calls = tool_calls or []
         flow.response.stop_reason = stop_reason
         flow.response.headers = headers or {}
@@ -6,8 +6,8 @@
 3. 错误重试 - 捕获错误后截断重试
 4. 预估检测 - 发送前预估并截断
 """
+import hashlib
 import json
-import httpx
 import time
 from typing import List, Dict, Any, Tuple, Optional, Callable
 from dataclasses import dataclass, field
@@ -75,6 +75,26 @@ class SummaryCache:
             self._entries.popitem(last=False)
 
 
+# 摘要消息的前后缀（用于识别已压缩过的历史）
+SUMMARY_HEAD_PREFIX = "[Earlier conversation summary]\n"
+SUMMARY_HEAD_SUFFIX = "\n\n[Continuing from recent messages...]"
+
+# 重复的工具结果只保留最后一次，更早的替换为占位文本
+DUPLICATE_TOOL_RESULT_PLACEHOLDER = "[Duplicate tool result omitted: the same content appears later in the conversation]"
+
+
+def _tool_result_digest(tool_result: dict, min_chars: int) -> Optional[bytes]:
+    """工具结果文本的摘要（blake2b-16），文本不足 min_chars 时返回 None"""
+    texts = [c.get("text") or "" for c in tool_result.get("content") or () if isinstance(c, dict)]
+    if sum(len(t) for t in texts) < min_chars:
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    for t in texts:
+        h.update(t.encode())
+        h.update(b"\x00")
+    return h.digest()
+
+
 class TruncateStrategy(str, Enum):
     """截断策略"""
     NONE = "none"                    # 不截断
@@ -113,6 +133,10 @@ class HistoryConfig:
     summary_cache_min_delta_chars: int = 4000   # 旧历史新增字符数阈值
     summary_cache_max_age_seconds: int = 180    # 摘要最大复用时间
 
+    # 工具结果去重（同一份文件内容/命令输出重复出现时只保留最后一次）
+    dedupe_tool_results: bool = True
+    dedupe_min_chars: int = 1000                # 参与去重的最小字符数
+
     # 是否添加截断警告
     add_warning_header: bool = True
     
@@ -132,6 +156,8 @@ class HistoryConfig:
             "summary_cache_min_delta_messages": self.summary_cache_min_delta_messages,
             "summary_cache_min_delta_chars": self.summary_cache_min_delta_chars,
             "summary_cache_max_age_seconds": self.summary_cache_max_age_seconds,
+            "dedupe_tool_results": self.dedupe_tool_results,
+            "dedupe_min_chars": self.dedupe_min_chars,
             "add_warning_header": self.add_warning_header,
         }
     
@@ -153,6 +179,8 @@ class HistoryConfig:
             summary_cache_min_delta_messages=data.get("summary_cache_min_delta_messages", 3),
             summary_cache_min_delta_chars=data.get("summary_cache_min_delta_chars", 4000),
             summary_cache_max_age_seconds=data.get("summary_cache_max_age_seconds", 180),
+            dedupe_tool_results=data.get("dedupe_tool_results", True),
+            dedupe_min_chars=data.get("dedupe_min_chars", 1000),
             add_warning_header=data.get("add_warning_header", True),
         )
 
@@ -168,6 +196,8 @@ class HistoryManager:
         self._truncated = False
         self._truncate_info = ""
         self.cache_key = cache_key
+        # 最近一次序列化长度：(history, 消息数, 字符数)，同一列表多次判定时复用
+        self._chars_memo: Optional[Tuple[List[dict], int, int]] = None
     
     @property
     def was_truncated(self) -> bool:
@@ -193,6 +223,15 @@ class HistoryManager:
             return None
         return f"{self.cache_key}:{target_count}"
     
+    def _history_chars(self, history: List[dict]) -> int:
+        """历史消息序列化后的字符数（同一列表对象复用上次结果）"""
+        memo = self._chars_memo
+        if memo is not None and memo[0] is history and memo[1] == len(history):
+            return memo[2]
+        chars = len(json.dumps(history, ensure_ascii=False))
+        self._chars_memo = (history, len(history), chars)
+        return chars
+
     def estimate_tokens(self, text: str) -> int:
         """估算 token 数量"""
         return int(len(text) / self.config.chars_per_token)
@@ -203,12 +242,11 @@ class HistoryManager:
         Returns:
             (message_count, char_count)
         """
-        char_count = len(json.dumps(history, ensure_ascii=False))
-        return len(history), char_count
+        return len(history), self._history_chars(history)
 
     def estimate_request_chars(self, history: List[dict], user_content: str = "") -> Tuple[int, int, int]:
         """估算请求字符数 (history_chars, user_chars, total_chars)"""
-        history_chars = len(json.dumps(history, ensure_ascii=False))
+        history_chars = self._history_chars(history)
         user_chars = len(user_content or "")
         return history_chars, user_chars, history_chars + user_chars
     
@@ -225,7 +263,7 @@ class HistoryManager:
     
     def truncate_by_chars(self, history: List[dict], max_chars: int) -> List[dict]:
         """按字符数截断"""
-        total_chars = len(json.dumps(history, ensure_ascii=False))
+        total_chars = self._history_chars(history)
         if total_chars <= max_chars:
             return history
         
@@ -247,6 +285,62 @@ class HistoryManager:
         
         return result
     
+    def dedupe_tool_results(self, history: List[dict], current_tool_results: Optional[List[dict]] = None) -> List[dict]:
+        """重复的大段工具结果只保留最后一次，更早的替换为占位文本
+
+        无需调用模型，去重后常能让后续摘要变得不必要。当前轮的 tool_results
+        是最新的一次，历史中与之重复的内容同样会被替换（其本身不做修改）。
+        不修改传入的消息对象，被替换的消息按需浅拷贝；没有重复时原样返回。
+        """
+        if not self.config.dedupe_tool_results:
+            return history
+
+        min_chars = self.config.dedupe_min_chars
+        # 当前轮的结果视为最后一次出现
+        current = {
+            digest for digest in (_tool_result_digest(tr, min_chars) for tr in current_tool_results or ())
+            if digest is not None
+        }
+        # digest -> 最后一次出现的位置 (消息下标, 结果下标)
+        last_seen: Dict[bytes, Tuple[int, int]] = {}
+        occurrences: List[Tuple[int, int]] = []
+        for i, msg in enumerate(history):
+            user_msg = msg.get("userInputMessage")
+            if not user_msg:
+                continue
+            results = user_msg.get("userInputMessageContext", {}).get("toolResults")
+            if not results:
+                continue
+            for j, tr in enumerate(results):
+                digest = _tool_result_digest(tr, min_chars)
+                if digest is None:
+                    continue
+                if digest in current:
+                    occurrences.append((i, j))
+                    continue
+                if digest in last_seen:
+                    occurrences.append(last_seen[digest])
+                last_seen[digest] = (i, j)
+
+        if not occurrences:
+            return history
+
+        result = list(history)
+        for i, j in occurrences:
+            msg = result[i]
+            if msg is history[i]:
+                user_msg = dict(msg["userInputMessage"])
+                ctx = dict(user_msg["userInputMessageContext"])
+                ctx["toolResults"] = list(ctx["toolResults"])
+                user_msg["userInputMessageContext"] = ctx
+                msg = {**msg, "userInputMessage": user_msg}
+                result[i] = msg
+            results = msg["userInputMessage"]["userInputMessageContext"]["toolResults"]
+            results[j] = {**results[j], "content": [{"text": DUPLICATE_TOOL_RESULT_PLACEHOLDER}]}
+
+        print(f"[HistoryManager] 工具结果去重: 替换 {len(occurrences)} 处重复内容")
+        return result
+
     def _extract_text(self, content) -> str:
         """从消息内容中提取文本"""
         if isinstance(content, str):
@@ -414,7 +508,7 @@ class HistoryManager:
 
             summary_msg = {
                 "userInputMessage": {
-                    "content": f"[Earlier conversation summary]\n{summary}\n\n[Continuing from recent messages...]",
+                    "content": f"{SUMMARY_HEAD_PREFIX}{summary}{SUMMARY_HEAD_SUFFIX}",
                     "modelId": model_id,
                     "origin": "AI_EDITOR",
                 }
@@ -433,7 +527,7 @@ class HistoryManager:
 
         summary_msg = {
             "role": "user",
-            "content": f"[Earlier conversation summary]\n{summary}\n\n[Continuing from recent messages...]"
+            "content": f"{SUMMARY_HEAD_PREFIX}{summary}{SUMMARY_HEAD_SUFFIX}"
         }
         result = [summary_msg]
         result.append({
@@ -445,12 +539,39 @@ class HistoryManager:
             print(f"[HistoryManager] {debug_label}: {self.summarize_history_structure(result)}")
         return result
     
-    async def generate_summary(self, history: List[dict], api_caller: Callable) -> Optional[str]:
+    def _split_summary_head(self, history: List[dict]) -> Tuple[Optional[str], List[dict]]:
+        """拆出已有的摘要头（摘要 user 消息 + 占位 assistant 消息）
+
+        Returns:
+            (已有摘要文本, 摘要头之后的消息)；没有摘要头时返回 (None, history)
+        """
+        if len(history) < 2:
+            return None, history
+        first = history[0]
+        if "userInputMessage" in first:
+            content = first["userInputMessage"].get("content", "")
+        else:
+            content = first.get("content", "")
+        if (
+            isinstance(content, str)
+            and content.startswith(SUMMARY_HEAD_PREFIX)
+            and content.endswith(SUMMARY_HEAD_SUFFIX)
+        ):
+            return content[len(SUMMARY_HEAD_PREFIX):-len(SUMMARY_HEAD_SUFFIX)], history[2:]
+        return None, history
+
+    async def generate_summary(
+        self,
+        history: List[dict],
+        api_caller: Callable,
+        previous_summary: Optional[str] = None
+    ) -> Optional[str]:
         """生成历史消息摘要
         
         Args:
             history: 需要摘要的历史消息
             api_caller: API 调用函数，签名为 async (prompt: str) -> str
+            previous_summary: 已有摘要，提供时只对新增的 history 做增量摘要
         
         Returns:
             摘要文本，失败返回 None
@@ -463,6 +584,9 @@ class HistoryManager:
         if len(formatted) > 10000:
             formatted = formatted[:10000] + "\n...(truncated)"
         
+        if previous_summary:
+            formatted = f"已有摘要：\n{previous_summary}\n\n新增对话历史：\n{formatted}"
+
         prompt = f"""请简洁地总结以下对话历史的关键信息，包括：
 1. 用户的主要目标和需求
 2. 已完成的重要操作
@@ -496,12 +620,11 @@ class HistoryManager:
         Returns:
             压缩后的历史消息
         """
-        total_chars = len(json.dumps(history, ensure_ascii=False))
-        if total_chars <= self.config.summary_threshold:
-            return history
-        
         if len(history) <= self.config.summary_keep_recent:
             return history
+
+        if self._history_chars(history) <= self.config.summary_threshold:
+            return history
         
         # 分离早期消息和最近消息
         keep_recent = self.config.summary_keep_recent
@@ -590,6 +713,17 @@ class HistoryManager:
             return history, False
 
         if api_caller:
+            # 上一次重试已经摘要过：只摘要新移出窗口的消息，与已有摘要合并
+            previous_summary, body = self._split_summary_head(history)
+            if previous_summary is not None and len(body) > target_count:
+                recent_history = body[-target_count:]
+                summary = await self.generate_summary(body[:-target_count], api_caller, previous_summary)
+                if summary:
+                    result = self._build_summary_history(summary, recent_history, "错误重试增量摘要结构")
+                    self._truncated = True
+                    self._truncate_info = f"错误重试增量摘要 (第 {retry_count + 1} 次): {len(history)} -> {len(result)} 条消息 (摘要 {len(summary)} 字符)"
+                    return result, True
+
             old_history = history[:-target_count]
             recent_history = history[-target_count:]
             cache_key = self._summary_cache_key(target_count)
@@ -634,7 +768,7 @@ class HistoryManager:
         if TruncateStrategy.PRE_ESTIMATE not in self.config.strategies:
             return False
         
-        total_chars = len(json.dumps(history, ensure_ascii=False)) + len(user_content)
+        total_chars = self._history_chars(history) + len(user_content)
         return total_chars > self.config.estimate_threshold
     
     def should_summarize(self, history: List[dict]) -> bool:
@@ -645,7 +779,8 @@ class HistoryManager:
         """错误重试触发前的预摘要判定"""
         if TruncateStrategy.ERROR_RETRY not in self.config.strategies:
             return False
-        if not history:
+        # 预摘要只处理超出 retry_max_messages 的早期消息，消息数不足时无事可做
+        if len(history) <= self.config.retry_max_messages:
             return False
         _, _, total_chars = self.estimate_request_chars(history, user_content)
         return total_chars > self.config.estimate_threshold
@@ -655,8 +790,9 @@ class HistoryManager:
         if TruncateStrategy.SMART_SUMMARY not in self.config.strategies:
             return False
 
-        total_chars = len(json.dumps(history, ensure_ascii=False))
-        return total_chars > self.config.summary_threshold and len(history) > self.config.summary_keep_recent
+        if len(history) <= self.config.summary_keep_recent:
+            return False
+        return self._history_chars(history) > self.config.summary_threshold
 
     def should_auto_truncate_summarize(self, history: List[dict]) -> bool:
         """检查是否需要自动截断前摘要"""
@@ -666,8 +802,10 @@ class HistoryManager:
         if len(history) <= 1:
             return False
 
-        total_chars = len(json.dumps(history, ensure_ascii=False))
-        return len(history) > self.config.max_messages or total_chars > self.config.max_chars
+        # 先比较消息数，超出时无需序列化
+        if len(history) > self.config.max_messages:
+            return True
+        return self._history_chars(history) > self.config.max_chars
     
     def pre_process(self, history: List[dict], user_content: str = "") -> List[dict]:
         """预处理历史消息（发送前，同步版本）
@@ -690,7 +828,7 @@ class HistoryManager:
         
         # 策略 4: 预估检测
         if TruncateStrategy.PRE_ESTIMATE in self.config.strategies:
-            total_chars = len(json.dumps(result, ensure_ascii=False)) + len(user_content)
+            total_chars = self._history_chars(result) + len(user_content)
             if total_chars > self.config.estimate_threshold:
                 # 计算需要保留的消息数
                 target_chars = int(self.config.estimate_threshold * 0.8)  # 留 20% 余量
@@ -778,7 +916,7 @@ class HistoryManager:
         
         # 策略 4: 预估检测
         if TruncateStrategy.PRE_ESTIMATE in self.config.strategies:
-            total_chars = len(json.dumps(result, ensure_ascii=False)) + len(user_content)
+            total_chars = self._history_chars(result) + len(user_content)
             if total_chars > self.config.estimate_threshold:
                 target_chars = int(self.config.estimate_threshold * 0.8)
                 result = self.truncate_by_chars(result, target_chars)
@@ -847,10 +985,6 @@ def is_content_length_error(status_code: int, error_text: str) -> bool:
     """检查是否为内容长度超限错误"""
     if "CONTENT_LENGTH_EXCEEDS_THRESHOLD" in error_text:
         return True
-    if "Input is too long" in error_text:
-        return True
-    # 更宽松的匹配
+    # 更宽松的匹配（覆盖 "Input is too long"）
     lowered = error_text.lower()
-    if "too long" in lowered and ("input" in lowered or "content" in lowered or "message" in lowered):
-        return True
-    return False
+    return "too long" in lowered and ("input" in lowered or "content" in lowered or "message" in lowered)
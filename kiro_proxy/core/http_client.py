@@ -0,0 +1,52 @@
+"""共享 HTTP 客户端 - 复用连接池，避免每个请求重新握手"""
+from typing import Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 默认超时（流式响应可能很长，连接阶段单独限制）
+DEFAULT_TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+
+# 连接池限制：流式响应会长时间占用连接，总连接数需覆盖同时进行的流，
+# 否则超出的请求会排队等待连接池
+DEFAULT_LIMITS = httpx.Limits(
+    max_connections=1000,
+    max_keepalive_connections=200,
+    keepalive_expiry=60.0,
+)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """获取全局共享客户端（惰性创建）"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            verify=False,
+            timeout=DEFAULT_TIMEOUT,
+            limits=DEFAULT_LIMITS,
+        )
+    return _client
+
+
+async def warm_up(url: str, timeout: float = 5.0):
+    """预先建立到上游的连接（TLS 握手后放回连接池），失败忽略"""
+    try:
+        await get_client().head(url, timeout=timeout)
+    except Exception:
+        pass
+
+
+async def close_client():
+    """关闭全局客户端（应用退出时调用）"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
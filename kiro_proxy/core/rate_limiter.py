@@ -5,6 +5,8 @@
 - 全局请求限制
 - 突发请求检测
 - 配额超限冷却控制
+
+只比较时间间隔，统一使用 time.monotonic()，不受系统时间调整影响。
 """
 import time
 from dataclasses import dataclass, field
@@ -31,32 +33,70 @@ class RateLimitConfig:
     quota_cooldown_seconds: int = 30
 
 
-@dataclass
+@dataclass(slots=True)
+class TokenBucket:
+    """令牌桶：按速率连续补充令牌，容量即允许的突发请求数"""
+    tokens: float = 0.0
+    updated: float = 0.0
+
+    def refill(self, now: float, rate: float, capacity: float) -> float:
+        """补充令牌并返回当前令牌数（首次使用时为满桶）"""
+        if self.updated:
+            self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        else:
+            self.tokens = capacity
+        self.updated = now
+        return self.tokens
+
+    def consume(self, now: float, rate: float, capacity: float):
+        """消耗一个令牌（不低于 0）"""
+        self.tokens = max(0.0, self.refill(now, rate, capacity) - 1)
+
+    def drain(self, now: float):
+        """清空令牌（上游限流时作为惩罚）"""
+        self.tokens = 0.0
+        self.updated = now
+
+
+@dataclass(slots=True)
 class AccountRateState:
     """账号限速状态"""
     last_request_time: float = 0
     request_times: deque = field(default_factory=lambda: deque(maxlen=100))
+    bucket: TokenBucket = field(default_factory=TokenBucket)
     
     def get_requests_in_window(self, window_seconds: int = 60) -> int:
         """获取时间窗口内的请求数"""
-        now = time.time()
+        now = time.monotonic()
         cutoff = now - window_seconds
         return sum(1 for t in self.request_times if t > cutoff)
 
 
 class RateLimiter:
-    """请求限速器"""
+    """请求限速器
+    
+    每分钟请求数限制用令牌桶实现：速率 = 每分钟上限 / 60，容量 = 每分钟上限，
+    检查和记录都是 O(1)，请求时间队列只用于统计展示。
+    """
     
     def __init__(self, config: RateLimitConfig = None):
         self.config = config or RateLimitConfig()
         self._account_states: Dict[str, AccountRateState] = {}
         self._global_requests: deque = deque(maxlen=1000)
+        self._global_bucket = TokenBucket()
     
     def _get_account_state(self, account_id: str) -> AccountRateState:
         """获取账号状态"""
-        if account_id not in self._account_states:
-            self._account_states[account_id] = AccountRateState()
-        return self._account_states[account_id]
+        state = self._account_states.get(account_id)
+        if state is None:
+            state = self._account_states[account_id] = AccountRateState()
+        return state
+    
+    @staticmethod
+    def _bucket_params(per_minute: int) -> tuple:
+        """每分钟上限 -> (每秒补充速率, 桶容量)"""
+        capacity = float(max(per_minute, 1))
+        return capacity / 60.0, capacity
     
     def can_request(self, account_id: str) -> tuple:
         """检查是否可以发送请求
@@ -67,7 +107,7 @@ class RateLimiter:
         if not self.config.enabled:
             return True, 0, None
         
-        now = time.time()
+        now = time.monotonic()
         state = self._get_account_state(account_id)
         
         # 检查最小请求间隔
@@ -76,25 +116,35 @@ class RateLimiter:
             wait = self.config.min_request_interval - time_since_last
             return False, wait, f"请求过快，请等待 {wait:.1f} 秒"
         
-        # 检查每账号每分钟限制
-        account_rpm = state.get_requests_in_window(60)
-        if account_rpm >= self.config.max_requests_per_minute:
-            return False, 2, f"账号请求过于频繁 ({account_rpm}/分钟)"
+        # 检查每账号令牌桶
+        rate, capacity = self._bucket_params(self.config.max_requests_per_minute)
+        tokens = state.bucket.refill(now, rate, capacity)
+        if tokens < 1:
+            wait = (1 - tokens) / rate
+            return False, wait, f"账号请求过于频繁，{wait:.1f} 秒后恢复"
         
-        # 检查全局每分钟限制
-        global_rpm = sum(1 for t in self._global_requests if t > now - 60)
-        if global_rpm >= self.config.global_max_requests_per_minute:
-            return False, 1, f"全局请求过于频繁 ({global_rpm}/分钟)"
+        # 检查全局令牌桶
+        rate, capacity = self._bucket_params(self.config.global_max_requests_per_minute)
+        tokens = self._global_bucket.refill(now, rate, capacity)
+        if tokens < 1:
+            wait = (1 - tokens) / rate
+            return False, wait, f"全局请求过于频繁，{wait:.1f} 秒后恢复"
         
         return True, 0, None
     
     def record_request(self, account_id: str):
         """记录请求"""
-        now = time.time()
+        now = time.monotonic()
         state = self._get_account_state(account_id)
         state.last_request_time = now
         state.request_times.append(now)
         self._global_requests.append(now)
+        state.bucket.consume(now, *self._bucket_params(self.config.max_requests_per_minute))
+        self._global_bucket.consume(now, *self._bucket_params(self.config.global_max_requests_per_minute))
+    
+    def penalize(self, account_id: str):
+        """上游返回限流时清空账号令牌，令牌按速率重新积累"""
+        self._get_account_state(account_id).bucket.drain(time.monotonic())
     
     def should_apply_quota_cooldown(self) -> bool:
         """是否应该应用配额冷却（只在限速启用时）"""
@@ -106,7 +156,7 @@ class RateLimiter:
     
     def get_stats(self) -> dict:
         """获取统计信息"""
-        now = time.time()
+        now = time.monotonic()
         return {
             "enabled": self.config.enabled,
             "global_rpm": sum(1 for t in self._global_requests if t > now - 60),
@@ -1,5 +1,6 @@
 """请求重试机制"""
 import asyncio
+import random
 from typing import Callable, Any, Optional, Set
 from functools import wraps
 
@@ -22,6 +23,18 @@ NON_RETRYABLE_STATUS_CODES: Set[int] = {
 }
 
 
+# 退避延迟表（第 n 次重试取第 n 项，超出取最后一项）
+RETRY_BACKOFF = (0.5, 1.0, 2.0, 4.0, 5.0)
+# 随机抖动上限（秒），避免多个请求同时重试
+RETRY_JITTER = 0.1
+
+
+async def backoff_sleep(retry_count: int):
+    """按重试次数退避等待（查表 + 少量随机抖动）"""
+    delay = RETRY_BACKOFF[min(retry_count, len(RETRY_BACKOFF) - 1)]
+    await asyncio.sleep(delay + random.random() * RETRY_JITTER)
+
+
 def is_retryable_error(status_code: Optional[int], error: Optional[Exception] = None) -> bool:
     """判断是否为可重试的错误"""
     # 网络错误可重试
@@ -81,7 +94,7 @@ async def retry_async(
                 else:
                     print(f"[Retry] 第 {attempt + 1} 次重试，延迟 {delay:.1f}s，错误: {type(e).__name__}")
                 
-                await asyncio.sleep(delay)
+                await asyncio.sleep(delay + random.random() * RETRY_JITTER)
             else:
                 raise
     
@@ -114,4 +127,4 @@ class RetryableRequest:
         """等待重试延迟"""
         delay = min(self.base_delay * (2 ** (self.attempt - 1)), 5.0)
         print(f"[Retry] 第 {self.attempt} 次重试，延迟 {delay:.1f}s")
-        await asyncio.sleep(delay)
+        await asyncio.sleep(delay + random.random() * RETRY_JITTER)
@@ -3,6 +3,9 @@ import asyncio
 from typing import Optional
 from datetime import datetime
 
+# 后台刷新 / 健康检查的最大并发账号数
+MAX_CONCURRENT_CHECKS = 16
+
 
 class BackgroundScheduler:
     """后台任务调度器
@@ -18,7 +21,7 @@ class BackgroundScheduler:
         self._running = False
         self._refresh_interval = 300  # 5 分钟检查一次
         self._health_check_interval = 600  # 10 分钟健康检查
-        self._last_health_check = 0
+        self._last_health_check: Optional[float] = None  # time.monotonic()
     
     async def start(self):
         """启动后台任务"""
@@ -42,6 +45,7 @@ class BackgroundScheduler:
     async def _run(self):
         """主循环"""
         from . import state
+        from ..credential import quota_manager
         import time
         
         while self._running:
@@ -49,9 +53,12 @@ class BackgroundScheduler:
                 # Token 预刷新
                 await self._refresh_expiring_tokens(state)
                 
+                # 清理过期的配额冷却记录（请求路径上由 is_available 按需清理）
+                quota_manager.cleanup_expired()
+                
                 # 健康检查
-                now = time.time()
-                if now - self._last_health_check > self._health_check_interval:
+                now = time.monotonic()
+                if self._last_health_check is None or now - self._last_health_check > self._health_check_interval:
                     await self._health_check(state)
                     self._last_health_check = now
                 
@@ -64,58 +71,66 @@ class BackgroundScheduler:
                 await asyncio.sleep(60)
     
     async def _refresh_expiring_tokens(self, state):
-        """刷新即将过期的 Token"""
-        for acc in state.accounts:
-            if not acc.enabled:
-                continue
-            
-            # 提前 15 分钟刷新
-            if acc.is_token_expiring_soon(15):
+        """刷新即将过期的 Token（各账号并发）"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+        
+        async def refresh_one(acc):
+            async with semaphore:
                 print(f"[Scheduler] Token 即将过期，预刷新: {acc.name}")
                 success, msg = await acc.refresh_token()
                 if success:
                     print(f"[Scheduler] Token 刷新成功: {acc.name}")
                 else:
                     print(f"[Scheduler] Token 刷新失败: {acc.name} - {msg}")
+        
+        # 提前 15 分钟刷新
+        await asyncio.gather(
+            *(refresh_one(acc) for acc in state.accounts
+              if acc.enabled and acc.is_token_expiring_soon(15))
+        )
     
     async def _health_check(self, state):
-        """健康检查"""
-        import httpx
+        """健康检查（各账号并发，复用共享连接池）"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+        await asyncio.gather(
+            *(self._check_one(acc, semaphore) for acc in state.accounts if acc.enabled)
+        )
+    
+    async def _check_one(self, acc, semaphore: asyncio.Semaphore):
+        """检查单个账号"""
         from ..config import MODELS_URL
         from ..credential import CredentialStatus
+        from .http_client import get_client
         
-        for acc in state.accounts:
-            if not acc.enabled:
-                continue
-            
+        async with semaphore:
             try:
-                token = acc.get_token()
+                token = await acc.get_token_async()
                 if not token:
                     acc.status = CredentialStatus.UNHEALTHY
-                    continue
+                    return
                 
                 headers = {
                     "Authorization": f"Bearer {token}",
                     "content-type": "application/json"
                 }
                 
-                async with httpx.AsyncClient(verify=False, timeout=10) as client:
-                    resp = await client.get(
-                        MODELS_URL, 
-                        headers=headers,
-                        params={"origin": "AI_EDITOR"}
-                    )
-                    
-                    if resp.status_code == 200:
-                        if acc.status == CredentialStatus.UNHEALTHY:
-                            acc.status = CredentialStatus.ACTIVE
-                            print(f"[HealthCheck] 账号恢复健康: {acc.name}")
-                    elif resp.status_code == 401:
-                        acc.status = CredentialStatus.UNHEALTHY
-                        print(f"[HealthCheck] 账号认证失败: {acc.name}")
-                    elif resp.status_code == 429:
-                        # 配额超限，不改变状态
-                        pass
+                resp = await get_client().get(
+                    MODELS_URL, 
+                    headers=headers,
+                    params={"origin": "AI_EDITOR"},
+                    timeout=10
+                )
+                
+                if resp.status_code == 200:
+                    if acc.status == CredentialStatus.UNHEALTHY:
+                        acc.status = CredentialStatus.ACTIVE
+                        print(f"[HealthCheck] 账号恢复健康: {acc.name}")
+                elif resp.status_code == 401:
+                    acc.status = CredentialStatus.UNHEALTHY
+                    print(f"[HealthCheck] 账号认证失败: {acc.name}")
+                elif resp.status_code == 429:
+                    # 配额超限，不改变状态
+                    pass
                         
             except Exception as e:
                 print(f"[HealthCheck] 检查失败 {acc.name}: {e}")
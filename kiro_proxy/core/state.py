@@ -1,17 +1,25 @@
 """全局状态管理"""
+import asyncio
 import time
-from collections import deque
-from dataclasses import dataclass
-from typing import Optional, List, Dict
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Tuple
 from pathlib import Path
 
 from ..config import TOKEN_PATH
-from ..credential import quota_manager, CredentialStatus
+from ..credential import CredentialStatus
 from .account import Account
 from .persistence import load_accounts, save_accounts
 
+# 会话粘性：有效期（秒）和最大会话数
+SESSION_TTL_SECONDS = 60
+SESSION_MAX_ENTRIES = 4096
 
-@dataclass
+# 账号配置保存的合并窗口（秒）：窗口内多次修改只写一次磁盘
+SAVE_DEBOUNCE_SECONDS = 0.25
+
+
+@dataclass(slots=True)
 class RequestLog:
     """请求日志"""
     id: str
@@ -25,6 +33,30 @@ class RequestLog:
     tokens_in: int = 0
     tokens_out: int = 0
     error: Optional[str] = None
+    # 日志写入后不再修改，字典形式首次生成后缓存
+    _dict: Optional[dict] = field(default=None, init=False, repr=False, compare=False)
+
+    def to_dict(self) -> dict:
+        """转换为字典（字段均为基本类型，无需 asdict 递归拷贝；结果缓存，调用方不应修改）"""
+        if self._dict is None:
+            self._dict = self._build_dict()
+        return self._dict
+
+    def _build_dict(self) -> dict:
+        """生成字典形式"""
+        return {
+            "id": self.id,
+            "timestamp": self.timestamp,
+            "method": self.method,
+            "path": self.path,
+            "model": self.model,
+            "account_id": self.account_id,
+            "status": self.status,
+            "duration_ms": self.duration_ms,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "error": self.error,
+        }
 
 
 class ProxyState:
@@ -32,12 +64,15 @@ class ProxyState:
     
     def __init__(self):
         self.accounts: List[Account] = []
+        self._accounts_by_id: Dict[str, Account] = {}
         self.request_logs: deque = deque(maxlen=1000)
         self.total_requests: int = 0
         self.total_errors: int = 0
-        self.session_locks: Dict[str, str] = {}
-        self.session_timestamps: Dict[str, float] = {}
+        # session_id -> (account_id, 最后使用时间)，按最后使用时间排序（LRU + TTL）
+        self.sessions: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
         self.start_time: float = time.time()
+        self._save_pending: bool = False
+        self._save_task: Optional[asyncio.Task] = None
         self._load_accounts()
     
     def _load_accounts(self):
@@ -47,7 +82,7 @@ class ProxyState:
             for acc_data in saved:
                 # 验证 token 文件存在
                 if Path(acc_data.get("token_path", "")).exists():
-                    self.accounts.append(Account(
+                    self.add_account(Account(
                         id=acc_data["id"],
                         name=acc_data["name"],
                         token_path=acc_data["token_path"],
@@ -57,16 +92,16 @@ class ProxyState:
         
         # 如果没有账号，尝试添加默认账号
         if not self.accounts and TOKEN_PATH.exists():
-            self.accounts.append(Account(
+            self.add_account(Account(
                 id="default",
                 name="默认账号",
                 token_path=str(TOKEN_PATH)
             ))
             self._save_accounts()
     
-    def _save_accounts(self):
-        """保存账号到配置文件"""
-        accounts_data = [
+    def _accounts_data(self) -> List[dict]:
+        """账号配置快照"""
+        return [
             {
                 "id": acc.id,
                 "name": acc.name,
@@ -75,60 +110,119 @@ class ProxyState:
             }
             for acc in self.accounts
         ]
-        save_accounts(accounts_data)
     
+    def _save_accounts(self):
+        """保存账号到配置文件
+        
+        在事件循环中调用时只标记待保存，由后台任务合并后在线程中写盘；
+        无事件循环（CLI、启动加载）时直接同步写入。
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            save_accounts(self._accounts_data())
+            return
+        
+        self._save_pending = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._save_worker())
+    
+    async def _save_worker(self):
+        """合并保存请求并在线程中写入配置文件"""
+        while self._save_pending:
+            await asyncio.sleep(SAVE_DEBOUNCE_SECONDS)
+            self._save_pending = False
+            await asyncio.to_thread(save_accounts, self._accounts_data())
+    
+    async def flush_accounts(self):
+        """等待未完成的保存（应用退出时调用）"""
+        task = self._save_task
+        if task is not None and not task.done():
+            await task
+    
+    def add_account(self, account: Account):
+        """添加账号（同步维护 id 索引）"""
+        self.accounts.append(account)
+        self._accounts_by_id[account.id] = account
+
+    def remove_account(self, account_id: str) -> Optional[Account]:
+        """删除账号，返回被删除的账号"""
+        account = self._accounts_by_id.pop(account_id, None)
+        if account is not None:
+            self.accounts = [a for a in self.accounts if a.id != account_id]
+        return account
+
+    def get_account(self, account_id: str) -> Optional[Account]:
+        """按 id 获取账号"""
+        return self._accounts_by_id.get(account_id)
+
+    def _least_used_available(self, exclude_id: Optional[str] = None, now: Optional[float] = None) -> Optional[Account]:
+        """单次遍历选出请求数最少的可用账号"""
+        now = now or time.time()
+        best = None
+        for acc in self.accounts:
+            if acc.id == exclude_id or not acc.is_available(now):
+                continue
+            if best is None or acc.request_count < best.request_count:
+                best = acc
+        return best
+
+    def _touch_session(self, session_id: str, account_id: str, now: float):
+        """记录会话绑定，并淘汰过期/超量的会话"""
+        sessions = self.sessions
+        sessions[session_id] = (account_id, now)
+        sessions.move_to_end(session_id)
+        # 头部是最久未使用的会话
+        expire_before = now - SESSION_TTL_SECONDS
+        while sessions:
+            _, (_, ts) = next(iter(sessions.items()))
+            if ts >= expire_before and len(sessions) <= SESSION_MAX_ENTRIES:
+                break
+            sessions.popitem(last=False)
+
     def get_available_account(self, session_id: Optional[str] = None) -> Optional[Account]:
         """获取可用账号（支持会话粘性）"""
-        quota_manager.cleanup_expired()
-        
+        now = time.time()
+    
         # 会话粘性
-        if session_id and session_id in self.session_locks:
-            account_id = self.session_locks[session_id]
-            ts = self.session_timestamps.get(session_id, 0)
-            if time.time() - ts < 60:
-                for acc in self.accounts:
-                    if acc.id == account_id and acc.is_available():
-                        self.session_timestamps[session_id] = time.time()
-                        return acc
-        
-        available = [a for a in self.accounts if a.is_available()]
-        if not available:
+        if session_id:
+            locked = self.sessions.get(session_id)
+            if locked and now - locked[1] < SESSION_TTL_SECONDS:
+                acc = self._accounts_by_id.get(locked[0])
+                if acc and acc.is_available(now):
+                    self._touch_session(session_id, acc.id, now)
+                    return acc
+    
+        account = self._least_used_available(now=now)
+        if account is None:
             return None
-        
-        account = min(available, key=lambda a: a.request_count)
-        
+    
         if session_id:
-            self.session_locks[session_id] = account.id
-            self.session_timestamps[session_id] = time.time()
-        
-        return account
+            self._touch_session(session_id, account.id, now)
     
+        return account
+
     def get_next_available_account(self, exclude_id: str) -> Optional[Account]:
         """获取下一个可用账号（排除指定账号）"""
-        available = [a for a in self.accounts if a.is_available() and a.id != exclude_id]
-        if not available:
-            return None
-        return min(available, key=lambda a: a.request_count)
-    
+        return self._least_used_available(exclude_id)
+
     def mark_rate_limited(self, account_id: str, duration_seconds: int = 60):
         """标记账号限流"""
-        for acc in self.accounts:
-            if acc.id == account_id:
-                acc.mark_quota_exceeded("Rate limited")
-                break
-    
+        acc = self._accounts_by_id.get(account_id)
+        if acc:
+            acc.mark_quota_exceeded("Rate limited")
+
     def mark_quota_exceeded(self, account_id: str, reason: str = "Quota exceeded"):
         """标记账号配额超限"""
-        for acc in self.accounts:
-            if acc.id == account_id:
-                acc.mark_quota_exceeded(reason)
-                break
-    
+        acc = self._accounts_by_id.get(account_id)
+        if acc:
+            acc.mark_quota_exceeded(reason)
+
     async def refresh_account_token(self, account_id: str) -> tuple:
         """刷新指定账号的 token"""
-        for acc in self.accounts:
-            if acc.id == account_id:
-                return await acc.refresh_token()
+        acc = self._accounts_by_id.get(account_id)
+        if acc:
+            return await acc.refresh_token()
         return False, "账号不存在"
     
     async def refresh_expiring_tokens(self) -> List[dict]:
@@ -151,23 +245,39 @@ class ProxyState:
         if log.error:
             self.total_errors += 1
     
+    def count_accounts(self) -> Tuple[int, int]:
+        """单次遍历统计 (可用账号数, 冷却中账号数)
+
+        可用状态会随冷却到期自动变化，无法靠事件计数器精确维护，这里只做一次遍历。
+        """
+        now = time.time()
+        available = cooldown = 0
+        for acc in self.accounts:
+            if acc.is_available(now):
+                available += 1
+            if acc.status == CredentialStatus.COOLDOWN:
+                cooldown += 1
+        return available, cooldown
+
     def get_stats(self) -> dict:
         """获取统计信息"""
         uptime = time.time() - self.start_time
+        available, cooldown = self.count_accounts()
         return {
             "uptime_seconds": int(uptime),
             "total_requests": self.total_requests,
             "total_errors": self.total_errors,
             "error_rate": f"{(self.total_errors / max(1, self.total_requests) * 100):.1f}%",
             "accounts_total": len(self.accounts),
-            "accounts_available": len([a for a in self.accounts if a.is_available()]),
-            "accounts_cooldown": len([a for a in self.accounts if a.status == CredentialStatus.COOLDOWN]),
+            "accounts_available": available,
+            "accounts_cooldown": cooldown,
             "recent_logs": len(self.request_logs)
         }
     
     def get_accounts_status(self) -> List[dict]:
         """获取所有账号状态"""
-        return [acc.get_status_info() for acc in self.accounts]
+        now = time.time()
+        return [acc.get_status_info(now) for acc in self.accounts]
 
 
 # 全局状态实例
@@ -4,8 +4,11 @@ from dataclasses import dataclass, field
 from typing import Dict, List
 import time
 
+# 按小时统计保留的小时数
+HOURLY_WINDOW = 24
 
-@dataclass
+
+@dataclass(slots=True)
 class AccountStats:
     """账号统计"""
     total_requests: int = 0
@@ -29,7 +32,7 @@ class AccountStats:
         return self.total_errors / self.total_requests
 
 
-@dataclass
+@dataclass(slots=True)
 class ModelStats:
     """模型统计"""
     total_requests: int = 0
@@ -55,7 +58,9 @@ class StatsManager:
     def __init__(self):
         self.by_account: Dict[str, AccountStats] = defaultdict(AccountStats)
         self.by_model: Dict[str, ModelStats] = defaultdict(ModelStats)
-        self.hourly_requests: Dict[int, int] = defaultdict(int)  # hour -> count
+        # 按小时计数的环形数组：槽位 hour % HOURLY_WINDOW，同时记录槽位所属小时
+        self._hourly_counts: List[int] = [0] * HOURLY_WINDOW
+        self._hourly_hours: List[int] = [-1] * HOURLY_WINDOW
     
     def record_request(
         self,
@@ -73,21 +78,23 @@ class StatsManager:
         # 按模型统计
         self.by_model[model].record(success, latency_ms)
         
-        # 按小时统计
+        # 按小时统计（槽位属于更早的小时则先清零，无需单独清理旧数据）
         hour = int(time.time() // 3600)
-        self.hourly_requests[hour] += 1
-        
-        # 清理旧数据（保留 24 小时）
-        self._cleanup_hourly()
+        slot = hour % HOURLY_WINDOW
+        if self._hourly_hours[slot] != hour:
+            self._hourly_hours[slot] = hour
+            self._hourly_counts[slot] = 0
+        self._hourly_counts[slot] += 1
     
-    def _cleanup_hourly(self):
-        """清理超过 24 小时的数据"""
-        current_hour = int(time.time() // 3600)
-        cutoff = current_hour - 24
-        self.hourly_requests = defaultdict(
-            int,
-            {h: c for h, c in self.hourly_requests.items() if h > cutoff}
-        )
+    @property
+    def hourly_requests(self) -> Dict[str, int]:
+        """最近 24 小时的请求数（hour -> count，键为字符串，与 JSON 输出一致）"""
+        cutoff = int(time.time() // 3600) - HOURLY_WINDOW
+        return {
+            str(h): c
+            for h, c in sorted(zip(self._hourly_hours, self._hourly_counts))
+            if h > cutoff and c
+        }
     
     def get_account_stats(self, account_id: str) -> dict:
         """获取账号统计"""
@@ -112,6 +119,7 @@ class StatsManager:
     
     def get_all_stats(self) -> dict:
         """获取所有统计"""
+        hourly = self.hourly_requests
         return {
             "by_account": {
                 acc_id: self.get_account_stats(acc_id)
@@ -121,8 +129,8 @@ class StatsManager:
                 model: self.get_model_stats(model)
                 for model in self.by_model
             },
-            "hourly_requests": dict(self.hourly_requests),
-            "requests_last_24h": sum(self.hourly_requests.values())
+            "hourly_requests": hourly,
+            "requests_last_24h": sum(hourly.values())
         }
 
 
@@ -2,11 +2,15 @@
 
 通过调用 AWS Q 的 getUsageLimits API 获取用户的用量信息。
 """
+import platform
 import uuid
 import httpx
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional, Tuple
 
+from .http_client import get_client
+
 
 # API 端点
 USAGE_LIMITS_URL = "https://q.us-east-1.amazonaws.com/getUsageLimits"
@@ -43,25 +47,29 @@ def build_usage_api_url(auth_method: str, profile_arn: Optional[str] = None) ->
     return url
 
 
-def build_usage_headers(
-    access_token: str,
-    machine_id: str,
-    kiro_version: str = "1.0.0"
-) -> dict:
-    """构造请求头"""
-    import platform
+@lru_cache(maxsize=64)
+def _usage_base_headers(kiro_version: str, machine_id: str) -> dict:
+    """用量查询请求头中不变的部分（按版本 + machine_id 缓存）"""
     os_name = platform.system().lower()
-    
     return {
-        "Authorization": f"Bearer {access_token}",
         "User-Agent": f"aws-sdk-js/1.0.0 ua/2.1 os/{os_name} lang/python api/codewhispererruntime#1.0.0 m/N,E KiroIDE-{kiro_version}-{machine_id}",
         "x-amz-user-agent": f"aws-sdk-js/1.0.0 KiroIDE-{kiro_version}-{machine_id}",
-        "amz-sdk-invocation-id": str(uuid.uuid4()),
         "amz-sdk-request": "attempt=1; max=1",
-        "Connection": "close",
     }
 
 
+def build_usage_headers(
+    access_token: str,
+    machine_id: str,
+    kiro_version: str = "1.0.0"
+) -> dict:
+    """构造请求头"""
+    headers = _usage_base_headers(kiro_version, machine_id).copy()
+    headers["Authorization"] = f"Bearer {access_token}"
+    headers["amz-sdk-invocation-id"] = str(uuid.uuid4())
+    return headers
+
+
 def calculate_balance(response: dict) -> UsageInfo:
     """从 API 响应计算余额"""
     subscription_info = response.get("subscriptionInfo", {})
@@ -146,15 +154,14 @@ async def get_usage_limits(
     headers = build_usage_headers(access_token, machine_id, kiro_version)
     
     try:
-        async with httpx.AsyncClient(timeout=10, verify=False) as client:
-            response = await client.get(url, headers=headers)
-            
-            if response.status_code != 200:
-                return False, {"error": f"API 请求失败: {response.status_code} - {response.text[:200]}"}
-            
-            data = response.json()
-            usage_info = calculate_balance(data)
-            return True, usage_info
+        response = await get_client().get(url, headers=headers, timeout=10)
+        
+        if response.status_code != 200:
+            return False, {"error": f"API 请求失败: {response.status_code} - {response.text[:200]}"}
+        
+        data = response.json()
+        usage_info = calculate_balance(data)
+        return True, usage_info
             
     except httpx.TimeoutException:
         return False, {"error": "请求超时"}
@@ -174,7 +181,7 @@ async def get_account_usage(account) -> Tuple[bool, UsageInfo | dict]:
     """
     from ..credential import get_kiro_version
     
-    token = account.get_token()
+    token = await account.get_token_async()
     if not token:
         return False, {"error": "无法获取 token"}
     
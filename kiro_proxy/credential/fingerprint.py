@@ -3,10 +3,12 @@ import hashlib
 import platform
 import subprocess
 import time
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
 
+@lru_cache(maxsize=1)
 def get_raw_machine_id() -> Optional[str]:
     """获取系统原始 Machine ID"""
     system = platform.system()
@@ -60,7 +62,12 @@ def generate_machine_id(
         unique_key = get_raw_machine_id() or "KIRO_DEFAULT_MACHINE"
     
     hour_slot = int(time.time()) // 3600
-    
+    return _hash_machine_id(unique_key, hour_slot)
+
+
+@lru_cache(maxsize=128)
+def _hash_machine_id(unique_key: str, hour_slot: int) -> str:
+    """计算 Machine ID（同一凭证在同一小时内结果不变，直接复用）"""
     hasher = hashlib.sha256()
     hasher.update(unique_key.encode())
     hasher.update(hour_slot.to_bytes(8, 'little'))
@@ -68,6 +75,7 @@ def generate_machine_id(
     return hasher.hexdigest()
 
 
+@lru_cache(maxsize=1)
 def get_kiro_version() -> str:
     """获取 Kiro IDE 版本号"""
     if platform.system() == "Darwin":
@@ -90,6 +98,7 @@ def get_kiro_version() -> str:
     return "0.1.25"
 
 
+@lru_cache(maxsize=1)
 def get_system_info() -> tuple:
     """获取系统运行时信息 (os_name, node_version)"""
     system = platform.system()
@@ -4,7 +4,7 @@ from dataclasses import dataclass
 from typing import Dict, Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class QuotaRecord:
     """配额超限记录"""
     credential_id: str
@@ -54,25 +54,25 @@ class QuotaManager:
         self.exceeded_records[credential_id] = record
         return record
     
-    def is_available(self, credential_id: str) -> bool:
-        """检查凭证是否可用"""
+    def is_available(self, credential_id: str, now: Optional[float] = None) -> bool:
+        """检查凭证是否可用（批量检查时可传入同一个 now）"""
         record = self.exceeded_records.get(credential_id)
         if not record:
             return True
         
-        if time.time() >= record.cooldown_until:
+        if (now or time.time()) >= record.cooldown_until:
             del self.exceeded_records[credential_id]
             return True
         
         return False
     
-    def get_cooldown_remaining(self, credential_id: str) -> Optional[int]:
+    def get_cooldown_remaining(self, credential_id: str, now: Optional[float] = None) -> Optional[int]:
         """获取剩余冷却时间（秒）"""
         record = self.exceeded_records.get(credential_id)
         if not record:
             return None
         
-        remaining = record.cooldown_until - time.time()
+        remaining = record.cooldown_until - (now or time.time())
         return max(0, int(remaining))
     
     def cleanup_expired(self) -> int:
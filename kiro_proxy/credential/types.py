@@ -2,8 +2,9 @@
 import json
 import time
 from dataclasses import dataclass
-from datetime import datetime, timezone, timedelta
+from datetime import datetime
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -82,34 +83,36 @@ class KiroCredentials:
     
     def is_expired(self) -> bool:
         """检查 token 是否已过期"""
-        if not self.expires_at:
-            return True
-        
-        try:
-            if "T" in self.expires_at:
-                expires = datetime.fromisoformat(self.expires_at.replace("Z", "+00:00"))
-                now = datetime.now(timezone.utc)
-                return expires <= now + timedelta(minutes=5)
-            
-            expires_ts = int(self.expires_at)
-            now_ts = int(time.time())
-            return now_ts >= (expires_ts - 300)
-        except Exception:
+        expires_ts = _parse_expires_at(self.expires_at)
+        if expires_ts is None:
             return True
+        return time.time() >= expires_ts - 300
     
     def is_expiring_soon(self, minutes: int = 10) -> bool:
         """检查 token 是否即将过期"""
-        if not self.expires_at:
+        expires_ts = _parse_expires_at(self.expires_at)
+        if expires_ts is None:
             return False
+        return time.time() >= expires_ts - minutes * 60
+
+
+@lru_cache(maxsize=64)
+def _parse_expires_at(expires_at: Optional[str]) -> Optional[float]:
+    """解析过期时间为时间戳（ISO 格式或秒级时间戳），无效时返回 None
+    
+    同一凭证的 expiresAt 在刷新前不变，解析结果按字符串缓存，
+    每次请求检查过期时只需一次比较。
+    """
+    if not expires_at:
+        return None
+    
+    try:
+        if "T" in expires_at:
+            expires = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
+            if expires.tzinfo is None:
+                return None
+            return expires.timestamp()
         
-        try:
-            if "T" in self.expires_at:
-                expires = datetime.fromisoformat(self.expires_at.replace("Z", "+00:00"))
-                now = datetime.now(timezone.utc)
-                return expires < now + timedelta(minutes=minutes)
-            
-            expires_ts = int(self.expires_at)
-            now_ts = int(time.time())
-            return now_ts >= (expires_ts - minutes * 60)
-        except Exception:
-            return False
+        return float(int(expires_at))
+    except Exception:
+        return None
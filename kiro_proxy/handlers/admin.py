@@ -2,14 +2,17 @@
 import json
 import uuid
 import time
-import httpx
+import asyncio
+from itertools import islice
 from pathlib import Path
 from datetime import datetime
-from dataclasses import asdict
 from fastapi import Request, HTTPException, Query
+from fastapi.responses import Response
 
+from .. import jsonutil
 from ..config import TOKEN_PATH, MODELS_URL
-from ..core import state, Account, stats_manager, get_browsers_info, open_url, flow_monitor, get_account_usage
+from ..core import state, Account, stats_manager, get_browsers_info, open_url, flow_monitor, get_account_usage, get_client
+from ..core.scheduler import MAX_CONCURRENT_CHECKS
 from ..credential import quota_manager, generate_machine_id, get_kiro_version, CredentialStatus
 from ..auth import start_device_flow, poll_device_flow, cancel_device_flow, get_login_state, save_credentials_to_file
 from ..auth import start_social_auth, exchange_social_auth_token, cancel_social_auth, get_social_auth_state
@@ -45,11 +48,16 @@ async def event_logging_batch(request: Request):
 
 async def get_logs(limit: int = Query(100, le=1000)):
     """获取请求日志"""
-    logs = list(state.request_logs)[-limit:]
-    return {
-        "logs": [asdict(log) for log in reversed(logs)],
-        "total": len(state.request_logs)
-    }
+    # 从 deque 右端倒序取最近 limit 条，不复制整个日志队列（负数已在路由层拒绝）
+    logs = islice(reversed(state.request_logs), limit)
+    # 直接序列化为响应，跳过 FastAPI 对上千条日志的 jsonable_encoder 遍历
+    return Response(
+        jsonutil.dumps_bytes({
+            "logs": [log.to_dict() for log in logs],
+            "total": len(state.request_logs)
+        }),
+        media_type="application/json"
+    )
 
 
 async def get_accounts():
@@ -61,36 +69,36 @@ async def get_accounts():
 
 async def get_account_detail(account_id: str):
     """获取账号详细信息"""
-    for acc in state.accounts:
-        if acc.id == account_id:
-            creds = acc.get_credentials()
-            return {
-                "id": acc.id,
-                "name": acc.name,
-                "enabled": acc.enabled,
-                "status": acc.status.value,
-                "available": acc.is_available(),
-                "request_count": acc.request_count,
-                "error_count": acc.error_count,
-                "last_used": acc.last_used,
-                "token_path": acc.token_path,
-                "machine_id": acc.get_machine_id()[:16] + "...",
-                "credentials": {
-                    "has_access_token": bool(creds and creds.access_token),
-                    "has_refresh_token": bool(creds and creds.refresh_token),
-                    "has_client_id": bool(creds and creds.client_id),
-                    "auth_method": creds.auth_method if creds else None,
-                    "region": creds.region if creds else None,
-                    "expires_at": creds.expires_at if creds else None,
-                    "is_expired": acc.is_token_expired(),
-                    "is_expiring_soon": acc.is_token_expiring_soon(),
-                } if creds else None,
-                "cooldown": {
-                    "is_cooldown": not quota_manager.is_available(acc.id),
-                    "remaining_seconds": quota_manager.get_cooldown_remaining(acc.id),
-                }
-            }
-    raise HTTPException(404, "Account not found")
+    acc = state.get_account(account_id)
+    if acc is None:
+        raise HTTPException(404, "Account not found")
+    creds = acc.get_credentials()
+    return {
+        "id": acc.id,
+        "name": acc.name,
+        "enabled": acc.enabled,
+        "status": acc.status.value,
+        "available": acc.is_available(),
+        "request_count": acc.request_count,
+        "error_count": acc.error_count,
+        "last_used": acc.last_used,
+        "token_path": acc.token_path,
+        "machine_id": acc.get_machine_id()[:16] + "...",
+        "credentials": {
+            "has_access_token": bool(creds and creds.access_token),
+            "has_refresh_token": bool(creds and creds.refresh_token),
+            "has_client_id": bool(creds and creds.client_id),
+            "auth_method": creds.auth_method if creds else None,
+            "region": creds.region if creds else None,
+            "expires_at": creds.expires_at if creds else None,
+            "is_expired": acc.is_token_expired(),
+            "is_expiring_soon": acc.is_token_expiring_soon(),
+        } if creds else None,
+        "cooldown": {
+            "is_cooldown": not quota_manager.is_available(acc.id),
+            "remaining_seconds": quota_manager.get_cooldown_remaining(acc.id),
+        }
+    }
 
 
 async def add_account(request: Request):
@@ -107,7 +115,7 @@ async def add_account(request: Request):
         name=name,
         token_path=token_path
     )
-    state.accounts.append(account)
+    state.add_account(account)
     
     # 预加载凭证
     account.load_credentials()
@@ -120,7 +128,7 @@ async def add_account(request: Request):
 
 async def delete_account(account_id: str):
     """删除账号"""
-    state.accounts = [a for a in state.accounts if a.id != account_id]
+    state.remove_account(account_id)
     # 清理配额记录
     quota_manager.restore(account_id)
     # 保存配置
@@ -130,13 +138,13 @@ async def delete_account(account_id: str):
 
 async def toggle_account(account_id: str):
     """启用/禁用账号"""
-    for acc in state.accounts:
-        if acc.id == account_id:
-            acc.enabled = not acc.enabled
-            # 保存配置
-            state._save_accounts()
-            return {"ok": True, "enabled": acc.enabled}
-    raise HTTPException(404, "Account not found")
+    acc = state.get_account(account_id)
+    if acc is None:
+        raise HTTPException(404, "Account not found")
+    acc.enabled = not acc.enabled
+    # 保存配置
+    state._save_accounts()
+    return {"ok": True, "enabled": acc.enabled}
 
 
 async def refresh_account_token(account_id: str):
@@ -159,11 +167,9 @@ async def restore_account(account_id: str):
     """恢复账号（从冷却状态）"""
     restored = quota_manager.restore(account_id)
     if restored:
-        for acc in state.accounts:
-            if acc.id == account_id:
-                from ..credential import CredentialStatus
-                acc.status = CredentialStatus.ACTIVE
-                break
+        acc = state.get_account(account_id)
+        if acc is not None:
+            acc.status = CredentialStatus.ACTIVE
     return {"ok": restored}
 
 
@@ -173,9 +179,9 @@ async def speedtest():
     if not account:
         return {"ok": False, "error": "No available account"}
     
-    start = time.time()
+    start = time.perf_counter()
     try:
-        token = account.get_token()
+        token = await account.get_token_async()
         machine_id = account.get_machine_id()
         kiro_version = get_kiro_version()
         
@@ -184,61 +190,63 @@ async def speedtest():
             "x-amz-user-agent": f"aws-sdk-js/1.0.0 KiroIDE-{kiro_version}-{machine_id}",
             "Authorization": f"Bearer {token}",
         }
-        async with httpx.AsyncClient(verify=False, timeout=10) as client:
-            resp = await client.get(MODELS_URL, headers=headers, params={"origin": "AI_EDITOR"})
-            latency = (time.time() - start) * 1000
-            return {
-                "ok": resp.status_code == 200,
-                "latency_ms": round(latency, 2),
-                "status": resp.status_code,
-                "account_id": account.id
-            }
+        resp = await get_client().get(MODELS_URL, headers=headers, params={"origin": "AI_EDITOR"}, timeout=10)
+        latency = (time.perf_counter() - start) * 1000
+        return {
+            "ok": resp.status_code == 200,
+            "latency_ms": round(latency, 2),
+            "status": resp.status_code,
+            "account_id": account.id
+        }
     except Exception as e:
-        return {"ok": False, "error": str(e), "latency_ms": (time.time() - start) * 1000}
+        return {"ok": False, "error": str(e), "latency_ms": (time.perf_counter() - start) * 1000}
+
+
+def _scan_sso_cache(sso_cache: Path, added_paths: set) -> list:
+    """读取 SSO 缓存目录中的 token 文件（同步，在线程中执行）"""
+    found = []
+    for f in sso_cache.glob("*.json"):
+        try:
+            data = jsonutil.loads(f.read_bytes())
+            if "accessToken" in data:
+                auth_method = data.get("authMethod", "social")
+                client_id_hash = data.get("clientIdHash")
+                
+                # 检查 IdC 配置完整性
+                idc_complete = None
+                if auth_method == "idc" and client_id_hash:
+                    hash_file = sso_cache / f"{client_id_hash}.json"
+                    if hash_file.exists():
+                        try:
+                            hash_data = jsonutil.loads(hash_file.read_bytes())
+                            idc_complete = bool(hash_data.get("clientId") and hash_data.get("clientSecret"))
+                        except:
+                            idc_complete = False
+                    else:
+                        idc_complete = False
+                
+                found.append({
+                    "path": str(f),
+                    "name": f.stem,
+                    "expires": data.get("expiresAt"),
+                    "auth_method": auth_method,
+                    "region": data.get("region", "us-east-1"),
+                    "has_refresh_token": "refreshToken" in data,
+                    "already_added": str(f) in added_paths,
+                    "idc_config_complete": idc_complete,
+                })
+        except:
+            pass
+    return found
 
 
 async def scan_tokens():
-    """扫描系统中的 Kiro token 文件"""
+    """扫描系统中的 Kiro token 文件（文件读取放到线程中，不阻塞事件循环）"""
     found = []
     sso_cache = Path.home() / ".aws/sso/cache"
     if sso_cache.exists():
-        for f in sso_cache.glob("*.json"):
-            try:
-                with open(f) as fp:
-                    data = json.load(fp)
-                    if "accessToken" in data:
-                        # 检查是否已添加
-                        already_added = any(a.token_path == str(f) for a in state.accounts)
-                        
-                        auth_method = data.get("authMethod", "social")
-                        client_id_hash = data.get("clientIdHash")
-                        
-                        # 检查 IdC 配置完整性
-                        idc_complete = None
-                        if auth_method == "idc" and client_id_hash:
-                            hash_file = sso_cache / f"{client_id_hash}.json"
-                            if hash_file.exists():
-                                try:
-                                    with open(hash_file) as hf:
-                                        hash_data = json.load(hf)
-                                        idc_complete = bool(hash_data.get("clientId") and hash_data.get("clientSecret"))
-                                except:
-                                    idc_complete = False
-                            else:
-                                idc_complete = False
-                        
-                        found.append({
-                            "path": str(f),
-                            "name": f.stem,
-                            "expires": data.get("expiresAt"),
-                            "auth_method": auth_method,
-                            "region": data.get("region", "us-east-1"),
-                            "has_refresh_token": "refreshToken" in data,
-                            "already_added": already_added,
-                            "idc_config_complete": idc_complete,
-                        })
-            except:
-                pass
+        added_paths = {a.token_path for a in state.accounts}
+        found = await asyncio.to_thread(_scan_sso_cache, sso_cache, added_paths)
     return {"tokens": found}
 
 
@@ -267,7 +275,7 @@ async def add_from_scan(request: Request):
         name=name,
         token_path=token_path
     )
-    state.accounts.append(account)
+    state.add_account(account)
     
     # 预加载凭证
     account.load_credentials()
@@ -305,7 +313,7 @@ async def import_config(request: Request):
                     token_path=token_path,
                     enabled=acc_data.get("enabled", True)
                 )
-                state.accounts.append(account)
+                state.add_account(account)
                 account.load_credentials()
                 imported += 1
     
@@ -385,85 +393,91 @@ async def get_detailed_stats():
     }
 
 
-async def run_health_check():
-    """手动触发健康检查"""
-    results = []
+async def _check_account_health(acc: Account) -> dict:
+    """检查单个账号健康状态，返回检查结果"""
+    if not acc.enabled:
+        return {
+            "id": acc.id,
+            "name": acc.name,
+            "status": "disabled",
+            "healthy": False
+        }
     
-    for acc in state.accounts:
-        if not acc.enabled:
-            results.append({
+    try:
+        token = await acc.get_token_async()
+        if not token:
+            acc.status = CredentialStatus.UNHEALTHY
+            return {
                 "id": acc.id,
                 "name": acc.name,
-                "status": "disabled",
+                "status": "no_token",
                 "healthy": False
-            })
-            continue
+            }
         
-        try:
-            token = acc.get_token()
-            if not token:
-                acc.status = CredentialStatus.UNHEALTHY
-                results.append({
-                    "id": acc.id,
-                    "name": acc.name,
-                    "status": "no_token",
-                    "healthy": False
-                })
-                continue
-            
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "content-type": "application/json"
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "content-type": "application/json"
+        }
+        
+        resp = await get_client().get(
+            MODELS_URL,
+            headers=headers,
+            params={"origin": "AI_EDITOR"},
+            timeout=10
+        )
+        
+        if resp.status_code == 200:
+            if acc.status == CredentialStatus.UNHEALTHY:
+                acc.status = CredentialStatus.ACTIVE
+            return {
+                "id": acc.id,
+                "name": acc.name,
+                "status": "healthy",
+                "healthy": True,
+                "latency_ms": resp.elapsed.total_seconds() * 1000
             }
-            
-            async with httpx.AsyncClient(verify=False, timeout=10) as client:
-                resp = await client.get(
-                    MODELS_URL,
-                    headers=headers,
-                    params={"origin": "AI_EDITOR"}
-                )
-                
-                if resp.status_code == 200:
-                    if acc.status == CredentialStatus.UNHEALTHY:
-                        acc.status = CredentialStatus.ACTIVE
-                    results.append({
-                        "id": acc.id,
-                        "name": acc.name,
-                        "status": "healthy",
-                        "healthy": True,
-                        "latency_ms": resp.elapsed.total_seconds() * 1000
-                    })
-                elif resp.status_code == 401:
-                    acc.status = CredentialStatus.UNHEALTHY
-                    results.append({
-                        "id": acc.id,
-                        "name": acc.name,
-                        "status": "auth_failed",
-                        "healthy": False
-                    })
-                elif resp.status_code == 429:
-                    results.append({
-                        "id": acc.id,
-                        "name": acc.name,
-                        "status": "rate_limited",
-                        "healthy": True  # 限流不代表不健康
-                    })
-                else:
-                    results.append({
-                        "id": acc.id,
-                        "name": acc.name,
-                        "status": f"error_{resp.status_code}",
-                        "healthy": False
-                    })
-                    
-        except Exception as e:
-            results.append({
+        elif resp.status_code == 401:
+            acc.status = CredentialStatus.UNHEALTHY
+            return {
                 "id": acc.id,
                 "name": acc.name,
-                "status": "error",
-                "healthy": False,
-                "error": str(e)
-            })
+                "status": "auth_failed",
+                "healthy": False
+            }
+        elif resp.status_code == 429:
+            return {
+                "id": acc.id,
+                "name": acc.name,
+                "status": "rate_limited",
+                "healthy": True  # 限流不代表不健康
+            }
+        else:
+            return {
+                "id": acc.id,
+                "name": acc.name,
+                "status": f"error_{resp.status_code}",
+                "healthy": False
+            }
+                
+    except Exception as e:
+        return {
+            "id": acc.id,
+            "name": acc.name,
+            "status": "error",
+            "healthy": False,
+            "error": str(e)
+        }
+
+
+async def run_health_check():
+    """手动触发健康检查（各账号并发检查，共用连接池）"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+    
+    async def check(acc: Account) -> dict:
+        async with semaphore:
+            return await _check_account_health(acc)
+    
+    results = await asyncio.gather(*(check(acc) for acc in state.accounts))
     
     healthy_count = len([r for r in results if r["healthy"]])
     return {
@@ -527,7 +541,7 @@ async def poll_kiro_login():
             name="在线登录账号",
             token_path=file_path
         )
-        state.accounts.append(account)
+        state.add_account(account)
         account.load_credentials()
         state._save_accounts()
         
@@ -618,7 +632,7 @@ async def exchange_social_token(request: Request):
             name=f"{provider} 登录账号",
             token_path=file_path
         )
-        state.accounts.append(account)
+        state.add_account(account)
         account.load_credentials()
         state._save_accounts()
         
@@ -745,29 +759,29 @@ async def export_flows(request: Request):
 
 async def get_account_usage_info(account_id: str):
     """获取账号用量信息"""
-    for acc in state.accounts:
-        if acc.id == account_id:
-            success, result = await get_account_usage(acc)
-            if success:
-                return {
-                    "ok": True,
-                    "account_id": account_id,
-                    "account_name": acc.name,
-                    "usage": {
-                        "subscription_title": result.subscription_title,
-                        "usage_limit": result.usage_limit,
-                        "current_usage": result.current_usage,
-                        "balance": result.balance,
-                        "is_low_balance": result.is_low_balance,
-                        "free_trial_limit": result.free_trial_limit,
-                        "free_trial_usage": result.free_trial_usage,
-                        "bonus_limit": result.bonus_limit,
-                        "bonus_usage": result.bonus_usage,
-                    }
-                }
-            else:
-                return {"ok": False, "error": result.get("error", "查询失败")}
-    raise HTTPException(404, "Account not found")
+    acc = state.get_account(account_id)
+    if acc is None:
+        raise HTTPException(404, "Account not found")
+    success, result = await get_account_usage(acc)
+    if success:
+        return {
+            "ok": True,
+            "account_id": account_id,
+            "account_name": acc.name,
+            "usage": {
+                "subscription_title": result.subscription_title,
+                "usage_limit": result.usage_limit,
+                "current_usage": result.current_usage,
+                "balance": result.balance,
+                "is_low_balance": result.is_low_balance,
+                "free_trial_limit": result.free_trial_limit,
+                "free_trial_usage": result.free_trial_usage,
+                "bonus_limit": result.bonus_limit,
+                "bonus_usage": result.bonus_usage,
+            }
+        }
+    else:
+        return {"ok": False, "error": result.get("error", "查询失败")}
 
 
 # ==================== 账号导入导出 API ====================
@@ -831,7 +845,7 @@ async def import_accounts(request: Request):
                 token_path=file_path,
                 enabled=acc_data.get("enabled", True)
             )
-            state.accounts.append(account)
+            state.add_account(account)
             account.load_credentials()
             imported += 1
         except Exception as e:
@@ -865,7 +879,7 @@ async def add_manual_token(request: Request):
         name=name,
         token_path=file_path
     )
-    state.accounts.append(account)
+    state.add_account(account)
     account.load_credentials()
     state._save_accounts()
     
@@ -962,7 +976,7 @@ async def complete_remote_login(session_id: str, request: Request):
             name=f"远程登录 ({provider})",
             token_path=file_path
         )
-        state.accounts.append(account)
+        state.add_account(account)
         account.load_credentials()
         state._save_accounts()
         
@@ -1,58 +1,130 @@
 """Anthropic 协议处理 - /v1/messages"""
-import json
-import uuid
+import secrets
 import time
 import asyncio
+from functools import lru_cache
 import httpx
 from fastapi import Request, HTTPException
 from fastapi.responses import StreamingResponse
 
-from ..config import KIRO_API_URL, map_model_name
-from ..core import state, RetryableRequest, is_retryable_error, stats_manager, flow_monitor, TokenUsage
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from ..config import KIRO_API_URL, DEBUG_REQUESTS, map_model_name
+from .. import jsonutil
+from ..core import state, RetryableRequest, is_retryable_error, backoff_sleep, stats_manager, flow_monitor, TokenUsage, get_client
 from ..core.state import RequestLog
 from ..core.history_manager import HistoryManager, get_history_config, is_content_length_error, TruncateStrategy
-from ..core.error_handler import classify_error, ErrorType, format_error_log
+from ..core.error_handler import classify_error, ErrorType, format_error_log, ANTHROPIC_ERROR_MAP, ANTHROPIC_ERROR_DEFAULT
 from ..core.rate_limiter import get_rate_limiter
-from ..credential import quota_manager
-from ..kiro_api import build_headers, build_kiro_request, parse_event_stream_full, parse_event_stream, is_quota_exceeded_error
+from ..credential import quota_manager, CredentialStatus
+from ..kiro_api import build_headers, switch_account_headers, build_kiro_request, generate_text, is_quota_exceeded_error, EventStreamParser
 from ..converters import (
     generate_session_id,
     convert_anthropic_tools_to_kiro,
     convert_anthropic_messages_to_kiro,
     convert_kiro_response_to_anthropic,
-    extract_images_from_content
+    fix_history_alternation,
 )
 
 
-def _extract_text_from_content(content) -> str:
-    if content is None:
-        return ""
-    if isinstance(content, str):
-        return content
-    if isinstance(content, list):
-        parts = []
-        for item in content:
-            parts.append(_extract_text_from_content(item))
-        return "".join(parts)
-    if isinstance(content, dict):
-        if "text" in content and isinstance(content.get("text"), str):
-            return content["text"]
-        if "content" in content:
-            return _extract_text_from_content(content.get("content"))
-    return ""
+# SSE 帧模板（预编码为 bytes，避免每次 yield 格式化和编码）
+_SSE_TEXT_BLOCK_START = b'data: {"type":"content_block_start","index":0,"content_block":{"type":"text","text":""}}\n\n'
+_SSE_TEXT_DELTA_PREFIX = b'data: {"type":"content_block_delta","index":0,"delta":{"type":"text_delta","text":'
+_SSE_TEXT_DELTA_SUFFIX = b'}}\n\n'
+_SSE_TEXT_BLOCK_STOP = b'data: {"type":"content_block_stop","index":0}\n\n'
+_SSE_BLOCK_STOP = b'data: {"type":"content_block_stop","index":%d}\n\n'
+_SSE_TOOL_DELTA_PREFIX = b'data: {"type":"content_block_delta","index":%d,"delta":{"type":"input_json_delta","partial_json":'
+_SSE_TOOL_DELTA_SUFFIX = b'}}\n\n'
+_SSE_MESSAGE_DELTA = {
+    stop_reason: b'data: {"type":"message_delta","delta":{"stop_reason":"' + stop_reason.encode()
+    + b'","stop_sequence":null},"usage":{"output_tokens":0}}\n\n'
+    for stop_reason in ("end_turn", "tool_use")
+}
+_SSE_MESSAGE_STOP = b'data: {"type":"message_stop"}\n\n'
+# message_start 中只有 id/model 随请求变化
+_MESSAGE_START_TEMPLATE = {
+    "id": "", "type": "message", "role": "assistant", "content": [], "model": "",
+    "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 0, "output_tokens": 0},
+}
+
+
+def _sse_data(data: dict) -> bytes:
+    """编码单个 SSE data 帧"""
+    return b"data: " + jsonutil.dumps_bytes(data) + b"\n\n"
+
+
+def _sse_message_start(msg_id: str, model: str) -> bytes:
+    """编码 message_start 帧（模板浅拷贝，不修改共享对象）"""
+    message = dict(_MESSAGE_START_TEMPLATE, id=msg_id, model=model)
+    return _sse_data({"type": "message_start", "message": message})
+
+
+def _sse_error(error_type: str, message: str) -> bytes:
+    """编码 SSE 错误帧"""
+    return _sse_data({"type": "error", "error": {"type": error_type, "message": message}})
+
+
+def _content_texts(content) -> list:
+    """收集内容中的文本片段（不拼接；顺序不保证，仅用于计数）
+
+    最常见的 str 直接返回；嵌套的 list/dict 用显式栈迭代展开，不递归。
+    """
+    if type(content) is str:
+        return [content]
+    texts = []
+    stack = [content]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            texts.append(item)
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            text = item.get("text")
+            if isinstance(text, str):
+                texts.append(text)
+            elif "content" in item:
+                stack.append(item["content"])
+    return texts
+
+
+@lru_cache(maxsize=1)
+def _get_token_encoding():
+    """tiktoken 编码器（可选依赖，首次使用时加载；未安装或加载失败时返回 None）"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"[Tokens] 加载 tiktoken 编码失败，改用字符数估算: {e}")
+        return None
 
 
-def _estimate_tokens(text: str) -> int:
-    if not text:
+def _estimate_tokens(length: int) -> int:
+    """按字符数估算 token 数（约 4 字符 / token）"""
+    if not length:
         return 0
-    return (len(text) + 3) // 4
+    return (length + 3) // 4
 
 
-def _count_tokens_from_messages(messages, system: str = "") -> int:
-    total = _estimate_tokens(system) if system else 0
+def _count_tokens_from_messages(messages, system="") -> int:
+    """统计 token 数：安装了 tiktoken 时用 cl100k_base 批量编码，否则按字符数估算"""
+    groups = [_content_texts(system)] if system else []
     for msg in messages or []:
-        total += _estimate_tokens(_extract_text_from_content(msg.get("content")))
-    return total
+        groups.append(_content_texts(msg.get("content")))
+
+    encoding = _get_token_encoding()
+    if encoding is not None:
+        texts = [text for group in groups for text in group if text]
+        try:
+            return sum(map(len, encoding.encode_ordinary_batch(texts)))
+        except Exception as e:
+            print(f"[Tokens] tiktoken 编码失败，改用字符数估算: {e}")
+
+    return sum(_estimate_tokens(sum(map(len, group))) for group in groups)
 
 
 def _handle_kiro_error(status_code: int, error_text: str, account):
@@ -65,7 +137,6 @@ def _handle_kiro_error(status_code: int, error_text: str, account):
     # 账号封禁 - 禁用账号
     if error.should_disable_account and account:
         account.enabled = False
-        from ..credential import CredentialStatus
         account.status = CredentialStatus.SUSPENDED
         print(f"[Account] 账号 {account.id} 已被禁用 (封禁)")
     
@@ -74,38 +145,27 @@ def _handle_kiro_error(status_code: int, error_text: str, account):
         account.mark_quota_exceeded(error.message[:100])
     
     # 映射错误类型
-    error_type_map = {
-        ErrorType.ACCOUNT_SUSPENDED: (403, "authentication_error"),
-        ErrorType.RATE_LIMITED: (429, "rate_limit_error"),
-        ErrorType.CONTENT_TOO_LONG: (400, "invalid_request_error"),
-        ErrorType.AUTH_FAILED: (401, "authentication_error"),
-        ErrorType.SERVICE_UNAVAILABLE: (503, "api_error"),
-        ErrorType.MODEL_UNAVAILABLE: (503, "overloaded_error"),
-        ErrorType.UNKNOWN: (500, "api_error"),
-    }
-    
-    http_status, err_type = error_type_map.get(error.type, (500, "api_error"))
+    http_status, err_type = ANTHROPIC_ERROR_MAP.get(error.type, ANTHROPIC_ERROR_DEFAULT)
     return http_status, err_type, error.user_message, error
 
 
 async def handle_count_tokens(request: Request):
     '''Handle /v1/messages/count_tokens requests.'''
-    body = await request.json()
+    body = await jsonutil.read_request(request)
     messages = body.get("messages", [])
     system = body.get("system", "")
     if not messages and not system:
         raise HTTPException(400, "messages required")
-    return {"input_tokens": _count_tokens_from_messages(messages, system)}
+    # 放到线程中执行：首次加载编码器可能下载 BPE 文件，大对话编码也较耗时，不能阻塞事件循环
+    input_tokens = await asyncio.to_thread(_count_tokens_from_messages, messages, system)
+    return {"input_tokens": input_tokens}
 
 
 async def _call_kiro_for_summary(prompt: str, account, headers: dict) -> str:
     """调用 Kiro API 生成摘要（内部使用）"""
-    kiro_request = build_kiro_request(prompt, "claude-haiku-4.5", [])  # 用快速模型生成摘要
     try:
-        async with httpx.AsyncClient(verify=False, timeout=60) as client:
-            resp = await client.post(KIRO_API_URL, json=kiro_request, headers=headers)
-            if resp.status_code == 200:
-                return parse_event_stream(resp.content)
+        # 用快速模型生成摘要
+        return await generate_text(prompt, headers)
     except Exception as e:
         print(f"[Summary] API 调用失败: {e}")
     return ""
@@ -114,9 +174,9 @@ async def _call_kiro_for_summary(prompt: str, account, headers: dict) -> str:
 async def handle_messages(request: Request):
     """处理 /v1/messages 请求"""
     start_time = time.time()
-    log_id = uuid.uuid4().hex[:8]
+    log_id = secrets.token_hex(4)
     
-    body = await request.json()
+    body = await jsonutil.read_request(request)
     model = map_model_name(body.get("model", "claude-sonnet-4"))
     messages = body.get("messages", [])
     system = body.get("system", "")
@@ -153,19 +213,13 @@ async def handle_messages(request: Request):
         if not success:
             print(f"[Anthropic] Token 刷新失败: {msg}")
     
-    token = account.get_token()
+    token = await account.get_token_async()
     if not token:
         flow_monitor.fail_flow(flow_id, "authentication_error", f"Failed to get token for account {account.name}")
         raise HTTPException(500, f"Failed to get token for account {account.name}")
     
     # 使用账号的动态 Machine ID（提前构建，供摘要使用）
-    creds = account.get_credentials()
-    headers = build_headers(
-        token,
-        machine_id=account.get_machine_id(),
-        profile_arn=creds.profile_arn if creds else None,
-        client_id=creds.client_id if creds else None
-    )
+    headers = build_headers(token, machine_id=account.get_machine_id())
     
     # 限速检查
     rate_limiter = get_rate_limiter()
@@ -175,11 +229,13 @@ async def handle_messages(request: Request):
         await asyncio.sleep(wait_seconds)
     
     # 转换消息格式
-    user_content, history, tool_results = convert_anthropic_messages_to_kiro(messages, system)
+    user_content, history, tool_results, images = convert_anthropic_messages_to_kiro(messages, system)
     
     # 历史消息预处理
     history_manager = HistoryManager(get_history_config(), cache_key=session_id)
     
+    history = history_manager.dedupe_tool_results(history, tool_results)
+
     # 检查是否需要智能摘要或错误重试预摘要
     async def api_caller(prompt: str) -> str:
         return await _call_kiro_for_summary(prompt, account, headers)
@@ -189,19 +245,11 @@ async def handle_messages(request: Request):
         history = history_manager.pre_process(history, user_content)
     
     # 摘要/截断后再次修复历史交替和 toolUses/toolResults 配对
-    from ..converters import fix_history_alternation
     history = fix_history_alternation(history)
     
     if history_manager.was_truncated:
         print(f"[Anthropic] {history_manager.truncate_info}")
     
-    # 提取最后一条消息中的图片
-    images = []
-    if messages:
-        last_msg = messages[-1]
-        if last_msg.get("role") == "user":
-            _, images = extract_images_from_content(last_msg.get("content", ""))
-    
     # 构建 Kiro 请求
     kiro_tools = convert_anthropic_tools_to_kiro(tools) if tools else None
     kiro_request = build_kiro_request(user_content, model, history, kiro_tools, images, tool_results)
@@ -220,226 +268,199 @@ async def _handle_stream(kiro_request, headers, account, model, log_id, start_ti
         current_account = account
         retry_count = 0
         max_retries = 2
-        full_content = ""
         
         while retry_count <= max_retries:
             try:
-                async with httpx.AsyncClient(verify=False, timeout=300) as client:
-                    async with client.stream("POST", KIRO_API_URL, json=kiro_request, headers=headers) as response:
+                client = get_client()
+                async with client.stream("POST", KIRO_API_URL, content=jsonutil.dumps_bytes(kiro_request), headers=headers) as response:
                         
-                        # 处理配额超限
-                        if response.status_code == 429 or is_quota_exceeded_error(response.status_code, ""):
-                            current_account.mark_quota_exceeded("Rate limited (stream)")
+                    # 处理配额超限
+                    if response.status_code == 429 or is_quota_exceeded_error(response.status_code, ""):
+                        current_account.mark_quota_exceeded("Rate limited (stream)")
                             
-                            # 尝试切换账号
+                        # 尝试切换账号
+                        next_account = state.get_next_available_account(current_account.id)
+                        if next_account and retry_count < max_retries:
+                            print(f"[Stream] 配额超限，切换账号: {current_account.id} -> {next_account.id}")
+                            current_account = next_account
+                            await switch_account_headers(headers, current_account)
+                            retry_count += 1
+                            continue
+                            
+                        if flow_id:
+                            flow_monitor.fail_flow(flow_id, "rate_limit_error", "All accounts rate limited", 429)
+                        yield _sse_error("rate_limit_error", "All accounts rate limited")
+                        return
+
+                    # 处理可重试的服务端错误
+                    if is_retryable_error(response.status_code):
+                        if retry_count < max_retries:
+                            print(f"[Stream] 服务端错误 {response.status_code}，重试 {retry_count + 1}/{max_retries}")
+                            retry_count += 1
+                            await backoff_sleep(retry_count)
+                            continue
+                        if flow_id:
+                            flow_monitor.fail_flow(flow_id, "api_error", "Server error after retries", response.status_code)
+                        yield _sse_error("api_error", "Server error after retries")
+                        return
+
+                    if response.status_code != 200:
+                        error_text = await response.aread()
+                        error_str = error_text.decode()
+                        print(f"=== Kiro API Error ===")
+                        print(f"Status: {response.status_code}")
+                        print(f"Response: {error_str[:500]}")
+                        print(f"Request model: {model}")
+                        print(f"History len: {len(history) if history else 0}")
+                        print(f"Tool results: {len(tool_results) if tool_results else 0}")
+                        # 对于 400 错误，打印更多请求细节（调试模式）
+                        if response.status_code == 400 and DEBUG_REQUESTS:
+                            print(f"Kiro request keys: {list(kiro_request.keys())}")
+                            if 'conversationState' in kiro_request:
+                                cs = kiro_request['conversationState']
+                                print(f"  conversationState keys: {list(cs.keys())}")
+                                if 'currentMessage' in cs:
+                                    cm = cs['currentMessage']
+                                    print(f"  currentMessage keys: {list(cm.keys())}")
+                                    if 'userInputMessage' in cm:
+                                        uim = cm['userInputMessage']
+                                        print(f"  userInputMessage keys: {list(uim.keys())}")
+                                        content = uim.get('content', '')
+                                        print(f"  content (first 200 chars): {str(content)[:200]}")
+                                if 'history' in cs:
+                                    hist = cs['history']
+                                    print(f"  history count: {len(hist) if hist else 0}")
+                                    if hist:
+                                        for i, h in enumerate(hist[:3]):
+                                            print(f"    history[{i}] keys: {list(h.keys()) if isinstance(h, dict) else type(h)}")
+                        print(f"======================")
+                            
+                        # 使用统一的错误处理
+                        http_status, error_type, error_msg, error_obj = _handle_kiro_error(
+                            response.status_code, error_str, current_account
+                        )
+                            
+                        # 账号封禁 - 尝试切换账号
+                        if error_obj.should_switch_account:
                             next_account = state.get_next_available_account(current_account.id)
                             if next_account and retry_count < max_retries:
-                                print(f"[Stream] 配额超限，切换账号: {current_account.id} -> {next_account.id}")
+                                print(f"[Stream] 切换账号: {current_account.id} -> {next_account.id}")
                                 current_account = next_account
-                                token = current_account.get_token()
-                                headers["Authorization"] = f"Bearer {token}"
+                                await switch_account_headers(headers, current_account)
                                 retry_count += 1
                                 continue
                             
-                            if flow_id:
-                                flow_monitor.fail_flow(flow_id, "rate_limit_error", "All accounts rate limited", 429)
-                            yield f'data: {{"type":"error","error":{{"type":"rate_limit_error","message":"All accounts rate limited"}}}}\n\n'
-                            return
-
-                        # 处理可重试的服务端错误
-                        if is_retryable_error(response.status_code):
-                            if retry_count < max_retries:
-                                print(f"[Stream] 服务端错误 {response.status_code}，重试 {retry_count + 1}/{max_retries}")
+                        # 检查是否为内容长度超限错误，尝试截断重试
+                        if error_obj.type == ErrorType.CONTENT_TOO_LONG:
+                            history_chars, user_chars, total_chars = history_manager.estimate_request_chars(
+                                history, user_content
+                            )
+                            print(f"[Stream] 内容长度超限: history={history_chars} chars, user={user_chars} chars, total={total_chars} chars")
+                            async def api_caller(prompt: str) -> str:
+                                return await _call_kiro_for_summary(prompt, current_account, headers)
+                            truncated_history, should_retry = await history_manager.handle_length_error_async(
+                                history, retry_count, api_caller
+                            )
+                            if should_retry:
+                                print(f"[Stream] 内容长度超限，{history_manager.truncate_info}")
+                                history = truncated_history
+                                # 重新构建请求
+                                kiro_request = build_kiro_request(user_content, model, history, kiro_tools, images, tool_results)
                                 retry_count += 1
-                                import asyncio
-                                await asyncio.sleep(0.5 * (2 ** retry_count))
                                 continue
-                            if flow_id:
-                                flow_monitor.fail_flow(flow_id, "api_error", "Server error after retries", response.status_code)
-                            yield f'data: {{"type":"error","error":{{"type":"api_error","message":"Server error after retries"}}}}\n\n'
-                            return
-
-                        if response.status_code != 200:
-                            error_text = await response.aread()
-                            error_str = error_text.decode()
-                            print(f"=== Kiro API Error ===")
-                            print(f"Status: {response.status_code}")
-                            print(f"Response: {error_str[:500]}")
-                            print(f"Request model: {model}")
-                            print(f"History len: {len(history) if history else 0}")
-                            print(f"Tool results: {len(tool_results) if tool_results else 0}")
-                            # 对于 400 错误，打印更多请求细节
-                            if response.status_code == 400:
-                                print(f"Kiro request keys: {list(kiro_request.keys())}")
-                                if 'conversationState' in kiro_request:
-                                    cs = kiro_request['conversationState']
-                                    print(f"  conversationState keys: {list(cs.keys())}")
-                                    if 'currentMessage' in cs:
-                                        cm = cs['currentMessage']
-                                        print(f"  currentMessage keys: {list(cm.keys())}")
-                                        if 'userInputMessage' in cm:
-                                            uim = cm['userInputMessage']
-                                            print(f"  userInputMessage keys: {list(uim.keys())}")
-                                            content = uim.get('content', '')
-                                            print(f"  content (first 200 chars): {str(content)[:200]}")
-                                    if 'history' in cs:
-                                        hist = cs['history']
-                                        print(f"  history count: {len(hist) if hist else 0}")
-                                        if hist:
-                                            for i, h in enumerate(hist[:3]):
-                                                print(f"    history[{i}] keys: {list(h.keys()) if isinstance(h, dict) else type(h)}")
-                            print(f"======================")
-                            
-                            # 使用统一的错误处理
-                            http_status, error_type, error_msg, error_obj = _handle_kiro_error(
-                                response.status_code, error_str, current_account
-                            )
-                            
-                            # 账号封禁 - 尝试切换账号
-                            if error_obj.should_switch_account:
-                                next_account = state.get_next_available_account(current_account.id)
-                                if next_account and retry_count < max_retries:
-                                    print(f"[Stream] 切换账号: {current_account.id} -> {next_account.id}")
-                                    current_account = next_account
-                                    headers["Authorization"] = f"Bearer {current_account.get_token()}"
-                                    retry_count += 1
-                                    continue
-                            
-                            # 检查是否为内容长度超限错误，尝试截断重试
-                            if error_obj.type == ErrorType.CONTENT_TOO_LONG:
-                                history_chars, user_chars, total_chars = history_manager.estimate_request_chars(
-                                    history, user_content
-                                )
-                                print(f"[Stream] 内容长度超限: history={history_chars} chars, user={user_chars} chars, total={total_chars} chars")
-                                async def api_caller(prompt: str) -> str:
-                                    return await _call_kiro_for_summary(prompt, current_account, headers)
-                                truncated_history, should_retry = await history_manager.handle_length_error_async(
-                                    history, retry_count, api_caller
-                                )
-                                if should_retry:
-                                    print(f"[Stream] 内容长度超限，{history_manager.truncate_info}")
-                                    history = truncated_history
-                                    # 重新构建请求
-                                    kiro_request = build_kiro_request(user_content, model, history, kiro_tools, images, tool_results)
-                                    retry_count += 1
-                                    continue
                             
-                            if flow_id:
-                                flow_monitor.fail_flow(flow_id, error_type, error_msg, response.status_code, error_str)
-                            yield f'data: {{"type":"error","error":{{"type":"{error_type}","message":"{error_msg}"}}}}\n\n'
-                            return
-
-                        # 标记开始流式传输
-                        if flow_id:
-                            flow_monitor.start_streaming(flow_id)
-
-                        # 正常处理响应
-                        msg_id = f"msg_{log_id}"
-                        yield f'data: {{"type":"message_start","message":{{"id":"{msg_id}","type":"message","role":"assistant","content":[],"model":"{model}","stop_reason":null,"stop_sequence":null,"usage":{{"input_tokens":0,"output_tokens":0}}}}}}\n\n'
-                        yield f'data: {{"type":"content_block_start","index":0,"content_block":{{"type":"text","text":""}}}}\n\n'
-
-                        full_response = b""
-
-                        async for chunk in response.aiter_bytes():
-                            full_response += chunk
-
-                            try:
-                                pos = 0
-                                while pos < len(chunk):
-                                    if pos + 12 > len(chunk):
-                                        break
-                                    total_len = int.from_bytes(chunk[pos:pos+4], 'big')
-                                    if total_len == 0 or total_len > len(chunk) - pos:
-                                        break
-                                    headers_len = int.from_bytes(chunk[pos+4:pos+8], 'big')
-                                    payload_start = pos + 12 + headers_len
-                                    payload_end = pos + total_len - 4
-
-                                    if payload_start < payload_end:
-                                        try:
-                                            payload = json.loads(chunk[payload_start:payload_end].decode('utf-8'))
-                                            content = None
-                                            if 'assistantResponseEvent' in payload:
-                                                content = payload['assistantResponseEvent'].get('content')
-                                            elif 'content' in payload:
-                                                content = payload['content']
-                                            if content:
-                                                full_content += content
-                                                if flow_id:
-                                                    flow_monitor.add_chunk(flow_id, content)
-                                                yield f'data: {{"type":"content_block_delta","index":0,"delta":{{"type":"text_delta","text":{json.dumps(content)}}}}}\n\n'
-                                        except Exception:
-                                            pass
-                                    pos += total_len
-                            except Exception:
-                                pass
-
-                        result = parse_event_stream_full(full_response)
-
-                        yield f'data: {{"type":"content_block_stop","index":0}}\n\n'
-
-                        if result["tool_uses"]:
-                            for i, tool_use in enumerate(result["tool_uses"], 1):
-                                yield f'data: {{"type":"content_block_start","index":{i},"content_block":{{"type":"tool_use","id":"{tool_use["id"]}","name":"{tool_use["name"]}","input":{{}}}}}}\n\n'
-                                yield f'data: {{"type":"content_block_delta","index":{i},"delta":{{"type":"input_json_delta","partial_json":{json.dumps(json.dumps(tool_use["input"]))}}}}}\n\n'
-                                yield f'data: {{"type":"content_block_stop","index":{i}}}\n\n'
-
-                        stop_reason = result["stop_reason"]
-                        yield f'data: {{"type":"message_delta","delta":{{"stop_reason":"{stop_reason}","stop_sequence":null}},"usage":{{"output_tokens":0}}}}\n\n'
-                        yield f'data: {{"type":"message_stop"}}\n\n'
-
-                        # 完成 Flow
                         if flow_id:
-                            flow_monitor.complete_flow(
-                                flow_id,
-                                status_code=200,
-                                content=full_content,
-                                tool_calls=result.get("tool_uses", []),
-                                stop_reason=stop_reason,
-                                usage=TokenUsage(
-                                    input_tokens=result.get("input_tokens", 0),
-                                    output_tokens=result.get("output_tokens", 0),
-                                ),
-                            )
-
-                        current_account.request_count += 1
-                        current_account.last_used = time.time()
-                        get_rate_limiter().record_request(current_account.id)
+                            flow_monitor.fail_flow(flow_id, error_type, error_msg, response.status_code, error_str)
+                        yield _sse_error(error_type, error_msg)
                         return
 
+                    # 标记开始流式传输
+                    if flow_id:
+                        flow_monitor.start_streaming(flow_id)
+
+                    # 正常处理响应
+                    msg_id = f"msg_{log_id}"
+                    yield _sse_message_start(msg_id, model) + _SSE_TEXT_BLOCK_START
+
+                    # 增量解析：跨 chunk 的帧会被缓存，每帧只解析一次
+                    # 请求未带 tools 时不会有工具调用，跳过工具事件的记录
+                    parser = EventStreamParser(text_only=not kiro_tools)
+
+                    async for chunk in response.aiter_bytes():
+                        # 同一个网络 chunk 解析出的多帧合并为一次 yield，减少 ASGI send 次数
+                        out = []
+                        for content in parser.feed(chunk):
+                            if flow_id:
+                                flow_monitor.add_chunk(flow_id, content)
+                            out.append(_SSE_TEXT_DELTA_PREFIX + jsonutil.dumps_bytes(content) + _SSE_TEXT_DELTA_SUFFIX)
+                        if out:
+                            yield b"".join(out)
+
+                    result = parser.result()
+
+                    # 上游结束后剩余的事件（文本块结束、工具块、message_delta/stop）一次性发送
+                    tail = [_SSE_TEXT_BLOCK_STOP]
+                    for i, tool_use in enumerate(result["tool_uses"], 1):
+                        tail.append(_sse_data({"type": "content_block_start", "index": i, "content_block": {"type": "tool_use", "id": tool_use["id"], "name": tool_use["name"], "input": {}}}))
+                        # partial_json 是 JSON 字符串：只对 input 编码一次，再作为字符串字面量嵌入
+                        partial_json = jsonutil.dumps_bytes(jsonutil.dumps(tool_use["input"]))
+                        tail.append(_SSE_TOOL_DELTA_PREFIX % i + partial_json + _SSE_TOOL_DELTA_SUFFIX)
+                        tail.append(_SSE_BLOCK_STOP % i)
+
+                    stop_reason = result["stop_reason"]
+                    tail.append(_SSE_MESSAGE_DELTA[stop_reason])
+                    tail.append(_SSE_MESSAGE_STOP)
+                    yield b"".join(tail)
+
+                    # 完成 Flow
+                    if flow_id:
+                        flow_monitor.complete_flow(
+                            flow_id,
+                            status_code=200,
+                            content="".join(result["content"]),
+                            tool_calls=result.get("tool_uses", []),
+                            stop_reason=stop_reason,
+                            usage=TokenUsage(
+                                input_tokens=result.get("input_tokens", 0),
+                                output_tokens=result.get("output_tokens", 0),
+                            ),
+                        )
+
+                    current_account.request_count += 1
+                    current_account.last_used = time.time()
+                    get_rate_limiter().record_request(current_account.id)
+                    return
+
             except httpx.TimeoutException:
                 if retry_count < max_retries:
                     print(f"[Stream] 请求超时，重试 {retry_count + 1}/{max_retries}")
                     retry_count += 1
-                    import asyncio
-                    await asyncio.sleep(0.5 * (2 ** retry_count))
+                    await backoff_sleep(retry_count)
                     continue
                 if flow_id:
                     flow_monitor.fail_flow(flow_id, "timeout_error", "Request timeout after retries", 408)
-                yield f'data: {{"type":"error","error":{{"type":"api_error","message":"Request timeout after retries"}}}}\n\n'
+                yield _sse_error("api_error", "Request timeout after retries")
                 return
             except httpx.ConnectError:
                 if retry_count < max_retries:
                     print(f"[Stream] 连接错误，重试 {retry_count + 1}/{max_retries}")
                     retry_count += 1
-                    import asyncio
-                    await asyncio.sleep(0.5 * (2 ** retry_count))
+                    await backoff_sleep(retry_count)
                     continue
                 if flow_id:
                     flow_monitor.fail_flow(flow_id, "connection_error", "Connection error after retries", 502)
-                yield f'data: {{"type":"error","error":{{"type":"api_error","message":"Connection error after retries"}}}}\n\n'
+                yield _sse_error("api_error", "Connection error after retries")
                 return
             except Exception as e:
                 # 检查是否为可重试的网络错误
                 if is_retryable_error(None, e) and retry_count < max_retries:
                     print(f"[Stream] 网络错误，重试 {retry_count + 1}/{max_retries}: {type(e).__name__}")
                     retry_count += 1
-                    import asyncio
-                    await asyncio.sleep(0.5 * (2 ** retry_count))
+                    await backoff_sleep(retry_count)
                     continue
                 if flow_id:
                     flow_monitor.fail_flow(flow_id, "api_error", str(e), 500)
-                yield f'data: {{"type":"error","error":{{"type":"api_error","message":"{str(e)}"}}}}\n\n'
+                yield _sse_error("api_error", str(e))
                 return
 
     return StreamingResponse(generate(), media_type="text/event-stream")
@@ -455,12 +476,14 @@ async def _handle_non_stream(kiro_request, headers, account, model, log_id, star
 
     for retry in range(max_retries + 1):
         try:
-            async with httpx.AsyncClient(verify=False, timeout=300) as client:
-                response = await client.post(KIRO_API_URL, json=kiro_request, headers=headers)
+            client = get_client()
+            async with client.stream("POST", KIRO_API_URL, content=jsonutil.dumps_bytes(kiro_request), headers=headers) as response:
                 status_code = response.status_code
+                # 仅错误响应需要完整读取 body，正常响应边接收边解析
+                error_text = "" if status_code == 200 else (await response.aread()).decode(errors="replace")
 
                 # 处理配额超限
-                if response.status_code == 429 or is_quota_exceeded_error(response.status_code, response.text):
+                if response.status_code == 429 or is_quota_exceeded_error(response.status_code, error_text):
                     current_account.mark_quota_exceeded("Rate limited")
                     
                     # 尝试切换账号
@@ -468,9 +491,7 @@ async def _handle_non_stream(kiro_request, headers, account, model, log_id, star
                     if next_account and retry < max_retries:
                         print(f"[NonStream] 配额超限，切换账号: {current_account.id} -> {next_account.id}")
                         current_account = next_account
-                        token = current_account.get_token()
-                        creds = current_account.get_credentials()
-                        headers["Authorization"] = f"Bearer {token}"
+                        await switch_account_headers(headers, current_account)
                         continue
                     
                     if flow_id:
@@ -488,7 +509,7 @@ async def _handle_non_stream(kiro_request, headers, account, model, log_id, star
                     raise HTTPException(response.status_code, f"Server error after {max_retries} retries")
 
                 if response.status_code != 200:
-                    error_msg = response.text
+                    error_msg = error_text
                     print(f"[NonStream] Kiro API Error {response.status_code}: {error_msg[:500]}")
                     
                     # 使用统一的错误处理
@@ -502,7 +523,7 @@ async def _handle_non_stream(kiro_request, headers, account, model, log_id, star
                         if next_account and retry < max_retries:
                             print(f"[NonStream] 切换账号: {current_account.id} -> {next_account.id}")
                             current_account = next_account
-                            headers["Authorization"] = f"Bearer {current_account.get_token()}"
+                            await switch_account_headers(headers, current_account)
                             continue
                     
                     # 检查是否为内容长度超限错误，尝试截断重试
@@ -528,26 +549,30 @@ async def _handle_non_stream(kiro_request, headers, account, model, log_id, star
                         flow_monitor.fail_flow(flow_id, error_type, error_message, status, error_msg)
                     raise HTTPException(status, error_message)
 
-                result = parse_event_stream_full(response.content)
-                current_account.request_count += 1
-                current_account.last_used = time.time()
-                get_rate_limiter().record_request(current_account.id)
+                parser = EventStreamParser(text_only=not kiro_tools)
+                async for chunk in response.aiter_bytes():
+                    parser.feed(chunk)
+                result = parser.result()
 
-                # 完成 Flow
-                if flow_id:
-                    flow_monitor.complete_flow(
-                        flow_id,
-                        status_code=200,
-                        content=result.get("text", ""),
-                        tool_calls=result.get("tool_uses", []),
-                        stop_reason=result.get("stop_reason", ""),
-                        usage=TokenUsage(
-                            input_tokens=result.get("input_tokens", 0),
-                            output_tokens=result.get("output_tokens", 0),
-                        ),
-                    )
+            current_account.request_count += 1
+            current_account.last_used = time.time()
+            get_rate_limiter().record_request(current_account.id)
+
+            # 完成 Flow
+            if flow_id:
+                flow_monitor.complete_flow(
+                    flow_id,
+                    status_code=200,
+                    content=result.get("text", ""),
+                    tool_calls=result.get("tool_uses", []),
+                    stop_reason=result.get("stop_reason", ""),
+                    usage=TokenUsage(
+                        input_tokens=result.get("input_tokens", 0),
+                        output_tokens=result.get("output_tokens", 0),
+                    ),
+                )
 
-                return convert_kiro_response_to_anthropic(result, model, f"msg_{log_id}")
+            return convert_kiro_response_to_anthropic(result, model, f"msg_{log_id}")
 
         except HTTPException:
             raise
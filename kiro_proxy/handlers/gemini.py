@@ -1,28 +1,34 @@
 """Gemini 协议处理 - /v1/models/{model}:generateContent"""
-import json
-import uuid
+import secrets
 import time
-import hashlib
 import asyncio
 import httpx
 from fastapi import Request, HTTPException
 
 from ..config import KIRO_API_URL, map_model_name
-from ..core import state, is_retryable_error
+from .. import jsonutil
+from ..core import state, is_retryable_error, backoff_sleep, get_client
 from ..core.state import RequestLog
 from ..core.history_manager import HistoryManager, get_history_config, is_content_length_error
 from ..core.error_handler import classify_error, ErrorType, format_error_log
 from ..core.rate_limiter import get_rate_limiter
-from ..kiro_api import build_headers, build_kiro_request, parse_event_stream, parse_event_stream_full, is_quota_exceeded_error
-from ..converters import convert_gemini_contents_to_kiro, convert_kiro_response_to_gemini, convert_gemini_tools_to_kiro
+from ..kiro_api import build_headers, switch_account_headers, build_kiro_request, generate_text, is_quota_exceeded_error, EventStreamParser
+from ..credential import CredentialStatus
+from ..converters import (
+    generate_session_id,
+    convert_gemini_contents_to_kiro,
+    convert_kiro_response_to_gemini,
+    convert_gemini_tools_to_kiro,
+    fix_history_alternation,
+)
 
 
 async def handle_generate_content(model_name: str, request: Request):
     """处理 Gemini generateContent 请求"""
     start_time = time.time()
-    log_id = uuid.uuid4().hex[:8]
+    log_id = secrets.token_hex(4)
     
-    body = await request.json()
+    body = await jsonutil.read_request(request)
     contents = body.get("contents", [])
     system_instruction = body.get("systemInstruction", {})
     tools = body.get("tools", [])
@@ -31,7 +37,7 @@ async def handle_generate_content(model_name: str, request: Request):
     model_raw = model_name.replace("models/", "")
     model = map_model_name(model_raw)
     
-    session_id = hashlib.sha256(json.dumps(contents[:3], sort_keys=True).encode()).hexdigest()[:16]
+    session_id = generate_session_id(contents)
     account = state.get_available_account(session_id)
     
     if not account:
@@ -44,18 +50,12 @@ async def handle_generate_content(model_name: str, request: Request):
         if not success:
             print(f"[Gemini] Token 刷新失败: {msg}")
     
-    token = account.get_token()
+    token = await account.get_token_async()
     if not token:
         raise HTTPException(500, f"Failed to get token for account {account.name}")
     
     # 构建 headers（提前构建，供摘要使用）
-    creds = account.get_credentials()
-    headers = build_headers(
-        token,
-        machine_id=account.get_machine_id(),
-        profile_arn=creds.profile_arn if creds else None,
-        client_id=creds.client_id if creds else None
-    )
+    headers = build_headers(token, machine_id=account.get_machine_id())
     
     # 限速检查
     rate_limiter = get_rate_limiter()
@@ -73,16 +73,14 @@ async def handle_generate_content(model_name: str, request: Request):
     history_manager = HistoryManager(get_history_config(), cache_key=session_id)
     
     async def call_summary(prompt: str) -> str:
-        req = build_kiro_request(prompt, "claude-haiku-4.5", [])
         try:
-            async with httpx.AsyncClient(verify=False, timeout=60) as client:
-                resp = await client.post(KIRO_API_URL, json=req, headers=headers)
-                if resp.status_code == 200:
-                    return parse_event_stream(resp.content)
+            return await generate_text(prompt, headers)
         except Exception as e:
             print(f"[Summary] API 调用失败: {e}")
         return ""
 
+    history = history_manager.dedupe_tool_results(history, tool_results)
+
     # 检查是否需要智能摘要或错误重试预摘要
     if history_manager.should_summarize(history) or history_manager.should_pre_summary_for_error_retry(history, user_content):
         history = await history_manager.pre_process_async(history, user_content, call_summary)
@@ -90,19 +88,14 @@ async def handle_generate_content(model_name: str, request: Request):
         history = history_manager.pre_process(history, user_content)
     
     # 摘要/截断后再次修复历史交替和 toolUses/toolResults 配对
-    from ..converters import fix_history_alternation
     history = fix_history_alternation(history)
     
     if history_manager.was_truncated:
         print(f"[Gemini] {history_manager.truncate_info}")
 
     async def call_summary(prompt: str) -> str:
-        req = build_kiro_request(prompt, "claude-haiku-4.5", [])
         try:
-            async with httpx.AsyncClient(verify=False, timeout=60) as client:
-                resp = await client.post(KIRO_API_URL, json=req, headers=headers)
-                if resp.status_code == 200:
-                    return parse_event_stream(resp.content)
+            return await generate_text(prompt, headers)
         except Exception as e:
             print(f"[Summary] API 调用失败: {e}")
         return ""
@@ -122,25 +115,20 @@ async def handle_generate_content(model_name: str, request: Request):
     
     for retry in range(max_retries + 1):
         try:
-            async with httpx.AsyncClient(verify=False, timeout=120) as client:
-                resp = await client.post(KIRO_API_URL, json=kiro_request, headers=headers)
+            client = get_client()
+            async with client.stream("POST", KIRO_API_URL, content=jsonutil.dumps_bytes(kiro_request), headers=headers, timeout=120) as resp:
                 status_code = resp.status_code
+                # 仅错误响应需要完整读取 body，正常响应边接收边解析
+                error_text = "" if status_code == 200 else (await resp.aread()).decode(errors="replace")
                 
                 # 处理配额超限
-                if resp.status_code == 429 or is_quota_exceeded_error(resp.status_code, resp.text):
+                if resp.status_code == 429 or is_quota_exceeded_error(resp.status_code, error_text):
                     current_account.mark_quota_exceeded("Rate limited")
                     next_account = state.get_next_available_account(current_account.id)
                     if next_account and retry < max_retries:
                         print(f"[Gemini] 配额超限，切换账号: {current_account.id} -> {next_account.id}")
                         current_account = next_account
-                        token = current_account.get_token()
-                        creds = current_account.get_credentials()
-                        headers = build_headers(
-                            token,
-                            machine_id=current_account.get_machine_id(),
-                            profile_arn=creds.profile_arn if creds else None,
-                            client_id=creds.client_id if creds else None
-                        )
+                        await switch_account_headers(headers, current_account)
                         continue
                     raise HTTPException(429, "All accounts rate limited")
                 
@@ -148,13 +136,12 @@ async def handle_generate_content(model_name: str, request: Request):
                 if is_retryable_error(resp.status_code):
                     if retry < max_retries:
                         print(f"[Gemini] 服务端错误 {resp.status_code}，重试 {retry + 1}/{max_retries}")
-                        import asyncio
-                        await asyncio.sleep(0.5 * (2 ** retry))
+                        await backoff_sleep(retry)
                         continue
                     raise HTTPException(resp.status_code, f"Server error after {max_retries} retries")
                 
                 if resp.status_code != 200:
-                    error_msg = resp.text
+                    error_msg = error_text
                     
                     # 使用统一的错误处理
                     error = classify_error(resp.status_code, error_msg)
@@ -163,7 +150,6 @@ async def handle_generate_content(model_name: str, request: Request):
                     # 账号封禁 - 禁用账号
                     if error.should_disable_account:
                         current_account.enabled = False
-                        from ..credential import CredentialStatus
                         current_account.status = CredentialStatus.SUSPENDED
                         print(f"[Gemini] 账号 {current_account.id} 已被禁用 (封禁)")
                     
@@ -177,7 +163,7 @@ async def handle_generate_content(model_name: str, request: Request):
                         if next_account and retry < max_retries:
                             print(f"[Gemini] 切换账号: {current_account.id} -> {next_account.id}")
                             current_account = next_account
-                            headers["Authorization"] = f"Bearer {current_account.get_token()}"
+                            await switch_account_headers(headers, current_account)
                             continue
                     
                     # 检查是否为内容长度超限错误
@@ -203,12 +189,15 @@ async def handle_generate_content(model_name: str, request: Request):
                     
                     raise HTTPException(resp.status_code, error.user_message)
                 
-                # 使用完整解析以支持工具调用
-                result = parse_event_stream_full(resp.content)
-                current_account.request_count += 1
-                current_account.last_used = time.time()
-                get_rate_limiter().record_request(current_account.id)
-                break
+                # 边接收边解析（包含工具调用）
+                parser = EventStreamParser()
+                async for chunk in resp.aiter_bytes():
+                    parser.feed(chunk)
+                result = parser.result()
+            current_account.request_count += 1
+            current_account.last_used = time.time()
+            get_rate_limiter().record_request(current_account.id)
+            break
                 
         except HTTPException:
             raise
@@ -217,8 +206,7 @@ async def handle_generate_content(model_name: str, request: Request):
             status_code = 408
             if retry < max_retries:
                 print(f"[Gemini] 请求超时，重试 {retry + 1}/{max_retries}")
-                import asyncio
-                await asyncio.sleep(0.5 * (2 ** retry))
+                await backoff_sleep(retry)
                 continue
             raise HTTPException(408, "Request timeout after retries")
         except httpx.ConnectError:
@@ -226,8 +214,7 @@ async def handle_generate_content(model_name: str, request: Request):
             status_code = 502
             if retry < max_retries:
                 print(f"[Gemini] 连接错误，重试 {retry + 1}/{max_retries}")
-                import asyncio
-                await asyncio.sleep(0.5 * (2 ** retry))
+                await backoff_sleep(retry)
                 continue
             raise HTTPException(502, "Connection error after retries")
         except Exception as e:
@@ -235,8 +222,7 @@ async def handle_generate_content(model_name: str, request: Request):
             status_code = 500
             if is_retryable_error(None, e) and retry < max_retries:
                 print(f"[Gemini] 网络错误，重试 {retry + 1}/{max_retries}: {type(e).__name__}")
-                import asyncio
-                await asyncio.sleep(0.5 * (2 ** retry))
+                await backoff_sleep(retry)
                 continue
             raise HTTPException(500, str(e))
     
@@ -1,6 +1,5 @@
 """OpenAI 协议处理 - /v1/chat/completions"""
-import json
-import uuid
+import secrets
 import time
 import asyncio
 import httpx
@@ -9,128 +8,71 @@ from fastapi import Request, HTTPException
 from fastapi.responses import StreamingResponse
 
 from ..config import KIRO_API_URL, map_model_name, parse_stream_mode
-from ..core import state, is_retryable_error, stats_manager
+from .. import jsonutil
+from ..core import state, is_retryable_error, backoff_sleep, stats_manager, get_client
 from ..core.state import RequestLog
 from ..core.history_manager import HistoryManager, get_history_config, is_content_length_error
 from ..core.error_handler import classify_error, ErrorType, format_error_log
 from ..core.rate_limiter import get_rate_limiter
-from ..kiro_api import build_headers, build_kiro_request, parse_event_stream, is_quota_exceeded_error
-from ..converters import generate_session_id, convert_openai_messages_to_kiro, extract_images_from_content
+from ..kiro_api import build_headers, switch_account_headers, build_kiro_request, generate_text, is_quota_exceeded_error, EventStreamParser
+from ..credential import CredentialStatus
+from ..converters import generate_session_id, convert_openai_messages_to_kiro, fix_history_alternation
+
+
+# 流式文本 chunk 的固定后缀（前缀每个流由 _chunk_delta_prefix 生成一次）
+_CHUNK_DELTA_SUFFIX = b'},"finish_reason":null}]}\n\n'
+_SSE_DONE = b"data: [DONE]\n\n"
+
+
+def _sse_data(data: dict) -> bytes:
+    """编码单个 SSE data 帧"""
+    return b"data: " + jsonutil.dumps_bytes(data) + b"\n\n"
+
+
+def _chunk_delta_prefix(log_id: str, model: str, created: int) -> bytes:
+    """流式文本 chunk 中 content 之前的部分（预编码为 bytes，逐帧只需序列化文本）"""
+    head = jsonutil.dumps_bytes({
+        "id": f"chatcmpl-{log_id}",
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+    })
+    return b"data: " + head[:-1] + b',"choices":[{"index":0,"delta":{"content":'
 
 
 class KiroStreamParser:
-    """Kiro event-stream 流式解析器，支持文本和工具调用"""
+    """Kiro event-stream 流式解析器，支持文本和工具调用（OpenAI 格式）"""
     
     def __init__(self):
-        self.buffer = b""
-        self.tool_buffers = {}  # tool_id -> {name, input_parts}
-        self.processed_pos = 0
+        self._parser = EventStreamParser()
     
     def feed(self, data: bytes) -> tuple[list[str], list[dict]]:
         """
         喂入数据，返回 (文本列表, 完成的工具调用列表)
         """
-        self.buffer += data
-        texts = []
-        completed_tools = []
-        
-        pos = self.processed_pos
-        while pos < len(self.buffer):
-            if pos + 12 > len(self.buffer):
-                break  # 不完整的帧头，等待更多数据
-            
-            total_len = int.from_bytes(self.buffer[pos:pos+4], 'big')
-            headers_len = int.from_bytes(self.buffer[pos+4:pos+8], 'big')
-            
-            if total_len == 0:
-                pos += 4
-                continue
-            
-            if pos + total_len > len(self.buffer):
-                break  # 不完整的帧，等待更多数据
-            
-            # 解析 headers 判断事件类型
-            header_start = pos + 12
-            header_end = header_start + headers_len
-            headers_data = self.buffer[header_start:header_end]
-            
-            event_type = None
-            try:
-                headers_str = headers_data.decode('utf-8', errors='ignore')
-                if 'toolUseEvent' in headers_str:
-                    event_type = 'toolUseEvent'
-                elif 'assistantResponseEvent' in headers_str:
-                    event_type = 'assistantResponseEvent'
-            except:
-                pass
-            
-            # 解析 payload
-            payload_start = pos + 12 + headers_len
-            payload_end = pos + total_len - 4
-            
-            if payload_start < payload_end:
-                try:
-                    payload = json.loads(self.buffer[payload_start:payload_end].decode('utf-8'))
-                    
-                    # 文本内容 - Kiro 直接返回 {"content": "..."} 格式
-                    if 'assistantResponseEvent' in payload:
-                        content = payload['assistantResponseEvent'].get('content', '')
-                        if content:
-                            texts.append(content)
-                    elif 'content' in payload and event_type != 'toolUseEvent':
-                        # 直接的 content 字段
-                        content = payload.get('content', '')
-                        if content:
-                            texts.append(content)
-                    
-                    # 工具调用
-                    if event_type == 'toolUseEvent' or 'toolUseId' in payload:
-                        tool_id = payload.get('toolUseId', '')
-                        tool_name = payload.get('name', '')
-                        tool_input = payload.get('input', '')
-                        
-                        if tool_id:
-                            if tool_id not in self.tool_buffers:
-                                self.tool_buffers[tool_id] = {"name": tool_name, "input_parts": []}
-                            if tool_name and not self.tool_buffers[tool_id]["name"]:
-                                self.tool_buffers[tool_id]["name"] = tool_name
-                            if tool_input:
-                                self.tool_buffers[tool_id]["input_parts"].append(tool_input)
-                except:
-                    pass
-            
-            pos += total_len
-        
-        self.processed_pos = pos
-        return texts, completed_tools
+        return self._parser.feed(data), []
     
     def get_tool_calls(self) -> list[dict]:
         """获取所有工具调用（流结束时调用）"""
-        tools = []
-        for tool_id, data in self.tool_buffers.items():
-            input_str = "".join(data["input_parts"])
-            try:
-                input_json = json.loads(input_str)
-            except:
-                input_json = {"raw": input_str}
-            
-            tools.append({
-                "id": tool_id,
+        return [
+            {
+                "id": tool_use["id"],
                 "type": "function",
                 "function": {
-                    "name": data["name"],
-                    "arguments": json.dumps(input_json)
+                    "name": tool_use["name"],
+                    "arguments": jsonutil.dumps(tool_use["input"])
                 }
-            })
-        return tools
+            }
+            for tool_use in self._parser.get_tool_uses()
+        ]
 
 
 async def handle_chat_completions(request: Request):
     """处理 /v1/chat/completions 请求"""
     start_time = time.time()
-    log_id = uuid.uuid4().hex[:8]
+    log_id = secrets.token_hex(4)
     
-    body = await request.json()
+    body = await jsonutil.read_request(request)
     raw_model = body.get("model", "claude-sonnet-4")
     
     # 解析流式模式前缀
@@ -158,18 +100,12 @@ async def handle_chat_completions(request: Request):
         if not success:
             print(f"[OpenAI] Token 刷新失败: {msg}")
     
-    token = account.get_token()
+    token = await account.get_token_async()
     if not token:
         raise HTTPException(500, f"Failed to get token for account {account.name}")
     
     # 使用账号的动态 Machine ID（提前构建，供摘要使用）
-    creds = account.get_credentials()
-    headers = build_headers(
-        token,
-        machine_id=account.get_machine_id(),
-        profile_arn=creds.profile_arn if creds else None,
-        client_id=creds.client_id if creds else None
-    )
+    headers = build_headers(token, machine_id=account.get_machine_id())
     
     # 限速检查
     rate_limiter = get_rate_limiter()
@@ -179,7 +115,7 @@ async def handle_chat_completions(request: Request):
         await asyncio.sleep(wait_seconds)
     
     # 使用增强的转换函数
-    user_content, history, tool_results, kiro_tools = convert_openai_messages_to_kiro(
+    user_content, history, tool_results, kiro_tools, images = convert_openai_messages_to_kiro(
         messages, model, tools, tool_choice
     )
     
@@ -187,16 +123,14 @@ async def handle_chat_completions(request: Request):
     history_manager = HistoryManager(get_history_config(), cache_key=session_id)
     
     async def call_summary(prompt: str) -> str:
-        req = build_kiro_request(prompt, "claude-haiku-4.5", [])
         try:
-            async with httpx.AsyncClient(verify=False, timeout=60) as client:
-                resp = await client.post(KIRO_API_URL, json=req, headers=headers)
-                if resp.status_code == 200:
-                    return parse_event_stream(resp.content)
+            return await generate_text(prompt, headers)
         except Exception as e:
             print(f"[Summary] API 调用失败: {e}")
         return ""
 
+    history = history_manager.dedupe_tool_results(history, tool_results)
+
     # 检查是否需要智能摘要或错误重试预摘要
     if history_manager.should_summarize(history) or history_manager.should_pre_summary_for_error_retry(history, user_content):
         history = await history_manager.pre_process_async(history, user_content, call_summary)
@@ -204,20 +138,12 @@ async def handle_chat_completions(request: Request):
         history = history_manager.pre_process(history, user_content)
     
     # 摘要/截断后再次修复历史交替和 toolUses/toolResults 配对
-    from ..converters import fix_history_alternation
     history = fix_history_alternation(history)
     
     if history_manager.was_truncated:
         print(f"[OpenAI] {history_manager.truncate_info}")
 
     
-    # 提取最后一条消息中的图片
-    images = []
-    if messages:
-        last_msg = messages[-1]
-        if last_msg.get("role") == "user":
-            _, images = extract_images_from_content(last_msg.get("content", ""))
-    
     kiro_request = build_kiro_request(
         user_content, model, history, 
         images=images,
@@ -239,95 +165,91 @@ async def handle_chat_completions(request: Request):
             parser = KiroStreamParser()
             
             try:
-                async with httpx.AsyncClient(verify=False, timeout=120) as client:
-                    async with client.stream("POST", KIRO_API_URL, json=kiro_request, headers=headers) as resp:
-                        status_code = resp.status_code
-                        
-                        if resp.status_code != 200:
-                            error_text = await resp.aread()
-                            error_msg = error_text.decode('utf-8', errors='ignore')[:500]
-                            
-                            # 记录错误统计
-                            duration = (time.time() - stream_start) * 1000
-                            stats_manager.record_request(
-                                account_id=current_account.id,
-                                model=model,
-                                success=False,
-                                latency_ms=duration
-                            )
-                            
-                            error_data = {
-                                "id": f"chatcmpl-{log_id}",
-                                "object": "chat.completion.chunk",
-                                "created": int(time.time()),
-                                "model": model,
-                                "choices": [{"index": 0, "delta": {"content": f"[Error {resp.status_code}]: {error_msg[:100]}"}, "finish_reason": "stop"}]
-                            }
-                            yield f"data: {json.dumps(error_data)}\n\n"
-                            yield "data: [DONE]\n\n"
-                            return
+                client = get_client()
+                async with client.stream("POST", KIRO_API_URL, content=jsonutil.dumps_bytes(kiro_request), headers=headers, timeout=120) as resp:
+                    status_code = resp.status_code
                         
-                        async for chunk in resp.aiter_bytes():
-                            texts, _ = parser.feed(chunk)
+                    if resp.status_code != 200:
+                        error_text = await resp.aread()
+                        error_msg = error_text.decode('utf-8', errors='ignore')[:500]
                             
-                            for text in texts:
-                                data = {
-                                    "id": f"chatcmpl-{log_id}",
-                                    "object": "chat.completion.chunk",
-                                    "created": int(time.time()),
-                                    "model": model,
-                                    "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]
-                                }
-                                yield f"data: {json.dumps(data)}\n\n"
-                        
-                        # 流结束，检查工具调用
-                        tool_calls = parser.get_tool_calls()
-                        if tool_calls:
-                            tool_data = {
-                                "id": f"chatcmpl-{log_id}",
-                                "object": "chat.completion.chunk",
-                                "created": int(time.time()),
-                                "model": model,
-                                "choices": [{
-                                    "index": 0,
-                                    "delta": {"tool_calls": tool_calls},
-                                    "finish_reason": None
-                                }]
-                            }
-                            yield f"data: {json.dumps(tool_data)}\n\n"
-                            
-                            end_data = {
-                                "id": f"chatcmpl-{log_id}",
-                                "object": "chat.completion.chunk",
-                                "created": int(time.time()),
-                                "model": model,
-                                "choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]
-                            }
-                            yield f"data: {json.dumps(end_data)}\n\n"
-                        else:
-                            end_data = {
-                                "id": f"chatcmpl-{log_id}",
-                                "object": "chat.completion.chunk",
-                                "created": int(time.time()),
-                                "model": model,
-                                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
-                            }
-                            yield f"data: {json.dumps(end_data)}\n\n"
-                        
-                        yield "data: [DONE]\n\n"
-                        
-                        # 记录成功统计
-                        current_account.request_count += 1
-                        current_account.last_used = time.time()
-                        get_rate_limiter().record_request(current_account.id)
-                        
+                        # 记录错误统计
                         duration = (time.time() - stream_start) * 1000
                         stats_manager.record_request(
                             account_id=current_account.id,
                             model=model,
-                            success=True,
+                            success=False,
                             latency_ms=duration
                         )
+                            
+                        error_data = {
+                            "id": f"chatcmpl-{log_id}",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [{"index": 0, "delta": {"content": f"[Error {resp.status_code}]: {error_msg[:100]}"}, "finish_reason": "stop"}]
+                        }
+                        yield _sse_data(error_data) + _SSE_DONE
+                        return
+                        
+                    delta_prefix = _chunk_delta_prefix(log_id, model, int(time.time()))
+                    async for chunk in resp.aiter_bytes():
+                        texts, _ = parser.feed(chunk)
+                        if texts:
+                            # 同一个网络 chunk 解析出的多段文本合并为一次 yield
+                            yield b"".join(
+                                delta_prefix + jsonutil.dumps_bytes(text) + _CHUNK_DELTA_SUFFIX
+                                for text in texts
+                            )
+                        
+                    # 流结束，检查工具调用；结尾的各帧合并为一次 yield
+                    tool_calls = parser.get_tool_calls()
+                    tail = []
+                    if tool_calls:
+                        tool_data = {
+                            "id": f"chatcmpl-{log_id}",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [{
+                                "index": 0,
+                                "delta": {"tool_calls": tool_calls},
+                                "finish_reason": None
+                            }]
+                        }
+                        tail.append(_sse_data(tool_data))
+                            
+                        end_data = {
+                            "id": f"chatcmpl-{log_id}",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]
+                        }
+                    else:
+                        end_data = {
+                            "id": f"chatcmpl-{log_id}",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                        }
+                    tail.append(_sse_data(end_data))
+                    tail.append(_SSE_DONE)
+                    yield b"".join(tail)
+                        
+                    # 记录成功统计
+                    current_account.request_count += 1
+                    current_account.last_used = time.time()
+                    get_rate_limiter().record_request(current_account.id)
+                        
+                    duration = (time.time() - stream_start) * 1000
+                    stats_manager.record_request(
+                        account_id=current_account.id,
+                        model=model,
+                        success=True,
+                        latency_ms=duration
+                    )
                         
             except Exception as e:
                 error_msg = str(e)
@@ -348,19 +270,20 @@ async def handle_chat_completions(request: Request):
                     "model": model,
                     "choices": [{"index": 0, "delta": {"content": f"[Stream Error: {str(e)}]"}, "finish_reason": "stop"}]
                 }
-                yield f"data: {json.dumps(error_data)}\n\n"
-                yield "data: [DONE]\n\n"
+                yield _sse_data(error_data) + _SSE_DONE
         
         return StreamingResponse(generate_real_stream(), media_type="text/event-stream")
     
     for retry in range(max_retries + 1):
         try:
-            async with httpx.AsyncClient(verify=False, timeout=120) as client:
-                resp = await client.post(KIRO_API_URL, json=kiro_request, headers=headers)
+            client = get_client()
+            async with client.stream("POST", KIRO_API_URL, content=jsonutil.dumps_bytes(kiro_request), headers=headers, timeout=120) as resp:
                 status_code = resp.status_code
+                # 仅错误响应需要完整读取 body，正常响应边接收边解析
+                error_text = "" if status_code == 200 else (await resp.aread()).decode(errors="replace")
                 
                 # 处理配额超限
-                if resp.status_code == 429 or is_quota_exceeded_error(resp.status_code, resp.text):
+                if resp.status_code == 429 or is_quota_exceeded_error(resp.status_code, error_text):
                     current_account.mark_quota_exceeded("Rate limited")
                     
                     # 尝试切换账号
@@ -368,14 +291,7 @@ async def handle_chat_completions(request: Request):
                     if next_account and retry < max_retries:
                         print(f"[OpenAI] 配额超限，切换账号: {current_account.id} -> {next_account.id}")
                         current_account = next_account
-                        token = current_account.get_token()
-                        creds = current_account.get_credentials()
-                        headers = build_headers(
-                            token,
-                            machine_id=current_account.get_machine_id(),
-                            profile_arn=creds.profile_arn if creds else None,
-                            client_id=creds.client_id if creds else None
-                        )
+                        await switch_account_headers(headers, current_account)
                         continue
                     
                     raise HTTPException(429, "All accounts rate limited")
@@ -384,13 +300,13 @@ async def handle_chat_completions(request: Request):
                 if is_retryable_error(resp.status_code):
                     if retry < max_retries:
                         print(f"[OpenAI] 服务端错误 {resp.status_code}，重试 {retry + 1}/{max_retries}")
-                        await asyncio.sleep(0.5 * (2 ** retry))
+                        await backoff_sleep(retry)
                         continue
                     raise HTTPException(resp.status_code, f"Server error after {max_retries} retries")
                 
                 if resp.status_code != 200:
-                    error_msg = resp.text
-                    print(f"[OpenAI] Kiro API error {resp.status_code}: {resp.text[:500]}")
+                    error_msg = error_text
+                    print(f"[OpenAI] Kiro API error {resp.status_code}: {error_text[:500]}")
                     
                     # 使用统一的错误处理
                     error = classify_error(resp.status_code, error_msg)
@@ -399,7 +315,6 @@ async def handle_chat_completions(request: Request):
                     # 账号封禁 - 禁用账号
                     if error.should_disable_account:
                         current_account.enabled = False
-                        from ..credential import CredentialStatus
                         current_account.status = CredentialStatus.SUSPENDED
                         print(f"[OpenAI] 账号 {current_account.id} 已被禁用 (封禁)")
                     
@@ -413,7 +328,7 @@ async def handle_chat_completions(request: Request):
                         if next_account and retry < max_retries:
                             print(f"[OpenAI] 切换账号: {current_account.id} -> {next_account.id}")
                             current_account = next_account
-                            headers["Authorization"] = f"Bearer {current_account.get_token()}"
+                            await switch_account_headers(headers, current_account)
                             continue
                     
                     # 检查是否为内容长度超限错误，尝试截断重试
@@ -440,11 +355,14 @@ async def handle_chat_completions(request: Request):
                     
                     raise HTTPException(resp.status_code, error.user_message)
                 
-                content = parse_event_stream(resp.content)
-                current_account.request_count += 1
-                current_account.last_used = time.time()
-                get_rate_limiter().record_request(current_account.id)
-                break
+                parser = EventStreamParser(text_only=True)
+                async for chunk in resp.aiter_bytes():
+                    parser.feed(chunk)
+                content = "".join(parser.content) or "[No response]"
+            current_account.request_count += 1
+            current_account.last_used = time.time()
+            get_rate_limiter().record_request(current_account.id)
+            break
                 
         except HTTPException:
             raise
@@ -453,7 +371,7 @@ async def handle_chat_completions(request: Request):
             status_code = 408
             if retry < max_retries:
                 print(f"[OpenAI] 请求超时，重试 {retry + 1}/{max_retries}")
-                await asyncio.sleep(0.5 * (2 ** retry))
+                await backoff_sleep(retry)
                 continue
             raise HTTPException(408, "Request timeout after retries")
         except httpx.ConnectError:
@@ -461,7 +379,7 @@ async def handle_chat_completions(request: Request):
             status_code = 502
             if retry < max_retries:
                 print(f"[OpenAI] 连接错误，重试 {retry + 1}/{max_retries}")
-                await asyncio.sleep(0.5 * (2 ** retry))
+                await backoff_sleep(retry)
                 continue
             raise HTTPException(502, "Connection error after retries")
         except Exception as e:
@@ -470,7 +388,7 @@ async def handle_chat_completions(request: Request):
             # 检查是否为可重试的网络错误
             if is_retryable_error(None, e) and retry < max_retries:
                 print(f"[OpenAI] 网络错误，重试 {retry + 1}/{max_retries}: {type(e).__name__}")
-                await asyncio.sleep(0.5 * (2 ** retry))
+                await backoff_sleep(retry)
                 continue
             raise HTTPException(500, str(e))
     
@@ -499,15 +417,9 @@ async def handle_chat_completions(request: Request):
     if stream:
         # 伪流式：先获取完整响应，再分块发送
         async def generate_fake_stream():
-            for chunk in [content[i:i+20] for i in range(0, len(content), 20)]:
-                data = {
-                    "id": f"chatcmpl-{log_id}",
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": model,
-                    "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]
-                }
-                yield f"data: {json.dumps(data)}\n\n"
+            delta_prefix = _chunk_delta_prefix(log_id, model, int(time.time()))
+            for i in range(0, len(content), 20):
+                yield delta_prefix + jsonutil.dumps_bytes(content[i:i+20]) + _CHUNK_DELTA_SUFFIX
                 await asyncio.sleep(0.02)
             
             end_data = {
@@ -517,8 +429,7 @@ async def handle_chat_completions(request: Request):
                 "model": model,
                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
             }
-            yield f"data: {json.dumps(end_data)}\n\n"
-            yield "data: [DONE]\n\n"
+            yield _sse_data(end_data) + _SSE_DONE
         
         return StreamingResponse(generate_fake_stream(), media_type="text/event-stream")
     
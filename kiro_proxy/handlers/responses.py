@@ -2,21 +2,25 @@
 
 Codex CLI 使用的 API 端点，深度适配 Codex 源码
 """
+import copy
+import hashlib
 import json
-import uuid
+import os
+import secrets
 import time
 import asyncio
-import httpx
 from fastapi import Request, HTTPException
 from fastapi.responses import StreamingResponse
 
-from ..config import KIRO_API_URL, map_model_name
-from ..core import state, is_retryable_error, stats_manager
+from ..config import KIRO_API_URL, DEBUG_REQUESTS, map_model_name
+from .. import jsonutil
+from ..core import state, is_retryable_error, stats_manager, get_client
 from ..core.state import RequestLog
-from ..core.history_manager import HistoryManager, get_history_config
+from ..core.history_manager import HistoryManager, get_history_config, TruncateStrategy
 from ..core.error_handler import classify_error, ErrorType, format_error_log
 from ..core.rate_limiter import get_rate_limiter
-from ..kiro_api import build_headers, build_kiro_request, parse_event_stream, parse_event_stream_full, is_quota_exceeded_error
+from ..converters import parse_image_data_url, fix_history_alternation
+from ..kiro_api import build_headers, build_kiro_request, generate_text, is_quota_exceeded_error, EventStreamParser
 
 
 def _convert_responses_input_to_kiro(input_data, instructions: str = None):
@@ -74,14 +78,12 @@ def _convert_responses_input_to_kiro(input_data, instructions: str = None):
                         text_parts.append(c.get("text", ""))
                     elif c_type == "input_image":
                         image_url = c.get("image_url", "")
-                        if image_url.startswith("data:"):
-                            import re
-                            match = re.match(r'data:image/(\w+);base64,(.+)', image_url)
-                            if match:
-                                images.append({
-                                    "format": match.group(1),
-                                    "source": {"bytes": match.group(2)}
-                                })
+                        parsed = parse_image_data_url(image_url)
+                        if parsed:
+                            images.append({
+                                "format": parsed[0],
+                                "source": {"bytes": parsed[1]}
+                            })
             
             text = "\n".join(text_parts) if text_parts else ""
             
@@ -147,7 +149,7 @@ def _convert_responses_input_to_kiro(input_data, instructions: str = None):
         
         elif item_type == "function_call":
             try:
-                args = json.loads(item.get("arguments", "{}")) if isinstance(item.get("arguments"), str) else item.get("arguments", {})
+                args = jsonutil.loads(item.get("arguments", "{}")) if isinstance(item.get("arguments"), str) else item.get("arguments", {})
             except:
                 args = {}
             
@@ -179,7 +181,7 @@ def _convert_responses_input_to_kiro(input_data, instructions: str = None):
                 output_str = output
                 status = "success"
             elif isinstance(output, dict):
-                output_str = output.get("content", json.dumps(output))
+                output_str = output["content"] if "content" in output else jsonutil.dumps(output)
                 status = "success" if output.get("success", True) is not False else "error"
             else:
                 output_str = str(output)
@@ -225,16 +227,17 @@ def _convert_responses_input_to_kiro(input_data, instructions: str = None):
                     user.pop("userInputMessageContext", None)
     
     # 调试日志
-    print(f"[Responses] Converted: history={len(history)}, tool_results={len(tool_results)}")
-    for i, h in enumerate(history):
-        if "userInputMessage" in h:
-            has_tr = "toolResults" in h.get("userInputMessage", {}).get("userInputMessageContext", {})
-            print(f"[Responses]   history[{i}]: userInputMessage, has_toolResults={has_tr}")
-        elif "assistantResponseMessage" in h:
-            arm = h.get("assistantResponseMessage", {})
-            has_tu_field = "toolUses" in arm
-            tu_count = len(arm.get("toolUses", []) or []) if has_tu_field else 0
-            print(f"[Responses]   history[{i}]: assistantResponseMessage, has_toolUses_field={has_tu_field}, toolUses_count={tu_count}")
+    if DEBUG_REQUESTS:
+        print(f"[Responses] Converted: history={len(history)}, tool_results={len(tool_results)}")
+        for i, h in enumerate(history):
+            if "userInputMessage" in h:
+                has_tr = "toolResults" in h.get("userInputMessage", {}).get("userInputMessageContext", {})
+                print(f"[Responses]   history[{i}]: userInputMessage, has_toolResults={has_tr}")
+            elif "assistantResponseMessage" in h:
+                arm = h.get("assistantResponseMessage", {})
+                has_tu_field = "toolUses" in arm
+                tu_count = len(arm.get("toolUses", []) or []) if has_tu_field else 0
+                print(f"[Responses]   history[{i}]: assistantResponseMessage, has_toolUses_field={has_tu_field}, toolUses_count={tu_count}")
     
     images = pending_images if pending_images else None
     return user_content, history, tool_results, images
@@ -352,9 +355,9 @@ def _convert_tools_to_kiro(tools: list) -> list:
 async def handle_responses(request: Request):
     """处理 /v1/responses 请求"""
     start_time = time.time()
-    log_id = uuid.uuid4().hex[:12]
+    log_id = secrets.token_hex(6)
     
-    body = await request.json()
+    body = await jsonutil.read_request(request)
     model = map_model_name(body.get("model", "gpt-4o"))
     input_data = body.get("input", "")
     instructions = body.get("instructions", "")
@@ -364,9 +367,8 @@ async def handle_responses(request: Request):
     if not input_data:
         raise HTTPException(400, "input required")
     
-    import hashlib
-    session_str = json.dumps(input_data[:3] if isinstance(input_data, list) else str(input_data)[:100], sort_keys=True, default=str)
-    session_id = hashlib.sha256(session_str.encode()).hexdigest()[:16]
+    session_bytes = jsonutil.dumps_bytes(input_data[:3] if isinstance(input_data, list) else str(input_data)[:100], sort_keys=True)
+    session_id = hashlib.sha256(session_bytes).hexdigest()[:16]
     account = state.get_available_account(session_id)
     
     if not account:
@@ -375,17 +377,11 @@ async def handle_responses(request: Request):
     if account.is_token_expiring_soon(5):
         await account.refresh_token()
     
-    token = account.get_token()
+    token = await account.get_token_async()
     if not token:
         raise HTTPException(500, f"Failed to get token for account {account.name}")
     
-    creds = account.get_credentials()
-    headers = build_headers(
-        token,
-        machine_id=account.get_machine_id(),
-        profile_arn=creds.profile_arn if creds else None,
-        client_id=creds.client_id if creds else None
-    )
+    headers = build_headers(token, machine_id=account.get_machine_id())
     
     rate_limiter = get_rate_limiter()
     can_request, wait_seconds, _ = rate_limiter.can_request(account.id)
@@ -395,28 +391,24 @@ async def handle_responses(request: Request):
     user_content, history, tool_results, images = _convert_responses_input_to_kiro(input_data, instructions)
     
     # 修复历史消息交替
-    from ..converters import fix_history_alternation
     history = fix_history_alternation(history)
     
     history_manager = HistoryManager(get_history_config(), cache_key=session_id)
     
     # 对于 Responses API，强制启用自动截断（Codex CLI 的历史可能很长）
-    from ..core.history_manager import TruncateStrategy
     if TruncateStrategy.AUTO_TRUNCATE not in history_manager.config.strategies:
         history_manager.config.strategies.append(TruncateStrategy.AUTO_TRUNCATE)
     
     # 创建摘要 API 调用函数
     async def api_caller(prompt: str) -> str:
-        req = build_kiro_request(prompt, "claude-haiku-4.5", [])
         try:
-            async with httpx.AsyncClient(verify=False, timeout=60) as client:
-                resp = await client.post(KIRO_API_URL, json=req, headers=headers)
-                if resp.status_code == 200:
-                    return parse_event_stream(resp.content)
+            return await generate_text(prompt, headers)
         except Exception as e:
             print(f"[Responses] Summary API 调用失败: {e}")
         return ""
     
+    history = history_manager.dedupe_tool_results(history, tool_results)
+
     # 检查是否需要智能摘要或错误重试预摘要
     if history_manager.should_summarize(history) or history_manager.should_pre_summary_for_error_retry(history, user_content):
         history = await history_manager.pre_process_async(history, user_content, api_caller)
@@ -432,7 +424,7 @@ async def handle_responses(request: Request):
     kiro_tools = _convert_tools_to_kiro(tools)
     
     # 调试：打印 input 结构
-    if isinstance(input_data, list):
+    if DEBUG_REQUESTS and isinstance(input_data, list):
         for i, item in enumerate(input_data):
             item_type = item.get("type", "?")
             role = item.get("role", "?")
@@ -458,8 +450,9 @@ async def handle_responses(request: Request):
                 if tu_id:
                     tool_use_ids.add(tu_id)
             
-            print(f"[Responses] Last assistant at idx={last_assistant_idx}, toolUse_ids={tool_use_ids}")
-            print(f"[Responses] tool_results ids={[tr.get('toolUseId') for tr in tool_results]}")
+            if DEBUG_REQUESTS:
+                print(f"[Responses] Last assistant at idx={last_assistant_idx}, toolUse_ids={tool_use_ids}")
+                print(f"[Responses] tool_results ids={[tr.get('toolUseId') for tr in tool_results]}")
             
             # 过滤 tool_results，只保留有对应 toolUse 的
             if tool_use_ids:
@@ -494,8 +487,7 @@ async def handle_responses(request: Request):
     )
     
     # 调试：打印完整的 Kiro 请求（使用深拷贝避免修改原始请求）
-    if tool_results:
-        import copy
+    if tool_results and DEBUG_REQUESTS:
         # 打印请求结构（不包括 tools，因为太长）
         debug_request = copy.deepcopy({
             "conversationState": {
@@ -515,17 +507,20 @@ async def handle_responses(request: Request):
         return await _handle_stream(kiro_request, headers, account, model, log_id, start_time)
     
     # 非流式
-    async with httpx.AsyncClient(verify=False, timeout=120) as client:
-        resp = await client.post(KIRO_API_URL, json=kiro_request, headers=headers)
+    client = get_client()
+    async with client.stream("POST", KIRO_API_URL, content=jsonutil.dumps_bytes(kiro_request), headers=headers, timeout=120) as resp:
         if resp.status_code != 200:
-            raise HTTPException(resp.status_code, resp.text)
+            raise HTTPException(resp.status_code, (await resp.aread()).decode(errors="replace"))
         
-        result = parse_event_stream_full(resp.content)
-        account.request_count += 1
-        account.last_used = time.time()
-        get_rate_limiter().record_request(account.id)
+        parser = EventStreamParser()
+        async for chunk in resp.aiter_bytes():
+            parser.feed(chunk)
+        result = parser.result()
+    account.request_count += 1
+    account.last_used = time.time()
+    get_rate_limiter().record_request(account.id)
         
-        return _build_response(result, model, log_id)
+    return _build_response(result, model, log_id)
 
 
 def _build_response(result: dict, model: str, response_id: str) -> dict:
@@ -544,10 +539,10 @@ def _build_response(result: dict, model: str, response_id: str) -> dict:
     for tool_use in result.get("tool_uses", []):
         output.append({
             "type": "function_call",
-            "id": tool_use.get("id", f"call_{uuid.uuid4().hex[:12]}"),
-            "call_id": tool_use.get("id", f"call_{uuid.uuid4().hex[:12]}"),
+            "id": tool_use.get("id", f"call_{secrets.token_hex(6)}"),
+            "call_id": tool_use.get("id", f"call_{secrets.token_hex(6)}"),
             "name": tool_use.get("name", ""),
-            "arguments": json.dumps(tool_use.get("input", {}))
+            "arguments": jsonutil.dumps(tool_use.get("input", {}))
         })
     
     return {
@@ -565,13 +560,13 @@ async def _handle_stream(kiro_request, headers, account, model, log_id, start_ti
     """流式处理 - Codex 期望的 SSE 格式"""
     
     # 保存完整请求用于调试
-    import os
-    debug_dir = "debug_requests"
-    os.makedirs(debug_dir, exist_ok=True)
-    debug_file = f"{debug_dir}/{log_id}_request.json"
-    with open(debug_file, 'w', encoding='utf-8') as f:
-        json.dump(kiro_request, f, indent=2, ensure_ascii=False)
-    print(f"[Responses] Saved request to {debug_file}")
+    if DEBUG_REQUESTS:
+        debug_dir = "debug_requests"
+        os.makedirs(debug_dir, exist_ok=True)
+        debug_file = f"{debug_dir}/{log_id}_request.json"
+        with open(debug_file, 'w', encoding='utf-8') as f:
+            json.dump(kiro_request, f, indent=2, ensure_ascii=False)
+        print(f"[Responses] Saved request to {debug_file}")
     
     async def generate():
         response_id = f"resp_{log_id}"
@@ -584,131 +579,119 @@ async def _handle_stream(kiro_request, headers, account, model, log_id, start_ti
         print(f"[Responses] Request: model={model}, log_id={log_id}")
         
         try:
-            async with httpx.AsyncClient(verify=False, timeout=300) as client:
-                async with client.stream("POST", KIRO_API_URL, json=kiro_request, headers=headers) as response:
+            client = get_client()
+            async with client.stream("POST", KIRO_API_URL, content=jsonutil.dumps_bytes(kiro_request), headers=headers) as response:
                     
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        error_msg = error_text.decode()[:500]
-                        print(f"[Responses] Kiro error: {response.status_code} - {error_msg[:200]}")
+                if response.status_code != 200:
+                    error_text = await response.aread()
+                    error_msg = error_text.decode()[:500]
+                    print(f"[Responses] Kiro error: {response.status_code} - {error_msg[:200]}")
                         
-                        # 打印更多调试信息
-                        if response.status_code == 400:
-                            cs = kiro_request.get("conversationState", {})
-                            hist = cs.get("history", [])
-                            print(f"[Responses] 400 Debug: history_len={len(hist)}")
-                            if hist:
-                                # 检查每条 history 的详细结构
-                                for i, h in enumerate(hist[:5]):  # 只打印前5条
-                                    if "userInputMessage" in h:
-                                        uim = h["userInputMessage"]
-                                        has_ctx = "userInputMessageContext" in uim
-                                        has_tr = has_ctx and "toolResults" in uim.get("userInputMessageContext", {})
-                                        content_len = len(uim.get("content", ""))
-                                        uim_keys = list(uim.keys())
-                                        print(f"[Responses]   hist[{i}]: user, keys={uim_keys}, content_len={content_len}, has_toolResults={has_tr}")
-                                    elif "assistantResponseMessage" in h:
-                                        arm = h["assistantResponseMessage"]
-                                        arm_keys = list(arm.keys())
-                                        has_tu = "toolUses" in arm
-                                        tu_count = len(arm.get("toolUses", []) or []) if has_tu else 0
-                                        content_len = len(arm.get("content", "") or "")
-                                        print(f"[Responses]   hist[{i}]: assistant, keys={arm_keys}, content_len={content_len}, has_toolUses={has_tu}, toolUses_count={tu_count}")
-                                    else:
-                                        print(f"[Responses]   hist[{i}]: UNKNOWN keys={list(h.keys())}")
-                                if len(hist) > 5:
-                                    print(f"[Responses]   ... ({len(hist) - 5} more)")
+                    # 打印更多调试信息（调试模式）
+                    if response.status_code == 400 and DEBUG_REQUESTS:
+                        cs = kiro_request.get("conversationState", {})
+                        hist = cs.get("history", [])
+                        print(f"[Responses] 400 Debug: history_len={len(hist)}")
+                        if hist:
+                            # 检查每条 history 的详细结构
+                            for i, h in enumerate(hist[:5]):  # 只打印前5条
+                                if "userInputMessage" in h:
+                                    uim = h["userInputMessage"]
+                                    has_ctx = "userInputMessageContext" in uim
+                                    has_tr = has_ctx and "toolResults" in uim.get("userInputMessageContext", {})
+                                    content_len = len(uim.get("content", ""))
+                                    uim_keys = list(uim.keys())
+                                    print(f"[Responses]   hist[{i}]: user, keys={uim_keys}, content_len={content_len}, has_toolResults={has_tr}")
+                                elif "assistantResponseMessage" in h:
+                                    arm = h["assistantResponseMessage"]
+                                    arm_keys = list(arm.keys())
+                                    has_tu = "toolUses" in arm
+                                    tu_count = len(arm.get("toolUses", []) or []) if has_tu else 0
+                                    content_len = len(arm.get("content", "") or "")
+                                    print(f"[Responses]   hist[{i}]: assistant, keys={arm_keys}, content_len={content_len}, has_toolUses={has_tu}, toolUses_count={tu_count}")
+                                else:
+                                    print(f"[Responses]   hist[{i}]: UNKNOWN keys={list(h.keys())}")
+                            if len(hist) > 5:
+                                print(f"[Responses]   ... ({len(hist) - 5} more)")
                             
-                            # 打印 currentMessage 结构
-                            cm = cs.get("currentMessage", {})
-                            if "userInputMessage" in cm:
-                                uim = cm["userInputMessage"]
-                                print(f"[Responses] currentMessage: keys={list(uim.keys())}, content_len={len(uim.get('content', ''))}")
-                                if "userInputMessageContext" in uim:
-                                    ctx = uim["userInputMessageContext"]
-                                    print(f"[Responses]   context keys={list(ctx.keys())}")
-                                    if "toolResults" in ctx:
-                                        print(f"[Responses]   toolResults count={len(ctx['toolResults'])}")
-                                    if "tools" in ctx:
-                                        print(f"[Responses]   tools count={len(ctx['tools'])}")
+                        # 打印 currentMessage 结构
+                        cm = cs.get("currentMessage", {})
+                        if "userInputMessage" in cm:
+                            uim = cm["userInputMessage"]
+                            print(f"[Responses] currentMessage: keys={list(uim.keys())}, content_len={len(uim.get('content', ''))}")
+                            if "userInputMessageContext" in uim:
+                                ctx = uim["userInputMessageContext"]
+                                print(f"[Responses]   context keys={list(ctx.keys())}")
+                                if "toolResults" in ctx:
+                                    print(f"[Responses]   toolResults count={len(ctx['toolResults'])}")
+                                if "tools" in ctx:
+                                    print(f"[Responses]   tools count={len(ctx['tools'])}")
                         
-                        error_occurred = True
+                    error_occurred = True
                         
-                        # 映射错误代码
-                        error_code = "api_error"
-                        error_lower = error_msg.lower()
-                        if response.status_code == 429 or "rate limit" in error_lower or "throttl" in error_lower:
-                            error_code = "rate_limit_exceeded"
-                        elif "context" in error_lower or "too long" in error_lower or "content length" in error_lower:
-                            error_code = "context_length_exceeded"
-                        elif "quota" in error_lower or "insufficient" in error_lower:
-                            error_code = "insufficient_quota"
-                        elif response.status_code == 401 or response.status_code == 403:
-                            error_code = "authentication_error"
+                    # 映射错误代码
+                    error_code = "api_error"
+                    error_lower = error_msg.lower()
+                    if response.status_code == 429 or "rate limit" in error_lower or "throttl" in error_lower:
+                        error_code = "rate_limit_exceeded"
+                    elif "context" in error_lower or "too long" in error_lower or "content length" in error_lower:
+                        error_code = "context_length_exceeded"
+                    elif "quota" in error_lower or "insufficient" in error_lower:
+                        error_code = "insufficient_quota"
+                    elif response.status_code == 401 or response.status_code == 403:
+                        error_code = "authentication_error"
                         
-                        yield _sse("response.failed", {
-                            "type": "response.failed",
-                            "response": {
-                                "id": response_id,
-                                "object": "response",
-                                "status": "failed",
-                                "error": {"code": error_code, "message": error_msg[:200]}
-                            }
-                        })
-                        return
-                    
-                    # 1. response.created
-                    yield _sse("response.created", {
-                        "type": "response.created",
+                    yield _sse("response.failed", {
+                        "type": "response.failed",
                         "response": {
                             "id": response_id,
                             "object": "response",
-                            "created_at": created_at,
-                            "status": "in_progress",
-                            "model": model,
-                            "output": []
+                            "status": "failed",
+                            "error": {"code": error_code, "message": error_msg[:200]}
                         }
                     })
+                    return
                     
-                    # 2. response.output_item.added
-                    yield _sse("response.output_item.added", {
-                        "type": "response.output_item.added",
-                        "output_index": 0,
-                        "item": {
-                            "id": item_id,
-                            "type": "message",
-                            "status": "in_progress",
-                            "role": "assistant",
-                            "content": []
-                        }
-                    })
+                # 1. response.created + 2. response.output_item.added（一次发送）
+                yield _sse("response.created", {
+                    "type": "response.created",
+                    "response": {
+                        "id": response_id,
+                        "object": "response",
+                        "created_at": created_at,
+                        "status": "in_progress",
+                        "model": model,
+                        "output": []
+                    }
+                }) + _sse("response.output_item.added", {
+                    "type": "response.output_item.added",
+                    "output_index": 0,
+                    "item": {
+                        "id": item_id,
+                        "type": "message",
+                        "status": "in_progress",
+                        "role": "assistant",
+                        "content": []
+                    }
+                })
                     
-                    # 3. 流式读取并发送 delta
-                    full_response = b""
-                    async for chunk in response.aiter_bytes():
-                        full_response += chunk
-                        
-                        # 尝试解析增量内容
-                        content = _extract_content_from_chunk(chunk)
-                        if content:
-                            full_content += content
-                            yield _sse("response.output_text.delta", {
-                                "type": "response.output_text.delta",
-                                "item_id": item_id,
-                                "output_index": 0,
-                                "content_index": 0,
-                                "delta": content
-                            })
+                # 3. 流式读取并发送 delta
+                parser = EventStreamParser()
+                delta_prefix = _text_delta_prefix(item_id)
+                async for chunk in response.aiter_bytes():
+                    # 增量解析（跨 chunk 的帧会被缓存）
+                    texts = parser.feed(chunk)
+                    if texts:
+                        yield delta_prefix + jsonutil.dumps_bytes("".join(texts)) + _SSE_TEXT_DELTA_SUFFIX
                     
-                    # 解析完整响应获取工具调用
-                    result = parse_event_stream_full(full_response)
-                    tool_uses = result.get("tool_uses", [])
-                    if not full_content:
-                        full_content = "".join(result.get("content", []))
+                # 流结束，汇总文本和工具调用（文本已由解析器累积，无需逐段拼接）
+                result = parser.result()
+                tool_uses = result.get("tool_uses", [])
+                full_content = "".join(result.get("content", []))
                     
-                    account.request_count += 1
-                    account.last_used = time.time()
-                    get_rate_limiter().record_request(account.id)
+                account.request_count += 1
+                account.last_used = time.time()
+                get_rate_limiter().record_request(account.id)
                     
         except Exception as e:
             error_occurred = True
@@ -722,9 +705,12 @@ async def _handle_stream(kiro_request, headers, account, model, log_id, start_ti
             })
             return
         
+        # 结尾事件（4~6）合并为一次发送
+        tail = []
+
         # 4. response.output_item.done - 消息完成
         message_content = [{"type": "output_text", "text": full_content, "annotations": []}]
-        yield _sse("response.output_item.done", {
+        tail.append(_sse("response.output_item.done", {
             "type": "response.output_item.done",
             "output_index": 0,
             "item": {
@@ -734,7 +720,7 @@ async def _handle_stream(kiro_request, headers, account, model, log_id, start_ti
                 "role": "assistant",
                 "content": message_content
             }
-        })
+        }))
         
         # 构建 output 列表
         output_items = [{
@@ -747,31 +733,31 @@ async def _handle_stream(kiro_request, headers, account, model, log_id, start_ti
         
         # 5. 工具调用
         for i, tool_use in enumerate(tool_uses):
-            tool_item_id = tool_use.get("id", f"call_{uuid.uuid4().hex[:12]}")
+            tool_item_id = tool_use.get("id", f"call_{secrets.token_hex(6)}")
             tool_item = {
                 "type": "function_call",
                 "id": tool_item_id,
                 "call_id": tool_item_id,
                 "name": tool_use.get("name", ""),
-                "arguments": json.dumps(tool_use.get("input", {}))
+                "arguments": jsonutil.dumps(tool_use.get("input", {}))
             }
             
-            yield _sse("response.output_item.added", {
+            tail.append(_sse("response.output_item.added", {
                 "type": "response.output_item.added",
                 "output_index": i + 1,
                 "item": tool_item
-            })
+            }))
             
-            yield _sse("response.output_item.done", {
+            tail.append(_sse("response.output_item.done", {
                 "type": "response.output_item.done",
                 "output_index": i + 1,
                 "item": tool_item
-            })
+            }))
             
             output_items.append(tool_item)
         
         # 6. response.completed - 必须发送!
-        yield _sse("response.completed", {
+        tail.append(_sse("response.completed", {
             "type": "response.completed",
             "response": {
                 "id": response_id,
@@ -788,45 +774,27 @@ async def _handle_stream(kiro_request, headers, account, model, log_id, start_ti
                     "total_tokens": 0
                 }
             }
-        })
+        }))
+        yield b"".join(tail)
     
     return StreamingResponse(generate(), media_type="text/event-stream")
 
 
-def _sse(event_type: str, data: dict) -> str:
+def _sse(event_type: str, data: dict) -> bytes:
     """生成 SSE 格式的事件"""
-    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+    return b"event: " + event_type.encode() + b"\ndata: " + jsonutil.dumps_bytes(data) + b"\n\n"
 
 
-def _extract_content_from_chunk(chunk: bytes) -> str:
-    """从 AWS event-stream chunk 中提取文本内容"""
-    content = ""
-    pos = 0
-    
-    while pos < len(chunk):
-        if pos + 12 > len(chunk):
-            break
-        
-        total_len = int.from_bytes(chunk[pos:pos+4], 'big')
-        if total_len == 0 or total_len > len(chunk) - pos:
-            break
-        
-        headers_len = int.from_bytes(chunk[pos+4:pos+8], 'big')
-        payload_start = pos + 12 + headers_len
-        payload_end = pos + total_len - 4
-        
-        if payload_start < payload_end:
-            try:
-                payload = json.loads(chunk[payload_start:payload_end].decode('utf-8'))
-                if 'assistantResponseEvent' in payload:
-                    c = payload['assistantResponseEvent'].get('content')
-                    if c:
-                        content += c
-                elif 'content' in payload and 'toolUseId' not in payload:
-                    content += payload['content']
-            except:
-                pass
-        
-        pos += total_len
-    
-    return content
+# output_text.delta 事件的固定后缀（前缀每个流由 _text_delta_prefix 生成一次）
+_SSE_TEXT_DELTA_SUFFIX = b"}\n\n"
+
+
+def _text_delta_prefix(item_id: str) -> bytes:
+    """output_text.delta 事件中 delta 之前的部分（预编码，逐帧只需序列化文本）"""
+    head = jsonutil.dumps_bytes({
+        "type": "response.output_text.delta",
+        "item_id": item_id,
+        "output_index": 0,
+        "content_index": 0,
+    })
+    return b"event: response.output_text.delta\ndata: " + head[:-1] + b',"delta":'
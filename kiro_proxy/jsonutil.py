@@ -0,0 +1,47 @@
+"""JSON 编解码 - 优先使用 orjson，未安装时回退到标准库
+
+输出统一为紧凑格式、不转义非 ASCII 字符，两种实现结果一致。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def loads(data):
+        """解析 JSON（支持 str/bytes/bytearray/memoryview）"""
+        return orjson.loads(data)
+
+    # 与标准库一致：非 str 的键（如 int）转为字符串，而不是抛 TypeError
+    _OPTS = orjson.OPT_NON_STR_KEYS
+    _OPTS_SORTED = orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+    def dumps_bytes(obj, sort_keys: bool = False) -> bytes:
+        """序列化为 UTF-8 bytes"""
+        return orjson.dumps(obj, option=_OPTS_SORTED if sort_keys else _OPTS)
+
+    def dumps(obj) -> str:
+        """序列化为 str"""
+        return orjson.dumps(obj, option=_OPTS).decode()
+else:
+    def loads(data):
+        """解析 JSON（支持 str/bytes/bytearray/memoryview）"""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def dumps_bytes(obj, sort_keys: bool = False) -> bytes:
+        """序列化为 UTF-8 bytes"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys).encode()
+
+    def dumps(obj) -> str:
+        """序列化为 str"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+async def read_request(request):
+    """读取并解析请求体（替代 Starlette 的 request.json()，使用同一套解析器）"""
+    return loads(await request.body())
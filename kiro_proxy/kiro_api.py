@@ -2,8 +2,11 @@
 
 此文件保留用于向后兼容，实际实现已移至 providers/kiro.py。
 """
-from .providers.kiro import KiroProvider
+from .providers.kiro import KiroProvider, EventStreamParser
 from .credential import generate_machine_id, get_kiro_version, get_system_info, quota_manager
+from .config import KIRO_API_URL
+from .core.http_client import get_client
+from . import jsonutil
 
 # 创建默认 provider 实例
 _default_provider = KiroProvider()
@@ -28,6 +31,15 @@ def build_headers(
     return _default_provider.build_headers(token, agent_mode)
 
 
+async def switch_account_headers(headers: dict, account):
+    """切换账号后就地更新请求头：Authorization 和该账号的 Machine ID 一起替换
+
+    就地修改，闭包中持有同一个 headers 的调用（如摘要）也随之切换。
+    """
+    token = await account.get_token_async()
+    headers.update(build_headers(token, machine_id=account.get_machine_id()))
+
+
 def build_kiro_request(
     user_content: str,
     model: str,
@@ -52,9 +64,25 @@ def parse_event_stream(raw: bytes) -> str:
     return _default_provider.parse_response_text(raw)
 
 
-def parse_event_stream_full(raw: bytes) -> dict:
-    """解析 AWS event-stream 格式，返回完整结构"""
-    return _default_provider.parse_response(raw)
+def parse_event_stream_full(raw: bytes, text_only: bool = False) -> dict:
+    """解析 AWS event-stream 格式，返回完整结构（text_only 时 tool_uses 为空）"""
+    return _default_provider.parse_response(raw, text_only=text_only)
+
+
+async def generate_text(prompt: str, headers: dict, model: str = "claude-haiku-4.5", timeout: float = 60) -> str:
+    """单轮调用 Kiro API 并返回文本（用于摘要等内部调用）
+
+    响应边接收边解析，不缓存完整 body；非 200 返回空字符串，网络异常由调用方处理。
+    """
+    kiro_request = build_kiro_request(prompt, model, [])
+    client = get_client()
+    async with client.stream("POST", KIRO_API_URL, content=jsonutil.dumps_bytes(kiro_request), headers=headers, timeout=timeout) as resp:
+        if resp.status_code != 200:
+            return ""
+        parser = EventStreamParser(text_only=True)
+        async for chunk in resp.aiter_bytes():
+            parser.feed(chunk)
+    return "".join(parser.content) or "[No response]"
 
 
 def is_quota_exceeded_error(status_code: int, error_text: str) -> bool:
@@ -1,22 +1,32 @@
 """Kiro API Proxy - 主应用"""
 import json
 import uuid
-import httpx
 import sys
+import asyncio
+import httpx
+import hashlib
+from functools import lru_cache
+from typing import Optional, Tuple
 from pathlib import Path
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
-from fastapi.middleware.cors import CORSMiddleware
-
-from .config import MODELS_URL
-from .core import state, scheduler, stats_manager
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+
+from .config import MODELS_URL, KIRO_API_URL
+from . import jsonutil
+from .middleware import FastCORS
+from .core import state, scheduler, stats_manager, get_client, close_client, warm_up
+from .core.http_client import HTTP2_AVAILABLE
 from .handlers import anthropic, openai, gemini, admin
 from .handlers import responses as responses_handler
 from .web.html import HTML_PAGE
 from .credential import generate_machine_id, get_kiro_version
 
 
+# 上游 API 源站（用于启动时预热连接）
+KIRO_ORIGIN = str(httpx.URL(KIRO_API_URL).copy_with(path="/"))
+
+
 def get_resource_path(relative_path: str) -> Path:
     """获取资源文件路径，支持从打包资源读取"""
     base_path = Path(sys._MEIPASS) if hasattr(sys, '_MEIPASS') else Path(__file__).parent.parent
@@ -28,37 +38,70 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时
     await scheduler.start()
+    # 后台预热上游连接，首个请求无需等待 TLS 握手
+    warm_task = asyncio.create_task(warm_up(KIRO_ORIGIN))
     yield
     # 关闭时
+    warm_task.cancel()
     await scheduler.stop()
+    await state.flush_accounts()
+    await close_client()
 
 
-app = FastAPI(title="Kiro API Proxy", docs_url="/docs", redoc_url=None, lifespan=lifespan)
+class FastJSONResponse(JSONResponse):
+    """JSON 响应：通过 jsonutil 序列化（orjson 可用时使用 orjson）"""
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    def render(self, content) -> bytes:
+        return jsonutil.dumps_bytes(content)
+
+
+app = FastAPI(
+    title="Kiro API Proxy", docs_url="/docs", redoc_url=None, lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
+app.add_middleware(FastCORS)
+
 
 # ==================== Web UI ====================
 
+_HTML_BYTES = HTML_PAGE.encode()
+_HTML_ETAG = '"%s"' % hashlib.blake2b(_HTML_BYTES, digest_size=16).hexdigest()
+
+
+def _cached_response(request: Request, body: bytes, media_type: str, etag: str) -> Response:
+    """返回带 ETag 的静态内容，浏览器缓存命中时返回 304"""
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=60"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+
+@lru_cache(maxsize=32)
+def _load_asset(path: str) -> Optional[Tuple[bytes, str]]:
+    """读取静态资源并计算 ETag（资源随程序发布，不会变化）"""
+    assets_dir = get_resource_path("assets").resolve()
+    file_path = (assets_dir / path).resolve()
+    if assets_dir not in file_path.parents or not file_path.is_file():
+        return None
+    data = file_path.read_bytes()
+    return data, '"%s"' % hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
 @app.get("/", response_class=HTMLResponse)
-async def index():
-    return HTML_PAGE
+async def index(request: Request):
+    return _cached_response(request, _HTML_BYTES, "text/html; charset=utf-8", _HTML_ETAG)
 
 
 @app.get("/assets/{path:path}")
-async def serve_assets(path: str):
+async def serve_assets(path: str, request: Request):
     """提供静态资源"""
-    file_path = get_resource_path("assets") / path
-    if file_path.exists():
-        content_type = "image/svg+xml" if path.endswith(".svg") else "application/octet-stream"
-        return StreamingResponse(open(file_path, "rb"), media_type=content_type)
-    raise HTTPException(status_code=404)
+    asset = _load_asset(path)
+    if asset is None:
+        raise HTTPException(status_code=404)
+    data, etag = asset
+    content_type = "image/svg+xml" if path.endswith(".svg") else "application/octet-stream"
+    return _cached_response(request, data, content_type, etag)
 
 
 # ==================== API 端点 ====================
@@ -71,7 +114,7 @@ async def models():
         if not account:
             raise Exception("No available account")
         
-        token = account.get_token()
+        token = await account.get_token_async()
         machine_id = account.get_machine_id()
         kiro_version = get_kiro_version()
         
@@ -81,25 +124,25 @@ async def models():
             "amz-sdk-invocation-id": str(uuid.uuid4()),
             "Authorization": f"Bearer {token}",
         }
-        async with httpx.AsyncClient(verify=False, timeout=30) as client:
-            resp = await client.get(MODELS_URL, headers=headers, params={"origin": "AI_EDITOR"})
-            if resp.status_code == 200:
-                data = resp.json()
-                base_models = [
-                    {
-                        "id": m["modelId"],
-                        "object": "model",
-                        "owned_by": "kiro",
-                        "name": m["modelName"],
-                    }
-                    for m in data.get("models", [])
-                ]
-                # 添加假流式前缀版本
-                fake_stream_models = [
-                    {"id": f"假流式/{m['id']}", "object": "model", "owned_by": "kiro", "name": f"假流式/{m['name']}"}
-                    for m in base_models
-                ]
-                return {"object": "list", "data": base_models + fake_stream_models}
+        client = get_client()
+        resp = await client.get(MODELS_URL, headers=headers, params={"origin": "AI_EDITOR"}, timeout=30)
+        if resp.status_code == 200:
+            data = resp.json()
+            base_models = [
+                {
+                    "id": m["modelId"],
+                    "object": "model",
+                    "owned_by": "kiro",
+                    "name": m["modelName"],
+                }
+                for m in data.get("models", [])
+            ]
+            # 添加假流式前缀版本
+            fake_stream_models = [
+                {"id": f"假流式/{m['id']}", "object": "model", "owned_by": "kiro", "name": f"假流式/{m['name']}"}
+                for m in base_models
+            ]
+            return {"object": "list", "data": base_models + fake_stream_models}
     except Exception:
         pass
     
@@ -166,7 +209,7 @@ async def api_stats():
 
 
 @app.get("/api/logs")
-async def api_logs(limit: int = 100):
+async def api_logs(limit: int = Query(100, ge=0)):
     return await admin.get_logs(limit)
 
 
@@ -530,13 +573,31 @@ async def api_docs_content(doc_id: str):
 
 # ==================== 启动 ====================
 
+def _pick_server_impl() -> tuple:
+    """选择事件循环和 HTTP 解析实现（uvloop/httptools 可用时优先）"""
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+    return loop, http
+
+
 def run(port: int = 8080):
     import uvicorn
+    loop, http = _pick_server_impl()
     print(f"\n{'='*50}")
     print(f"  Kiro API Proxy v1.7.1")
     print(f"  http://localhost:{port}")
+    print(f"  loop={loop} http={http} upstream={'HTTP/2' if HTTP2_AVAILABLE else 'HTTP/1.1'}")
     print(f"{'='*50}\n")
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # 账号/会话状态保存在进程内存中，只能单 worker 运行
+    uvicorn.run(app, host="0.0.0.0", port=port, loop=loop, http=http, log_level="warning")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+"""轻量 ASGI 中间件"""
+
+
+class FastCORS:
+    """纯 ASGI 的 CORS 中间件
+
+    - 无 Origin 头的请求（CLI/SDK 客户端）直接透传，零开销
+    - 预检请求（OPTIONS）在中间件内直接响应，不进入应用
+    - 其他跨域请求只在 http.response.start 时追加响应头，流式 body 不做任何处理
+    """
+
+    def __init__(self, app, allow_origin: bytes = b"*", max_age: int = 600):
+        self.app = app
+        self.allow_origin = allow_origin
+        self.max_age = str(max_age).encode()
+
+    def _origin_headers(self, origin: bytes) -> list:
+        # 允许携带凭证时不能返回 "*"，回显请求的 Origin
+        allow = origin if self.allow_origin == b"*" else self.allow_origin
+        return [
+            (b"access-control-allow-origin", allow),
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for key, value in scope["headers"]:
+            if key == b"origin":
+                origin = value
+            elif key == b"access-control-request-method":
+                request_method = value
+            elif key == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        cors_headers = self._origin_headers(origin)
+
+        # 预检请求
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            headers = cors_headers + [
+                (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+                (b"access-control-max-age", self.max_age),
+                (b"content-length", b"2"),
+                (b"content-type", b"text/plain; charset=utf-8"),
+            ]
+            if request_headers:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": b"OK"})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + cors_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
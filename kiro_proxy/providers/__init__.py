@@ -1,5 +1,5 @@
 """Provider 模块"""
 from .base import BaseProvider
-from .kiro import KiroProvider
+from .kiro import KiroProvider, EventStreamParser
 
-__all__ = ["BaseProvider", "KiroProvider"]
+__all__ = ["BaseProvider", "KiroProvider", "EventStreamParser"]
@@ -1,14 +1,221 @@
 """Kiro Provider"""
-import json
+import os
+import struct
 import uuid
+from functools import lru_cache
 from typing import Dict, Any, List, Optional, Tuple
 
 from .base import BaseProvider
+from .. import jsonutil
 from ..credential import (
     KiroCredentials, TokenRefresher,
     generate_machine_id, get_kiro_version, get_system_info
 )
 
+# AWS event-stream 帧前导：total_len(4) + headers_len(4)，后接 4 字节 prelude CRC
+EVENT_PRELUDE = struct.Struct(">II")
+
+_EVENT_TYPE_HEADER = b":event-type"
+_EVENT_TYPE_HEADER_LEN = len(_EVENT_TYPE_HEADER)
+_HEADER_VALUE_LEN = struct.Struct(">H")
+# 定长 header 值的字节数（按 header value type 编号）
+_FIXED_VALUE_SIZES = {0: 0, 1: 0, 2: 1, 3: 2, 4: 4, 5: 8, 8: 8, 9: 16}
+# 关心的事件类型，其余一律视为 None
+_KNOWN_EVENT_TYPES = {
+    b"assistantResponseEvent": "assistantResponseEvent",
+    b"toolUseEvent": "toolUseEvent",
+}
+
+
+def decode_event_type(buf, start: int, end: int) -> Optional[str]:
+    """按 TLV 格式解析帧 headers，返回 :event-type（仅识别已知类型）
+
+    header 格式: name_len(1) + name + value_type(1) + value
+    字符串/字节类型的 value 带 2 字节长度前缀
+    """
+    pos = start
+    try:
+        while pos < end:
+            name_start = pos + 1
+            name_end = name_start + buf[pos]
+            value_type = buf[name_end]
+            pos = name_end + 1
+            if value_type == 7 or value_type == 6:
+                value_len = _HEADER_VALUE_LEN.unpack_from(buf, pos)[0]
+                pos += 2
+                # 先比较长度，名称不同的 header 无需切片比较
+                if (name_end - name_start == _EVENT_TYPE_HEADER_LEN
+                        and buf[name_start:name_end] == _EVENT_TYPE_HEADER):
+                    return _KNOWN_EVENT_TYPES.get(bytes(buf[pos:pos + value_len]))
+                pos += value_len
+            else:
+                size = _FIXED_VALUE_SIZES.get(value_type)
+                if size is None:
+                    return None
+                pos += size
+    except (IndexError, struct.error):
+        pass
+    return None
+
+
+def decode_frames(buf) -> Tuple[List[Tuple[Optional[str], int, int]], int]:
+    """切分缓冲区中的完整帧
+
+    返回 ([(event_type, payload_start, payload_end), ...], 已消费字节数)，
+    只给出偏移量、不复制 payload，末尾不完整的帧留待下次处理。
+    """
+    frames = []
+    pos = 0
+    end = len(buf)
+    unpack_prelude = EVENT_PRELUDE.unpack_from
+    while end - pos >= 12:
+        total_len, headers_len = unpack_prelude(buf, pos)
+        if total_len < 16:
+            break  # 帧长不足 prelude + CRC，数据已损坏，停止解析
+        if total_len > end - pos:
+            break  # 不完整的帧，等待更多数据
+
+        header_start = pos + 12
+        payload_start = header_start + headers_len
+        payload_end = pos + total_len - 4
+        if payload_start < payload_end:
+            frames.append((decode_event_type(buf, header_start, payload_start), payload_start, payload_end))
+        pos += total_len
+    return frames, pos
+
+
+class EventStreamParser:
+    """AWS event-stream 增量解析器
+
+    跨 chunk 缓存不完整的帧，每帧只解析一次：文本在 feed() 中即时返回，
+    工具调用持续累积，流结束后由 result() 汇总。
+    text_only=True 时跳过工具调用的记录，只收集文本。
+    """
+
+    def __init__(self, text_only: bool = False):
+        self.text_only = text_only
+        self._buf = bytearray()
+        self.content: List[str] = []
+        self._tools: Dict[str, dict] = {}
+
+    def feed(self, data: bytes) -> List[str]:
+        """喂入数据，返回本次新解析出的文本片段"""
+        buf = self._buf
+        if buf:
+            buf += data
+            src = buf
+        else:
+            # 没有残留数据时直接在输入 chunk 上解析，只把不完整的尾帧拷入缓冲区
+            src = data
+        texts = []
+
+        skip_tools = self.text_only
+        with memoryview(src) as mv:
+            frames, consumed = decode_frames(mv)
+            for event_type, payload_start, payload_end in frames:
+                if skip_tools and event_type == 'toolUseEvent':
+                    continue  # 只要文本时，工具事件的 payload 无需解析
+                try:
+                    payload = jsonutil.loads(mv[payload_start:payload_end])
+                except ValueError:
+                    continue
+                if isinstance(payload, dict):
+                    self._handle_event(event_type, payload, texts)
+
+        if src is buf:
+            if consumed:
+                del buf[:consumed]
+        elif consumed < len(data):
+            buf += data[consumed:]
+        return texts
+
+    def _handle_event(self, event_type: Optional[str], payload: dict, texts: List[str]):
+        """处理单个事件（字段类型不符的帧直接跳过，不中断整个流）"""
+        if 'assistantResponseEvent' in payload:
+            event = payload['assistantResponseEvent']
+            content = event.get('content') if isinstance(event, dict) else None
+        elif event_type != 'toolUseEvent':
+            content = payload.get('content')
+        else:
+            content = None
+        if content and isinstance(content, str):
+            texts.append(content)
+            self.content.append(content)
+
+        if self.text_only:
+            return
+        if event_type == 'toolUseEvent' or 'toolUseId' in payload:
+            tool_id = payload.get('toolUseId', '')
+            if not tool_id or not isinstance(tool_id, str):
+                return
+            tool = self._tools.get(tool_id)
+            if tool is None:
+                tool = self._tools[tool_id] = {"name": payload.get('name', ''), "input_parts": []}
+            elif not tool["name"]:
+                tool["name"] = payload.get('name', '')
+            tool_input = payload.get('input', '')
+            if tool_input and isinstance(tool_input, str):
+                tool["input_parts"].append(tool_input)
+
+    @property
+    def has_tool_uses(self) -> bool:
+        return bool(self._tools)
+
+    def get_tool_uses(self) -> List[dict]:
+        """汇总工具调用（Anthropic tool_use 格式）"""
+        tool_uses = []
+        for tool_id, tool in self._tools.items():
+            input_str = "".join(tool["input_parts"])
+            try:
+                input_json = jsonutil.loads(input_str)
+            except ValueError:
+                input_json = {"raw": input_str}
+            tool_uses.append({
+                "type": "tool_use",
+                "id": tool_id,
+                "name": tool["name"],
+                "input": input_json
+            })
+        return tool_uses
+
+    def result(self) -> Dict[str, Any]:
+        """返回与 KiroProvider.parse_response 相同结构的结果"""
+        tool_uses = self.get_tool_uses()
+        return {
+            "content": self.content,
+            "tool_uses": tool_uses,
+            "stop_reason": "tool_use" if tool_uses else "end_turn"
+        }
+
+
+def _uuid4_strs(count: int) -> List[str]:
+    """一次读取随机字节生成多个 UUID4 字符串（上游要求带连字符格式）"""
+    raw = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
+
+@lru_cache(maxsize=64)
+def _static_headers(agent_mode: str, machine_id: str) -> Dict[str, str]:
+    """请求头中不随请求变化的部分（按 agent_mode + machine_id 缓存）"""
+    kiro_version = get_kiro_version()
+    os_name, node_version = get_system_info()
+    return {
+        "content-type": "application/json",
+        "x-amzn-codewhisperer-optout": "true",
+        "x-amzn-kiro-agent-mode": agent_mode,
+        "x-amz-user-agent": f"aws-sdk-js/1.0.0 KiroIDE-{kiro_version}-{machine_id}",
+        "user-agent": f"aws-sdk-js/1.0.0 ua/2.1 os/{os_name} lang/js md/nodejs#{node_version} api/codewhispererruntime#1.0.0 m/E KiroIDE-{kiro_version}-{machine_id}",
+        "amz-sdk-request": "attempt=1; max=1",
+    }
+
+
+@lru_cache(maxsize=64)
+def _account_headers(agent_mode: str, machine_id: str, token: str) -> Dict[str, str]:
+    """静态请求头 + Authorization（同一账号在 token 刷新前一直命中缓存）"""
+    headers = dict(_static_headers(agent_mode, machine_id))
+    headers["Authorization"] = f"Bearer {token}"
+    return headers
+
 
 class KiroProvider(BaseProvider):
     """Kiro/CodeWhisperer Provider"""
@@ -51,20 +258,10 @@ class KiroProvider(BaseProvider):
     ) -> Dict[str, str]:
         """构建 Kiro API 请求头"""
         machine_id = kwargs.get("machine_id") or self.get_machine_id()
-        kiro_version = get_kiro_version()
-        os_name, node_version = get_system_info()
-        
-        return {
-            "content-type": "application/json",
-            "x-amzn-codewhisperer-optout": "true",
-            "x-amzn-kiro-agent-mode": agent_mode,
-            "x-amz-user-agent": f"aws-sdk-js/1.0.0 KiroIDE-{kiro_version}-{machine_id}",
-            "user-agent": f"aws-sdk-js/1.0.0 ua/2.1 os/{os_name} lang/js md/nodejs#{node_version} api/codewhispererruntime#1.0.0 m/E KiroIDE-{kiro_version}-{machine_id}",
-            "amz-sdk-invocation-id": str(uuid.uuid4()),
-            "amz-sdk-request": "attempt=1; max=1",
-            "Authorization": f"Bearer {token}",
-            "Connection": "close",
-        }
+        # 返回副本：调用方切换账号时会改写 Authorization
+        headers = _account_headers(agent_mode, machine_id, token).copy()
+        headers["amz-sdk-invocation-id"] = str(uuid.uuid4())
+        return headers
     
     def build_request(
         self,
@@ -78,7 +275,7 @@ class KiroProvider(BaseProvider):
         **kwargs
     ) -> Dict[str, Any]:
         """构建 Kiro API 请求体"""
-        conversation_id = str(uuid.uuid4())
+        conversation_id, continuation_id = _uuid4_strs(2)
         
         # 确保 content 不为空
         if not user_content:
@@ -105,7 +302,7 @@ class KiroProvider(BaseProvider):
         
         return {
             "conversationState": {
-                "agentContinuationId": str(uuid.uuid4()),
+                "agentContinuationId": continuation_id,
                 "agentTaskType": "vibe",
                 "chatTriggerType": "MANUAL",
                 "conversationId": conversation_id,
@@ -114,99 +311,15 @@ class KiroProvider(BaseProvider):
             }
         }
     
-    def parse_response(self, raw: bytes) -> Dict[str, Any]:
-        """解析 AWS event-stream 格式响应"""
-        result = {
-            "content": [],
-            "tool_uses": [],
-            "stop_reason": "end_turn"
-        }
-        
-        tool_input_buffer = {}
-        pos = 0
-        
-        while pos < len(raw):
-            if pos + 12 > len(raw):
-                break
-            
-            total_len = int.from_bytes(raw[pos:pos+4], 'big')
-            headers_len = int.from_bytes(raw[pos+4:pos+8], 'big')
-            
-            if total_len == 0 or total_len > len(raw) - pos:
-                break
-            
-            header_start = pos + 12
-            header_end = header_start + headers_len
-            headers_data = raw[header_start:header_end]
-            event_type = None
-            
-            try:
-                headers_str = headers_data.decode('utf-8', errors='ignore')
-                if 'toolUseEvent' in headers_str:
-                    event_type = 'toolUseEvent'
-                elif 'assistantResponseEvent' in headers_str:
-                    event_type = 'assistantResponseEvent'
-            except:
-                pass
-            
-            payload_start = pos + 12 + headers_len
-            payload_end = pos + total_len - 4
-            
-            if payload_start < payload_end:
-                try:
-                    payload = json.loads(raw[payload_start:payload_end].decode('utf-8'))
-                    
-                    if 'assistantResponseEvent' in payload:
-                        e = payload['assistantResponseEvent']
-                        if 'content' in e:
-                            result["content"].append(e['content'])
-                    elif 'content' in payload and event_type != 'toolUseEvent':
-                        result["content"].append(payload['content'])
-                    
-                    if event_type == 'toolUseEvent' or 'toolUseId' in payload:
-                        tool_id = payload.get('toolUseId', '')
-                        tool_name = payload.get('name', '')
-                        tool_input = payload.get('input', '')
-                        
-                        if tool_id:
-                            if tool_id not in tool_input_buffer:
-                                tool_input_buffer[tool_id] = {
-                                    "id": tool_id,
-                                    "name": tool_name,
-                                    "input_parts": []
-                                }
-                            if tool_name and not tool_input_buffer[tool_id]["name"]:
-                                tool_input_buffer[tool_id]["name"] = tool_name
-                            if tool_input:
-                                tool_input_buffer[tool_id]["input_parts"].append(tool_input)
-                except:
-                    pass
-            
-            pos += total_len
-        
-        # 组装工具调用
-        for tool_id, tool_data in tool_input_buffer.items():
-            input_str = "".join(tool_data["input_parts"])
-            try:
-                input_json = json.loads(input_str)
-            except:
-                input_json = {"raw": input_str}
-            
-            result["tool_uses"].append({
-                "type": "tool_use",
-                "id": tool_data["id"],
-                "name": tool_data["name"],
-                "input": input_json
-            })
-        
-        if result["tool_uses"]:
-            result["stop_reason"] = "tool_use"
-        
-        return result
+    def parse_response(self, raw: bytes, text_only: bool = False) -> Dict[str, Any]:
+        """解析 AWS event-stream 格式响应（text_only 时不解析工具调用）"""
+        parser = EventStreamParser(text_only=text_only)
+        parser.feed(raw)
+        return parser.result()
     
     def parse_response_text(self, raw: bytes) -> str:
         """解析响应，只返回文本内容"""
-        result = self.parse_response(raw)
+        result = self.parse_response(raw, text_only=True)
         return "".join(result["content"]) or "[No response]"
     
     async def refresh_token(self) -> Tuple[bool, str]:
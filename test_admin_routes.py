@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""测试管理 API：所有无路径参数的 GET 接口都能正常序列化响应，无需启动代理"""
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+
+from kiro_proxy.main import app
+from kiro_proxy.core import stats_manager
+
+
+def _admin_get_paths():
+    return [
+        route.path for route in app.routes
+        if isinstance(route, APIRoute) and "GET" in route.methods
+        and route.path.startswith("/api/") and "{" not in route.path
+    ]
+
+
+def test_admin_get_routes():
+    print("1. 逐个请求 GET 管理接口...")
+    # 先产生统计数据，hourly_requests 等字段非空时才会覆盖到序列化问题
+    stats_manager.record_request(account_id="test", model="claude-sonnet-4", success=True, latency_ms=10)
+    client = TestClient(app)
+    for path in _admin_get_paths():
+        r = client.get(path)
+        assert r.status_code == 200, f"{path}: {r.status_code} {r.text[:200]}"
+        r.json()
+        print(f"   ✅ {path}")
+
+
+def test_stats_hourly_keys():
+    print("\n2. hourly_requests 的键为字符串...")
+    stats_manager.record_request(account_id="test", model="claude-sonnet-4", success=True, latency_ms=10)
+    r = TestClient(app).get("/api/stats/detailed")
+    assert r.status_code == 200
+    hourly = r.json()["detailed"]["hourly_requests"]
+    assert hourly and all(k.isdigit() for k in hourly)
+    print(f"   ✅ {hourly}")
+
+
+def test_logs_limit():
+    print("\n3. /api/logs 的 limit 参数校验...")
+    client = TestClient(app)
+    assert client.get("/api/logs?limit=0").json()["logs"] == []
+    assert client.get("/api/logs?limit=-1").status_code == 422
+    assert client.get("/api/logs?limit=5000").status_code == 200
+    print("   ✅ 通过")
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("管理 API 测试")
+    print("=" * 50)
+    test_admin_get_routes()
+    test_stats_hourly_keys()
+    test_logs_limit()
+    print("\n" + "=" * 50)
+    print("全部通过")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""测试 EventStreamParser（AWS event-stream 增量解析），无需启动代理"""
+
+import json
+import struct
+import zlib
+
+from kiro_proxy.providers.kiro import EventStreamParser
+
+
+def _header(name, value):
+    """编码单个字符串类型（7）的头"""
+    n = name.encode()
+    v = value.encode()
+    return bytes([len(n)]) + n + bytes([7]) + struct.pack(">H", len(v)) + v
+
+
+def make_frame(event_type, payload):
+    """按 event-stream 格式编码一帧：prelude + CRC + 头 + payload + CRC"""
+    headers = (
+        _header(":event-type", event_type)
+        + _header(":content-type", "application/json")
+        + _header(":message-type", "event")
+    )
+    body = json.dumps(payload).encode()
+    prelude = struct.pack(">II", 12 + len(headers) + len(body) + 4, len(headers))
+    prelude += struct.pack(">I", zlib.crc32(prelude))
+    frame = prelude + headers + body
+    return frame + struct.pack(">I", zlib.crc32(frame))
+
+
+def sample_stream():
+    return (
+        make_frame("assistantResponseEvent", {"content": "Hello "})
+        + make_frame("assistantResponseEvent", {"content": "世界"})
+        + make_frame("toolUseEvent", {"toolUseId": "t1", "name": "get_weather", "input": '{"city":'})
+        + make_frame("toolUseEvent", {"toolUseId": "t1", "input": '"北京"}'})
+        + make_frame("toolUseEvent", {"toolUseId": "t1", "stop": True})
+    )
+
+
+def test_whole_stream():
+    print("1. 一次喂入完整数据...")
+    parser = EventStreamParser()
+    assert parser.feed(sample_stream()) == ["Hello ", "世界"]
+    result = parser.result()
+    assert "".join(result["content"]) == "Hello 世界"
+    assert result["stop_reason"] == "tool_use"
+    assert result["tool_uses"] == [
+        {"type": "tool_use", "id": "t1", "name": "get_weather", "input": {"city": "北京"}}
+    ]
+    print("   ✅ 通过")
+
+
+def test_split_across_chunks():
+    print("\n2. 帧跨 chunk 拆分（逐字节 / 不规则切分）...")
+    data = sample_stream()
+    expected = EventStreamParser()
+    expected.feed(data)
+
+    for step in (1, 3, 7, 50):
+        parser = EventStreamParser()
+        texts = []
+        for i in range(0, len(data), step):
+            texts.extend(parser.feed(data[i:i + step]))
+        assert texts == ["Hello ", "世界"], step
+        assert parser.result() == expected.result(), step
+    print("   ✅ 通过")
+
+
+def test_text_only():
+    print("\n3. text_only 模式跳过工具调用...")
+    parser = EventStreamParser(text_only=True)
+    assert parser.feed(sample_stream()) == ["Hello ", "世界"]
+    assert not parser.has_tool_uses
+    result = parser.result()
+    assert result["tool_uses"] == []
+    assert result["stop_reason"] == "end_turn"
+    print("   ✅ 通过")
+
+
+def test_tool_use_reassembly():
+    print("\n4. 多个工具调用的 input 分片拼接...")
+    data = (
+        make_frame("toolUseEvent", {"toolUseId": "a", "name": "read", "input": '{"path":'})
+        + make_frame("toolUseEvent", {"toolUseId": "b", "name": "list", "input": '{}'})
+        + make_frame("toolUseEvent", {"toolUseId": "a", "input": '"/tmp/x"}'})
+        + make_frame("toolUseEvent", {"toolUseId": "c", "name": "broken", "input": '{"x":'})
+    )
+    parser = EventStreamParser()
+    assert parser.feed(data) == []
+    tools = {t["id"]: t for t in parser.get_tool_uses()}
+    assert tools["a"]["name"] == "read" and tools["a"]["input"] == {"path": "/tmp/x"}
+    assert tools["b"]["name"] == "list" and tools["b"]["input"] == {}
+    # input 不是合法 JSON 时保留原文
+    assert tools["c"]["input"] == {"raw": '{"x":'}
+    print("   ✅ 通过")
+
+
+def test_truncated_trailing_frame():
+    print("\n5. 流末尾不完整的帧被缓存而不是误解析...")
+    first = make_frame("assistantResponseEvent", {"content": "完整"})
+    last = make_frame("assistantResponseEvent", {"content": "被截断"})
+    parser = EventStreamParser()
+    assert parser.feed(first + last[:-5]) == ["完整"]
+    assert parser.result()["content"] == ["完整"]
+    # 剩余字节到达后这一帧才被解析
+    assert parser.feed(last[-5:]) == ["被截断"]
+    assert parser.result()["content"] == ["完整", "被截断"]
+    print("   ✅ 通过")
+
+
+def test_malformed_payloads():
+    print("\n6. 字段类型不符的帧被跳过，不中断解析...")
+    data = (
+        make_frame("assistantResponseEvent", {"assistantResponseEvent": "x"})
+        + make_frame("toolUseEvent", {"toolUseId": ["x"], "name": "bad"})
+        + make_frame("assistantResponseEvent", {"content": {"text": "不是字符串"}})
+        + make_frame("toolUseEvent", {"toolUseId": "t1", "name": "ok", "input": {"a": 1}})
+        + make_frame("assistantResponseEvent", {"content": "正常"})
+    )
+    parser = EventStreamParser()
+    assert parser.feed(data) == ["正常"]
+    result = parser.result()
+    assert result["content"] == ["正常"]
+    assert [t["id"] for t in result["tool_uses"]] == ["t1"]
+    print("   ✅ 通过")
+
+
+def test_corrupt_frame_length():
+    print("\n7. 帧长度损坏时停止解析，不把后续字节当作新帧...")
+    good = make_frame("assistantResponseEvent", {"content": "之前"})
+    for total_len in (0, 8, 15):
+        corrupt = struct.pack(">II", total_len, 0) + b"\0" * 4
+        parser = EventStreamParser()
+        assert parser.feed(good + corrupt + good) == ["之前"], total_len
+        assert parser.result()["content"] == ["之前"], total_len
+    print("   ✅ 通过")
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("EventStreamParser 测试")
+    print("=" * 50)
+    test_whole_stream()
+    test_split_across_chunks()
+    test_text_only()
+    test_tool_use_reassembly()
+    test_truncated_trailing_frame()
+    test_malformed_payloads()
+    test_corrupt_frame_length()
+    print("\n" + "=" * 50)
+    print("全部通过")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""测试 HistoryManager.dedupe_tool_results（重复工具结果去重），无需启动代理"""
+
+import copy
+
+from kiro_proxy.core.history_manager import (
+    HistoryManager, HistoryConfig, DUPLICATE_TOOL_RESULT_PLACEHOLDER,
+)
+
+BIG = "x" * 2000
+
+
+def _tool_result(tool_id, text):
+    return {"toolUseId": tool_id, "status": "success", "content": [{"text": text}]}
+
+
+def _user(*results):
+    return {"userInputMessage": {
+        "content": "Tool results provided.",
+        "userInputMessageContext": {"toolResults": list(results)},
+    }}
+
+
+def _assistant(text="ok"):
+    return {"assistantResponseMessage": {"content": text}}
+
+
+def _result_texts(msg):
+    return [tr["content"][0]["text"] for tr in msg["userInputMessage"]["userInputMessageContext"]["toolResults"]]
+
+
+def test_keeps_last_occurrence():
+    print("1. 历史中的重复结果只保留最后一次...")
+    history = [
+        _user(_tool_result("t1", BIG), _tool_result("t2", "short")),
+        _assistant(),
+        _user(_tool_result("t3", BIG)),
+        _assistant(),
+    ]
+    snapshot = copy.deepcopy(history)
+    result = HistoryManager(HistoryConfig()).dedupe_tool_results(history)
+
+    assert _result_texts(result[0]) == [DUPLICATE_TOOL_RESULT_PLACEHOLDER, "short"]
+    assert _result_texts(result[2]) == [BIG]
+    # toolUseId/status 保留，只替换 content
+    replaced = result[0]["userInputMessage"]["userInputMessageContext"]["toolResults"][0]
+    assert replaced["toolUseId"] == "t1" and replaced["status"] == "success"
+    # 传入的列表和字典不被修改，未改动的消息复用原对象
+    assert history == snapshot
+    assert result is not history
+    assert result[0] is not history[0]
+    assert result[1] is history[1] and result[2] is history[2]
+    print("   ✅ 通过")
+
+
+def test_current_tool_results():
+    print("\n2. 当前轮的 tool_results 视为最后一次出现...")
+    history = [_user(_tool_result("t1", BIG)), _assistant()]
+    current = [_tool_result("t2", BIG)]
+    snapshot = copy.deepcopy((history, current))
+    result = HistoryManager(HistoryConfig()).dedupe_tool_results(history, current)
+
+    assert _result_texts(result[0]) == [DUPLICATE_TOOL_RESULT_PLACEHOLDER]
+    assert (history, current) == snapshot
+    print("   ✅ 通过")
+
+
+def test_no_duplicates():
+    print("\n3. 没有重复 / 低于阈值 / 关闭时原样返回...")
+    manager = HistoryManager(HistoryConfig())
+    history = [_user(_tool_result("t1", BIG)), _assistant(), _user(_tool_result("t2", "y" * 2000))]
+    assert manager.dedupe_tool_results(history) is history
+
+    small = [_user(_tool_result("t1", "short")), _assistant(), _user(_tool_result("t2", "short"))]
+    assert manager.dedupe_tool_results(small) is small
+
+    dup = [_user(_tool_result("t1", BIG)), _assistant(), _user(_tool_result("t2", BIG))]
+    disabled = HistoryManager(HistoryConfig(dedupe_tool_results=False))
+    assert disabled.dedupe_tool_results(dup) is dup
+    print("   ✅ 通过")
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("工具结果去重测试")
+    print("=" * 50)
+    test_keeps_last_occurrence()
+    test_current_tool_results()
+    test_no_duplicates()
+    print("\n" + "=" * 50)
+    print("全部通过")